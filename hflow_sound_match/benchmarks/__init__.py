@@ -0,0 +1,11 @@
+"""性能基准
+#################################################
+不依赖正式音乐库：先生成一个符合 music_filename_template 的合成音乐库，再测量两版session。
+
+    python -m hflow_sound_match.benchmarks.library --out /tmp/hflow_lib --format wav
+    python -m hflow_sound_match.benchmarks.run --library /tmp/hflow_lib --out bench.json
+    python -m hflow_sound_match.benchmarks.run --library /tmp/hflow_lib --compare bench.json
+
+单机容量（并发心率流逐级加压，见loadtest）：
+    python -m hflow_sound_match.benchmarks.loadtest --library /tmp/hflow_lib --sessions 8 16 32 64 --speed 10
+"""
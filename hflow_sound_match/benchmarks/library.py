@@ -0,0 +1,127 @@
+"""合成音乐库
+#################################################
+按正式库的目录结构生成音频：
+    01 环境文件/env_XX.{fmt}                       噪声底（L0）
+    02 平静 / 03 愉悦 / 04 催眠/{no}_{bpm}_{class}_L{layer}.{fmt}   按bpm打拍的和弦（L1/L2）
+
+文件数量、时长、格式、采样格式都可配置，同样的参数和seed生成同样的库。
+python -m hflow_sound_match.benchmarks.library --out /tmp/hflow_lib --files-per-emotion 12 --format wav
+"""
+import os
+import json
+import argparse
+import numpy as np
+from pydub import AudioSegment
+from loguru import logger
+from ..config import cfg
+from ..utils import Emotion, FilesHelper
+
+MANIFEST_NAME = 'synthetic_library.json'
+
+
+def emotion_folder_names():
+    """{情绪: 目录名}，与 FilesHelper.get_emotion_root_by_emotion 一致"""
+    return {
+        emotion: os.path.relpath(FilesHelper.get_emotion_root_by_emotion(emotion), cfg['sound_folders_root'])
+        for emotion in (Emotion.peaceful, Emotion.happy, Emotion.sleepy)
+    }
+
+
+def _to_segment(samples, frame_rate, channels):
+    samples = np.clip(samples, -1.0, 1.0)
+    pcm = (samples * 32767).astype('<i2')
+    if channels > 1:
+        pcm = np.repeat(pcm[:, None], channels, axis=1)
+    return AudioSegment(pcm.tobytes(), frame_rate=frame_rate, sample_width=2, channels=channels)
+
+
+def synth_music(bpm, layer, duration_s, frame_rate, rng):
+    """以bpm为节拍包络的和弦，不同layer用不同音高"""
+    t = np.arange(int(duration_s * frame_rate)) / frame_rate
+    root = rng.uniform(110, 220) * layer
+    tone = sum(np.sin(2 * np.pi * root * ratio * t) / (i + 1) for i, ratio in enumerate((1.0, 1.25, 1.5, 2.0)))
+    beat = 0.6 + 0.4 * np.cos(np.pi * t * bpm / 60) ** 2
+    return 0.2 * tone * beat
+
+
+def synth_environment(duration_s, frame_rate, rng):
+    """平滑过的白噪声"""
+    noise = rng.standard_normal(int(duration_s * frame_rate))
+    kernel = np.ones(32) / 32
+    return 0.3 * np.convolve(noise, kernel, mode='same')
+
+
+def generate_library(out, files_per_emotion=6, layers=(1, 2), bpm_range=(55, 120), duration_s=(35, 60),
+                     env_files=2, env_duration_s=60, fmt='mp3', frame_rate=44100, channels=2, seed=0,
+                     overwrite=False):
+    """生成合成音乐库，返回清单（同时写到 out/synthetic_library.json）；已存在的文件默认跳过"""
+    rng = np.random.default_rng(seed)
+    params = {
+        'files_per_emotion': files_per_emotion, 'layers': list(layers), 'bpm_range': list(bpm_range),
+        'duration_s': list(duration_s), 'env_files': env_files, 'env_duration_s': env_duration_s, 'format': fmt,
+        'frame_rate': frame_rate, 'channels': channels, 'seed': seed,
+    }
+    files = []
+
+    def write(path, make_samples):
+        # 无论是否跳过都消耗随机数，保证同一seed下每个文件的内容固定
+        samples = make_samples()
+        if overwrite or not os.path.exists(path):
+            _to_segment(samples, frame_rate, channels).export(path, format=fmt)
+        files.append(os.path.relpath(path, out))
+
+    env_folder = os.path.join(out, os.path.basename(FilesHelper.L0_folder))
+    os.makedirs(env_folder, exist_ok=True)
+    for no in range(env_files):
+        write(os.path.join(env_folder, 'env_{:02d}.{}'.format(no, fmt)),
+              lambda: synth_environment(env_duration_s, frame_rate, rng))
+
+    for emotion, folder_name in emotion_folder_names().items():
+        folder = os.path.join(out, folder_name)
+        os.makedirs(folder, exist_ok=True)
+        bpms = np.sort(rng.integers(bpm_range[0], bpm_range[1] + 1, files_per_emotion))
+        for no, bpm in enumerate(bpms):
+            duration = rng.uniform(*duration_s)
+            for layer in layers:
+                # music_filename_template: '{no}_{bpm}_{class}_{layer}.mp3'
+                base_file = '{:02d}_{}_{}_L{}.{}'.format(no, bpm, emotion, layer, fmt)
+                write(os.path.join(folder, base_file),
+                      lambda: synth_music(int(bpm), layer, duration, frame_rate, rng))
+
+    manifest = {'params': params, 'files': files}
+    with open(os.path.join(out, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    logger.info('synthetic library: {} files in {}'.format(len(files), out))
+    return manifest
+
+
+def add_library_arguments(parser):
+    parser.add_argument('--files-per-emotion', type=int, default=6)
+    parser.add_argument('--layers', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--bpm-range', type=int, nargs=2, default=[55, 120])
+    parser.add_argument('--duration', type=float, nargs=2, default=[35, 60], help='min/max seconds of L1/L2 files')
+    parser.add_argument('--env-files', type=int, default=2)
+    parser.add_argument('--env-duration', type=float, default=60)
+    parser.add_argument('--format', default='mp3', help='any format ffmpeg can write, e.g. mp3/wav/flac')
+    parser.add_argument('--frame-rate', type=int, default=44100)
+    parser.add_argument('--channels', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def library_kwargs(args):
+    return dict(files_per_emotion=args.files_per_emotion, layers=args.layers, bpm_range=args.bpm_range,
+                duration_s=args.duration, env_files=args.env_files, env_duration_s=args.env_duration,
+                fmt=args.format, frame_rate=args.frame_rate, channels=args.channels, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='generate a synthetic sound library for benchmarks')
+    parser.add_argument('--out', required=True)
+    parser.add_argument('--overwrite', action='store_true')
+    add_library_arguments(parser)
+    args = parser.parse_args()
+    generate_library(args.out, overwrite=args.overwrite, **library_kwargs(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,400 @@
+"""负载测试：N个并发心率流
+#################################################
+逐级增加session数（--sessions 8 16 32 ...），每一级运行 --level-seconds 秒，记录：
+    - throughput: 每秒生成的片段数、音频秒数
+    - tick_ms: match_and_generate 耗时的 p50/p95/p99（metrics的tick阶段回调）
+    - misses: 没能在当前片段播放完之前交付下一个片段的次数（播放端断音）
+    - switches_per_session_min: 每个session每分钟的L1/L2切换次数
+    - cpu_cores: 进程CPU时间 / 墙钟时间；rss_bytes: 常驻内存
+最后给出容量报告：p99 tick耗时不超过片段预算（transport_time）且断音比例不超过 --max-miss-rate 的最大session数。
+
+两种模式：
+    inproc  session由scheduler.TickScheduler按截止时间驱动。时钟可以加速（--speed 10 表示每个片段的预算是
+            transport_time/10 秒），N个session在speed倍速下的负载相当于 N*speed 个实时用户。
+    server  在本进程中启动serve.StreamServer（随机端口），N个客户端通过HTTP创建session、写入心率、
+            拉取pcm流，按收到的音频时长模拟播放并统计断音。只能实时运行，客户端本身也占用本进程的CPU。
+
+心率来自 --traces（csv/npy，格式见render.load_trace，循环使用）或固定seed的随机游走，
+音乐库可以用 --generate 离线生成，整个测试不依赖外部服务：
+    python -m hflow_sound_match.benchmarks.loadtest --library /tmp/hflow_lib --generate --sessions 8 16 32 --speed 10
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import resource
+import threading
+import numpy as np
+from loguru import logger
+from .run import rss_bytes, summarize, heart_rate_trace, git_revision
+
+
+class Recorder:
+    """一级测试期间通过metrics回调收集tick耗时与切换次数，以及进程CPU时间"""
+
+    def __init__(self):
+        self.ticks = []
+        self.counters = {}
+        self.wall = self.cpu = 0.0
+
+    def __call__(self, kind, name, value):
+        if kind == 'stage' and name == 'tick':
+            self.ticks.append(value)
+        elif kind == 'counter':
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @staticmethod
+    def cpu_seconds():
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_utime + usage.ru_stime
+
+    def __enter__(self):
+        from ..metrics import metrics
+        self._enabled = metrics.enabled
+        metrics.enable()
+        metrics.add_callback(self)
+        self._wall, self._cpu = time.perf_counter(), self.cpu_seconds()
+        return self
+
+    def __exit__(self, *exc):
+        from ..metrics import metrics
+        self.wall = time.perf_counter() - self._wall
+        self.cpu = self.cpu_seconds() - self._cpu
+        metrics.remove_callback(self)
+        metrics.enabled = self._enabled
+
+    def result(self, sessions, audio_seconds, segments, sim_seconds):
+        switches = self.counters.get('l1_switch', 0) + self.counters.get('l2_switch', 0)
+        return {
+            'sessions': sessions,
+            'wall_seconds': round(self.wall, 3),
+            'segments': segments,
+            'segments_per_second': round(segments / self.wall, 3) if self.wall else None,
+            'audio_seconds_per_second': round(audio_seconds / self.wall, 3) if self.wall else None,
+            'tick_ms': summarize(self.ticks),
+            'switches': {'l1': self.counters.get('l1_switch', 0), 'l2': self.counters.get('l2_switch', 0)},
+            'switches_per_session_min': round(switches / sessions / (sim_seconds / 60), 3) if sim_seconds else None,
+            'cpu_cores': round(self.cpu / self.wall, 3) if self.wall else None,
+            'rss_bytes': rss_bytes(),
+        }
+
+
+# ---------------------------------------------------------- 心率轨迹
+def load_traces(paths, transport_time):
+    """[(相对时间戳, 心率), ...]；没有时间戳的轨迹每个心率对应一个tick"""
+    from ..render import load_trace
+    traces = []
+    for path in paths:
+        timestamps, heart_rates = load_trace(path)
+        if timestamps is None:
+            timestamps = np.arange(len(heart_rates)) * transport_time
+        traces.append((np.asarray(timestamps) - timestamps[0], np.asarray(heart_rates, dtype=np.float64)))
+    return traces
+
+
+def synthetic_traces(count, seed, transport_time, ticks=360):
+    return [(np.arange(ticks) * transport_time, np.asarray(heart_rate_trace(ticks, seed + i), dtype=np.float64))
+            for i in range(count)]
+
+
+def heart_rate_at(trace, seconds):
+    """轨迹在seconds时刻的心率（超出长度后循环）"""
+    timestamps, heart_rates = trace
+    duration = timestamps[-1] + (timestamps[1] - timestamps[0] if len(timestamps) > 1 else 1)
+    index = np.searchsorted(timestamps, seconds % duration, side='right') - 1
+    return float(heart_rates[max(index, 0)])
+
+
+# ---------------------------------------------------------- inproc
+def run_level_inproc(sessions, duration, traces, speed=1.0, workers=None, lead_ms=2000, hr_interval=1.0,
+                     session_kwargs=None):
+    from ..config import cfg
+    from ..pool import SessionPool
+    from ..scheduler import TickScheduler
+    m0, t0 = time.monotonic(), time.time()
+
+    def clock():
+        return t0 + (time.monotonic() - m0) * speed
+
+    pool = SessionPool(clock=clock, **(session_kwargs or {}))
+    scheduler = TickScheduler(workers=workers, lead_ms=lead_ms, clock=clock)
+    delivered = {'segments': 0, 'audio_ms': 0}
+    lock = threading.Lock()
+
+    def on_segment(session_id, segment):
+        with lock:
+            delivered['segments'] += 1
+            delivered['audio_ms'] += len(segment)
+
+    items = []
+    for i in range(sessions):
+        session_id = pool.create()
+        trace = traces[i % len(traces)]
+        pool.get(session_id).push_heart_rate(heart_rate_at(trace, 0))
+        items.append((session_id, trace))
+    stop = threading.Event()
+
+    def feed():
+        """每hr_interval（模拟时间）给所有session写入一次心率"""
+        step = 1
+        while not stop.wait(max(0.0, m0 + step * hr_interval / speed - time.monotonic())):
+            for session_id, trace in items:
+                pool.get(session_id).push_heart_rate(heart_rate_at(trace, step * hr_interval))
+            step += 1
+
+    feeder = threading.Thread(target=feed, name='hflow-loadtest-hr', daemon=True)
+    with Recorder() as recorder:
+        # 用户陆续进入：开始播放的时刻在一个片段时长内错开，否则所有session的截止时间永远挤在同一时刻
+        start = clock() + lead_ms / 1000
+        for i, (session_id, _) in enumerate(items):
+            scheduler.add(session_id, pool.get(session_id), on_segment=on_segment,
+                          start=start + i * cfg['transport_time'] / sessions)
+        scheduler.start()
+        feeder.start()
+        time.sleep(duration)
+        stop.set()
+        scheduler.stop()
+    feeder.join()
+    report = scheduler.report()
+    pool.retire_all()
+    result = recorder.result(sessions, delivered['audio_ms'] / 1000, delivered['segments'], duration * speed)
+    result.update({
+        'mode': 'inproc',
+        'speed': speed,
+        'realtime_users': round(sessions * speed, 1),
+        'budget_ms': round(1000 * cfg['transport_time'] / speed, 3),
+        'misses': report['misses'],
+        'miss_rate': report['miss_rate'],
+        'slack_ms': report['slack_ms'],
+        'decodes': report['decodes'],
+    })
+    return result
+
+
+# ---------------------------------------------------------- server
+async def _request(port, method, path, body=b''):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        writer.write('{} {} HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Length: {}\r\n\r\n'.format(
+            method, path, len(body)).encode('latin-1') + body)
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    head, _, payload = response.partition(b'\r\n\r\n')
+    return int(head.split(b' ', 2)[1]), payload
+
+
+async def _listen(port, session_id, bytes_per_ms, prebuffer_ms, stats):
+    """拉取pcm流并模拟播放：收到prebuffer_ms之后开始播放，播放位置追上已收到的音频即为一次断音"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    loop = asyncio.get_running_loop()
+    try:
+        writer.write('GET /sessions/{}/stream?fmt=pcm HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n'.format(
+            session_id).encode('latin-1'))
+        await writer.drain()
+        while (await reader.readline()) not in (b'\r\n', b''):
+            pass
+        received_ms, started_at, stalled_ms = 0.0, None, 0.0
+        while True:
+            size = int((await reader.readline()).strip() or b'0', 16)
+            if size == 0:
+                return
+            data = await reader.readexactly(size + 2)
+            now = loop.time()
+            if started_at is not None:
+                position = 1000 * (now - started_at) - stalled_ms
+                if position > received_ms:
+                    stats['stalls'] += 1
+                    stalled_ms += position - received_ms
+            received_ms += (len(data) - 2) / bytes_per_ms
+            stats['audio_ms'] += (len(data) - 2) / bytes_per_ms
+            if started_at is None and received_ms >= prebuffer_ms:
+                started_at = now
+    finally:
+        writer.close()
+
+
+async def _feed(port, session_id, trace, hr_interval):
+    step = 0
+    while True:
+        body = json.dumps(heart_rate_at(trace, step * hr_interval)).encode('utf-8')
+        await _request(port, 'POST', '/sessions/{}/hr'.format(session_id), body)
+        step += 1
+        await asyncio.sleep(hr_interval)
+
+
+async def _run_level_server(sessions, duration, traces, workers, lead_ms, hr_interval, session_kwargs):
+    from ..config import cfg
+    from ..pcm_store import profile_format, DEFAULT_FORMAT
+    from ..serve import StreamServer
+    fmt = profile_format((session_kwargs or {}).get('profile')) or DEFAULT_FORMAT
+    bytes_per_ms = fmt['frame_rate'] * fmt['channels'] * fmt['sample_width'] / 1000
+    server = StreamServer('127.0.0.1', 0, max_workers=workers or os.cpu_count() or 1, max_sessions=sessions,
+                          lead_ms=lead_ms, **(session_kwargs or {}))
+    await server.start()
+    port = server.server.sockets[0].getsockname()[1]
+    stats = {'stalls': 0, 'audio_ms': 0.0}
+    tasks = []
+    try:
+        with Recorder() as recorder:
+            for i in range(sessions):
+                status, payload = await _request(port, 'POST', '/sessions')
+                assert status == 201, payload
+                session_id = json.loads(payload)['session_id']
+                trace = traces[i % len(traces)]
+                tasks.append(asyncio.ensure_future(_feed(port, session_id, trace, hr_interval)))
+                tasks.append(asyncio.ensure_future(_listen(port, session_id, bytes_per_ms, lead_ms / 2, stats)))
+            await asyncio.sleep(duration)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        await server.shutdown()
+    segments = len(recorder.ticks)
+    result = recorder.result(sessions, stats['audio_ms'] / 1000, segments, duration)
+    result.update({
+        'mode': 'server',
+        'speed': 1.0,
+        'realtime_users': float(sessions),
+        'budget_ms': 1000.0 * cfg['transport_time'],
+        'misses': stats['stalls'],
+        'miss_rate': round(stats['stalls'] / segments, 4) if segments else None,
+    })
+    return result
+
+
+def run_level_server(sessions, duration, traces, workers=None, lead_ms=2000, hr_interval=1.0, session_kwargs=None):
+    return asyncio.run(_run_level_server(sessions, duration, traces, workers, lead_ms, hr_interval, session_kwargs))
+
+
+# ---------------------------------------------------------- 报告
+def evaluate(level, max_miss_rate=0.01):
+    """这一级是否在容量之内，返回不满足的条件列表"""
+    failures = []
+    p99 = level['tick_ms'].get('p99')
+    if p99 is not None and p99 > level['budget_ms']:
+        failures.append('p99 tick {}ms > budget {}ms'.format(p99, level['budget_ms']))
+    if level['miss_rate'] is not None and level['miss_rate'] > max_miss_rate:
+        failures.append('miss rate {} > {}'.format(level['miss_rate'], max_miss_rate))
+    if not level['segments']:
+        failures.append('no segments delivered')
+    return failures
+
+
+def run_loadtest(levels, mode='inproc', duration=30, traces=None, speed=1.0, workers=None, lead_ms=2000,
+                 hr_interval=1.0, max_miss_rate=0.01, stop_on_failure=True, session_kwargs=None, seed=0):
+    from ..config import cfg
+    if not traces:
+        traces = synthetic_traces(max(levels), seed, cfg['transport_time'])
+    random.seed(seed)
+    results, capacity = [], None
+    for sessions in levels:
+        logger.info('loadtest: {} sessions ({})'.format(sessions, mode))
+        if mode == 'server':
+            level = run_level_server(sessions, duration, traces, workers, lead_ms, hr_interval, session_kwargs)
+        else:
+            level = run_level_inproc(sessions, duration, traces, speed, workers, lead_ms, hr_interval,
+                                     session_kwargs)
+        level['failures'] = evaluate(level, max_miss_rate)
+        results.append(level)
+        if not level['failures']:
+            capacity = level
+        elif stop_on_failure:
+            break
+    return {
+        'meta': {
+            'revision': git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'cpu_count': os.cpu_count(),
+            'mode': mode,
+            'duration': duration,
+            'speed': speed if mode == 'inproc' else 1.0,
+            'transport_time': cfg['transport_time'],
+            'max_miss_rate': max_miss_rate,
+            'session_kwargs': session_kwargs or {},
+        },
+        'levels': results,
+        'capacity': {
+            'sessions': capacity['sessions'],
+            'realtime_users': capacity['realtime_users'],
+            'tick_p99_ms': capacity['tick_ms'].get('p99'),
+            'cpu_cores': capacity['cpu_cores'],
+            'rss_bytes': capacity['rss_bytes'],
+        } if capacity is not None else None,
+    }
+
+
+def format_report(report):
+    lines = ['{:>8} {:>10} {:>9} {:>9} {:>9} {:>9} {:>8} {:>9} {:>6} {:>8}  {}'.format(
+        'sessions', 'users', 'seg/s', 'p50 ms', 'p95 ms', 'p99 ms', 'misses', 'sw/min', 'cpu', 'rss MB', 'status')]
+    for level in report['levels']:
+        ticks = level['tick_ms']
+        lines.append('{:>8} {:>10} {:>9} {:>9} {:>9} {:>9} {:>8} {:>9} {:>6} {:>8.1f}  {}'.format(
+            level['sessions'], level['realtime_users'], level['segments_per_second'], ticks.get('p50', '-'),
+            ticks.get('p95', '-'), ticks.get('p99', '-'), level['misses'], level['switches_per_session_min'],
+            level['cpu_cores'], level['rss_bytes'] / 2 ** 20, '; '.join(level['failures']) or 'ok'))
+    capacity = report['capacity']
+    if capacity is None:
+        lines.append('capacity: below the first level')
+    else:
+        lines.append('capacity: {sessions} sessions (~{realtime_users} realtime users), p99 tick {tick_p99_ms} ms, '
+                     '{cpu_cores} cores, {mb:.1f} MB RSS'.format(mb=capacity['rss_bytes'] / 2 ** 20, **capacity))
+    return '\n'.join(lines)
+
+
+def main():
+    from .library import generate_library, add_library_arguments, library_kwargs
+    parser = argparse.ArgumentParser(description='ramp up concurrent heart-rate streams and report node capacity')
+    parser.add_argument('--library', required=True, help='sound folders root to test against')
+    parser.add_argument('--generate', action='store_true', help='generate a synthetic library into --library first')
+    parser.add_argument('--mode', choices=('inproc', 'server'), default='inproc')
+    parser.add_argument('--sessions', type=int, nargs='+', default=[8, 16, 32, 64, 128])
+    parser.add_argument('--level-seconds', type=float, default=30, help='wall-clock seconds per level')
+    parser.add_argument('--speed', type=float, default=1.0, help='inproc only: simulated time speed-up')
+    parser.add_argument('--workers', type=int, default=None, help='tick threads, defaults to cpu count')
+    parser.add_argument('--lead-ms', type=int, default=2000)
+    parser.add_argument('--hr-interval', type=float, default=1.0, help='seconds between heart rate samples')
+    parser.add_argument('--traces', nargs='*', default=None, help='heart rate traces (csv / npy), cycled')
+    parser.add_argument('--max-miss-rate', type=float, default=0.01)
+    parser.add_argument('--no-stop', action='store_true', help='keep ramping after a level fails')
+    parser.add_argument('--no-warm', action='store_true', help='do not preload the library before the first level')
+    parser.add_argument('--mix-backend', choices=('pydub', 'numpy'), default='numpy')
+    parser.add_argument('--tiles', action='store_true')
+    parser.add_argument('--mix-cache', action='store_true')
+    parser.add_argument('--profile', default=None, help='quality profile from config quality_profiles')
+    parser.add_argument('--out', default=None, help='write the report as json')
+    add_library_arguments(parser)
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level='INFO', filter=lambda record: record['name'].startswith(__name__))
+    logger.add(sys.stderr, level='WARNING', filter=lambda record: not record['name'].startswith(__name__))
+    if args.generate:
+        generate_library(args.library, **library_kwargs(args))
+    from ..config import cfg
+    from ..catalog import sound_catalog
+    cfg['sound_folders_root'] = os.path.abspath(args.library)
+    cfg['library_file_formats'] = [args.format]
+    sound_catalog.file_formats = (args.format,)
+    if not args.no_warm:
+        from ..workers import warm_up
+        logger.info('loadtest: warm up {}'.format(warm_up(profiles=(args.profile,))['seconds']))
+
+    traces = load_traces(args.traces, cfg['transport_time']) if args.traces else None
+    session_kwargs = {'mix_backend': args.mix_backend, 'tiles': args.tiles, 'mix_cache': args.mix_cache,
+                      'profile': args.profile}
+    report = run_loadtest(sorted(args.sessions), args.mode, args.level_seconds, traces, args.speed, args.workers,
+                          args.lead_ms, args.hr_interval, args.max_miss_rate, not args.no_stop, session_kwargs,
+                          args.seed)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+    print(format_report(report))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+"""session基准测试
+#################################################
+对每个variant（RelaxMusicSession / RelaxMusicSessionV2 的不同参数）在独立的子进程中测量：
+    - construct_ms: session构造耗时（第一个是冷启动，含L0解码）
+    - tick_ms:      每次 match_and_generate 的耗时
+    - switch_ms:    update_l1 / update_l2（切歌，含解码与预处理）的耗时
+    - rss_per_session_bytes: 子进程常驻内存的增量 / session数（包含共享缓存，session越多越接近边际成本）
+心率为固定seed的随机游走，心率记忆使用模拟时钟（每轮tick前进transport_time秒），结果可在不同提交之间对比。
+
+python -m hflow_sound_match.benchmarks.run --library /tmp/hflow_lib --generate --out bench.json
+python -m hflow_sound_match.benchmarks.run --library /tmp/hflow_lib --compare bench.json
+"""
+import os
+import gc
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+import multiprocessing
+import numpy as np
+from loguru import logger
+
+VARIANTS = {
+    'v1': ('RelaxMusicSession', {}),
+    'v2': ('RelaxMusicSessionV2', {}),
+    'v2-numpy': ('RelaxMusicSessionV2', {'mix_backend': 'numpy'}),
+    'v2-numpy-prefetch': ('RelaxMusicSessionV2', {'mix_backend': 'numpy', 'prefetch': True}),
+    'v2-tiles': ('RelaxMusicSessionV2', {'tiles': True}),
+    'v2-numpy-tiles': ('RelaxMusicSessionV2', {'mix_backend': 'numpy', 'tiles': True}),
+    'v2-numpy-tiles-mixcache': ('RelaxMusicSessionV2', {'mix_backend': 'numpy', 'tiles': True, 'mix_cache': True}),
+    'v2-numpy-wearable': ('RelaxMusicSessionV2', {'mix_backend': 'numpy', 'profile': 'wearable'}),
+}
+
+
+def rss_bytes():
+    """当前进程的常驻内存"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def summarize(values_s):
+    """秒 -> 毫秒统计"""
+    if not values_s:
+        return {'count': 0}
+    ms = np.asarray(values_s) * 1000
+    return {
+        'count': int(ms.size),
+        'mean': round(float(ms.mean()), 3),
+        'p50': round(float(np.percentile(ms, 50)), 3),
+        'p95': round(float(np.percentile(ms, 95)), 3),
+        'p99': round(float(np.percentile(ms, 99)), 3),
+        'max': round(float(ms.max()), 3),
+    }
+
+
+def heart_rate_trace(ticks, seed, start=70.0, low=50, high=125, step=4.0):
+    """心率随机游走"""
+    rng = np.random.default_rng(seed)
+    hrs = start + np.cumsum(rng.normal(0, step, ticks))
+    return np.clip(np.round(hrs), low, high).astype(int).tolist()
+
+
+def _timed(func, bucket):
+    def wrapper(*args, **kwargs):
+        t = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            bucket.append(time.perf_counter() - t)
+    return wrapper
+
+
+def bench_variant(variant, library, file_formats, sessions, ticks, seed):
+    """在（新的）子进程中运行一个variant，返回结果dict"""
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING')
+    from ..config import cfg
+    cfg['sound_folders_root'] = os.path.abspath(library)
+    cfg['library_file_formats'] = list(file_formats)
+    from .. import match, match_v2
+    from ..catalog import sound_catalog
+    from ..cache import sound_cache, mix_cache
+    sound_catalog.file_formats = tuple(file_formats)
+
+    class_name, kwargs = VARIANTS[variant]
+    session_cls = getattr(match_v2 if class_name.endswith('V2') else match, class_name)
+    now = [1e6]
+    clock = lambda: now[0]  # noqa: E731
+
+    gc.collect()
+    rss_before = rss_bytes()
+    construct, ticks_s, switches = [], [], {1: [], 2: []}
+    items = []
+    for i in range(sessions):
+        t = time.perf_counter()
+        session = session_cls(**kwargs)
+        construct.append(time.perf_counter() - t)
+        session.hr_memory.clock = clock
+        session.update_l1 = _timed(session.update_l1, switches[1])
+        session.update_l2 = _timed(session.update_l2, switches[2])
+        items.append((session, heart_rate_trace(ticks, seed + i)))
+
+    for tick in range(ticks):
+        for session, trace in items:
+            t = time.perf_counter()
+            session.match_and_generate(trace[tick])
+            ticks_s.append(time.perf_counter() - t)
+        now[0] += cfg['transport_time']
+
+    gc.collect()
+    rss_after = rss_bytes()
+    prefetch_stats = [s.prefetch_stats() for s, _ in items if getattr(s, 'prefetcher', None) is not None]
+    for session, _ in items:
+        if getattr(session, 'prefetcher', None) is not None:
+            session.prefetcher.close()
+    return {
+        'construct_ms': summarize(construct[1:]) if sessions > 1 else summarize(construct),
+        'construct_cold_ms': round(construct[0] * 1000, 3),
+        'tick_ms': summarize(ticks_s),
+        'switch_ms': {'l1': summarize(switches[1]), 'l2': summarize(switches[2])},
+        'rss_before_bytes': rss_before,
+        'rss_after_bytes': rss_after,
+        'rss_per_session_bytes': (rss_after - rss_before) // max(1, sessions),
+        'sound_cache': sound_cache.stats(),
+        'mix_cache': mix_cache.stats(),
+        'prefetch': prefetch_stats,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(library, variants=('v1', 'v2'), sessions=4, ticks=30, seed=0, file_formats=('mp3',)):
+    """每个variant一个spawn出来的子进程，互不共享缓存与内存"""
+    ctx = multiprocessing.get_context('spawn')
+    results = {}
+    for variant in variants:
+        logger.info('benchmark: {} ({} sessions x {} ticks)'.format(variant, sessions, ticks))
+        with ctx.Pool(1) as pool:
+            results[variant] = pool.apply(bench_variant, (variant, library, file_formats, sessions, ticks, seed))
+    return {
+        'meta': {
+            'revision': git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'library': os.path.abspath(library),
+            'sessions': sessions,
+            'ticks': ticks,
+            'seed': seed,
+        },
+        'results': results,
+    }
+
+
+def compare(current, baseline, keys=('tick_ms.p50', 'tick_ms.p99', 'construct_cold_ms', 'rss_per_session_bytes')):
+    """当前结果 / 基线结果 的比值，>1表示变慢（变大）"""
+    def pick(result, key):
+        for part in key.split('.'):
+            result = result.get(part) if isinstance(result, dict) else None
+        return result
+
+    ratios = {}
+    for variant, result in current['results'].items():
+        base = baseline['results'].get(variant)
+        if base is None:
+            continue
+        ratios[variant] = {}
+        for key in keys:
+            a, b = pick(result, key), pick(base, key)
+            ratios[variant][key] = round(a / b, 3) if a is not None and b else None
+    return ratios
+
+
+def main():
+    from .library import generate_library, add_library_arguments, library_kwargs
+    parser = argparse.ArgumentParser(description='benchmark RelaxMusicSession / RelaxMusicSessionV2')
+    parser.add_argument('--library', required=True, help='sound folders root to benchmark against')
+    parser.add_argument('--generate', action='store_true', help='generate a synthetic library into --library first')
+    parser.add_argument('--variants', nargs='+', default=['v1', 'v2'], choices=sorted(VARIANTS))
+    parser.add_argument('--sessions', type=int, default=4)
+    parser.add_argument('--ticks', type=int, default=30)
+    parser.add_argument('--out', default=None, help='write results as json')
+    parser.add_argument('--compare', default=None, help='baseline json to compare against')
+    add_library_arguments(parser)
+    args = parser.parse_args()
+    if args.generate:
+        generate_library(args.library, **library_kwargs(args))
+    report = run_benchmarks(args.library, args.variants, args.sessions, args.ticks, args.seed, (args.format,))
+    if args.compare:
+        with open(args.compare) as f:
+            report['compare'] = compare(report, json.load(f))
+    text = json.dumps(report, ensure_ascii=False, indent=1)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
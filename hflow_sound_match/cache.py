@@ -0,0 +1,133 @@
+"""进程内共享的音频缓存
+#################################################
+解码 + 音量归一化之后的音频对所有session都是只读的（AudioSegment不可变），
+所以同一个文件在进程内只需要一份。
+mix_cache 缓存混音结果：状态相同（三层文件、片段位置、淡入淡出、增益都相同）的session共享同一个输出片段。
+key = (文件绝对路径, mtime, 预处理参数)，文件被替换后mtime变化，自然不会命中旧数据。
+加载出的对象上记录 cache_key，对象被淘汰后仍可用它标识内容（见RelaxMusicSessionV2.mix_key）。
+按总字节数做LRU淘汰，线程安全：同一个key并发加载时只有一个线程真正解码，其他线程等待结果。
+"""
+import os
+import threading
+from collections import OrderedDict
+from .config import cfg
+
+
+def sizeof_sound(sound):
+    """音频对象占用的字节数（AudioSegment取raw_data，ndarray取nbytes）"""
+    nbytes = getattr(sound, 'nbytes', None)
+    if nbytes is not None:
+        return int(nbytes)
+    return len(sound.raw_data)
+
+
+def tag_cache_key(value, key):
+    """在value上记录加载它的key，不能设置属性的对象（如ndarray）跳过"""
+    try:
+        value.cache_key = key
+    except AttributeError:
+        pass
+    return value
+
+
+class SoundCache:
+    def __init__(self, max_bytes, sizeof=sizeof_sound):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.current_bytes = 0
+        self.hits, self.misses, self.evictions = 0, 0, 0
+        self._items = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(path, params=()):
+        path = os.path.abspath(path)
+        return path, os.stat(path).st_mtime_ns, params
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value):
+        nbytes = self.sizeof(value)
+        with self._lock:
+            if nbytes > self.max_bytes:
+                return value
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            self._items[key] = (value, nbytes)
+            self.current_bytes += nbytes
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._items.popitem(last=False)
+                self.current_bytes -= evicted_bytes
+                self.evictions += 1
+        return value
+
+    def get_or_create(self, key, loader):
+        """命中直接返回；未命中时调用loader()，同一key并发时只加载一次"""
+        while True:
+            with self._lock:
+                item = self._items.get(key)
+                if item is not None:
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    return item[0]
+                event = self._loading.get(key)
+                if event is None:
+                    event = self._loading[key] = threading.Event()
+                    self.misses += 1
+                    break
+            # 其他线程正在加载，等它完成后重新查一次
+            event.wait()
+        try:
+            value = tag_cache_key(loader(), key)
+            self.put(key, value)
+            return value
+        finally:
+            with self._lock:
+                self._loading.pop(key, None)
+            event.set()
+
+    def get_or_load(self, path, loader, params=()):
+        return self.get_or_create(self.make_key(path, params), loader)
+
+    def shared_ids(self):
+        """缓存中所有对象的id，用于判断某个session持有的音频是否为共享的那一份"""
+        with self._lock:
+            return {id(value) for value, _ in self._items.values()}
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'items': len(self._items),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / (self.hits + self.misses), 4) if self.hits + self.misses else None,
+            }
+
+
+sound_cache = SoundCache(int(cfg.get('sound_cache_max_mb', 1024) * 1024 * 1024))
+# 混音结果，key见 RelaxMusicSessionV2.mix_key
+mix_cache = SoundCache(int(cfg.get('mix_cache_max_mb', 256) * 1024 * 1024))
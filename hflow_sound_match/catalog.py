@@ -0,0 +1,152 @@
+"""音乐库索引
+#################################################
+进程内只扫描一次目录，按 (目录, layer) 建立 bpm有序数组 + 文件列表 的索引，
+之后的匹配都是查表（见compute.HeartRateLookup）。
+目录的 mtime 变化时只重建该目录的索引（增量失效），
+为了减少 NFS 上的 stat 次数，同一目录两次 mtime 检查之间至少间隔 check_interval 秒。
+"""
+import os
+import time
+import bisect
+import threading
+from loguru import logger
+from .config import cfg
+from .compute import HeartRateLookup
+from .metrics import timed
+
+
+class LayerIndex:
+    """某个目录下某一层的文件，按 bpm 升序排列"""
+    __slots__ = ('bpms', 'files', 'base_files', '_lookup')
+
+    def __init__(self, bpms, files, base_files):
+        self.bpms = bpms
+        self.files = files
+        self.base_files = base_files
+        self._lookup = None
+
+    def __len__(self):
+        return len(self.bpms)
+
+    @property
+    def lookup(self):
+        """心率 -> 最近bpm 的查找表（compute.HeartRateLookup），首次使用时构建"""
+        if self._lookup is None:
+            self._lookup = HeartRateLookup(self.bpms)
+        return self._lookup
+
+    def closest_bpm(self, heart_rate):
+        """距离心率最近的bpm，距离相同时取较大的bpm（与compute.get_index_of_closest_heart_rate一致）"""
+        return self.lookup.closest_bpm(heart_rate)
+
+    def closest_files(self, heart_rate):
+        return [self.files[i] for i in self.lookup.lookup(heart_rate)]
+
+    def closest_files_batch(self, heart_rates):
+        """多个心率一次查询，返回与heart_rates一一对应的候选文件列表"""
+        return [[self.files[i] for i in inds] for inds in self.lookup.lookup_batch(heart_rates)]
+
+
+class FolderIndex:
+    __slots__ = ('mtime', 'checked_at', 'files', 'base_files', 'layers')
+
+    def __init__(self, mtime, files, base_files, layers):
+        self.mtime = mtime
+        self.checked_at = time.monotonic()
+        self.files = files
+        self.base_files = base_files
+        self.layers = layers
+
+
+def parse_music_filename(base_file):
+    """按 music_filename_template ('{no}_{bpm}_{class}_{layer}.mp3') 解析出 (bpm, layer)"""
+    bpm = int(base_file.split('_')[1])
+    layer = int(base_file.split('_L')[-1].split('.')[0])
+    return bpm, layer
+
+
+def layer_file(file, layer):
+    """同一首曲子另一层的文件名：只替换文件名末尾的 _L{layer}，保留扩展名（wav/mp3/...）"""
+    stem, ext = os.path.splitext(file)
+    return '{}_L{}{}'.format(stem.rsplit('_L', 1)[0], layer, ext)
+
+
+class SoundCatalog:
+    def __init__(self, file_formats=None, check_interval=None):
+        if file_formats is None:
+            file_formats = cfg.get('library_file_formats', ['mp3'])
+        self.file_formats = tuple(file_formats)
+        self.check_interval = cfg.get('catalog_check_interval', 5) if check_interval is None else check_interval
+        self._folders = {}
+        self._lock = threading.Lock()
+
+    @timed('catalog_scan')
+    def _build(self, folder, mtime):
+        base_fs = sorted(i for i in os.listdir(folder) if i.endswith(self.file_formats))
+        fs = [os.path.join(folder, i) for i in base_fs]
+        grouped = {}
+        for f, base_f in zip(fs, base_fs):
+            try:
+                bpm, layer = parse_music_filename(base_f)
+            except (IndexError, ValueError):
+                continue
+            grouped.setdefault(layer, []).append((bpm, base_f, f))
+        layers = {}
+        for layer, items in grouped.items():
+            items.sort()
+            layers[layer] = LayerIndex([i[0] for i in items], [i[2] for i in items], [i[1] for i in items])
+        logger.debug('catalog built: {} ({} files)'.format(folder, len(fs)))
+        return FolderIndex(mtime, fs, base_fs, layers)
+
+    def folder(self, folder):
+        index = self._folders.get(folder)
+        now = time.monotonic()
+        if index is not None and now - index.checked_at < self.check_interval:
+            return index
+        with self._lock:
+            index = self._folders.get(folder)
+            mtime = os.stat(folder).st_mtime_ns
+            if index is None or index.mtime != mtime:
+                index = self._build(folder, mtime)
+                self._folders[folder] = index
+            else:
+                index.checked_at = now
+        return index
+
+    def list_files(self, folder):
+        """等价于 FilesHelper.get_files_by_folder_root 的 (fs, base_fs)"""
+        index = self.folder(folder)
+        return list(index.files), list(index.base_files)
+
+    def layer(self, folder, layer):
+        return self.folder(folder).layers.get(int(layer), LayerIndex([], [], []))
+
+    def closest_files(self, folder, layer, heart_rate):
+        return self.layer(folder, layer).closest_files(heart_rate)
+
+    def closest_files_batch(self, folder, layer, heart_rates):
+        return self.layer(folder, layer).closest_files_batch(heart_rates)
+
+    def contains(self, file):
+        folder, base_file = os.path.split(file)
+        try:
+            index = self.folder(folder)
+        except FileNotFoundError:
+            return False
+        return bisect_contains(index.base_files, base_file)
+
+    def invalidate(self, folder=None):
+        with self._lock:
+            if folder is None:
+                self._folders.clear()
+            else:
+                self._folders.pop(folder, None)
+
+
+def bisect_contains(sorted_seq, value):
+    i = bisect.bisect_left(sorted_seq, value)
+    return i < len(sorted_seq) and sorted_seq[i] == value
+
+
+# 进程内共享的索引
+sound_catalog = SoundCatalog()
@@ -1,14 +1,103 @@
+import functools
 import numpy as np
 
 
 # Compute Module
+class HeartRateLookup:
+    """
+    在一组候选bpm中查找与心率最接近的bpm，对每个候选集只构建一次：
+    - 生理范围（hr_range）内的整数心率直接查表
+    - 其他心率（小数、超出范围）用二分查找
+    - lookup_batch 一次处理多个session的心率数组
+    距离相同时取较大的bpm（与旧的逐次计算一致）
+    """
+    HR_RANGE = (20, 250)
+
+    def __init__(self, heart_rates, hr_range=HR_RANGE):
+        bpms = np.asarray(heart_rates, dtype=np.int32)
+        assert bpms.size, "at least one heart rate to match"
+        self.bpms = bpms
+        self.unique_bpms, inverse = np.unique(bpms, return_inverse=True)
+        # 每个bpm对应的原始下标（升序，与np.where一致）
+        self.members = [np.flatnonzero(inverse == i).tolist() for i in range(len(self.unique_bpms))]
+        self.hr_min, self.hr_max = hr_range
+        self._table = self._closest_unique(np.arange(self.hr_min, self.hr_max + 1, dtype=np.float64))
+
+    def _closest_unique(self, heart_rates):
+        """心率数组 -> unique_bpms中最接近者的下标"""
+        n = len(self.unique_bpms)
+        i = np.searchsorted(self.unique_bpms, heart_rates, side='left')
+        higher = np.minimum(i, n - 1)
+        lower = np.maximum(i - 1, 0)
+        d_higher = np.abs(self.unique_bpms[higher] - heart_rates)
+        d_lower = np.abs(heart_rates - self.unique_bpms[lower])
+        return np.where(d_higher <= d_lower, higher, lower)
+
+    def closest_unique_index(self, heart_rate):
+        if self.hr_min <= heart_rate <= self.hr_max and float(heart_rate).is_integer():
+            return int(self._table[int(heart_rate) - self.hr_min])
+        return int(self._closest_unique(np.asarray([heart_rate], dtype=np.float64))[0])
+
+    def closest_bpm(self, heart_rate):
+        return int(self.unique_bpms[self.closest_unique_index(heart_rate)])
+
+    def lookup(self, heart_rate):
+        """与心率最接近的所有候选下标"""
+        return self.members[self.closest_unique_index(heart_rate)]
+
+    def closest_unique_batch(self, heart_rates):
+        heart_rates = np.asarray(heart_rates, dtype=np.float64)
+        in_table = (heart_rates >= self.hr_min) & (heart_rates <= self.hr_max) & \
+            (heart_rates == np.floor(heart_rates))
+        result = np.empty(heart_rates.shape, dtype=np.int64)
+        result[in_table] = self._table[heart_rates[in_table].astype(np.int64) - self.hr_min]
+        if not in_table.all():
+            result[~in_table] = self._closest_unique(heart_rates[~in_table])
+        return result
+
+    def lookup_batch(self, heart_rates):
+        """每个心率对应的候选下标列表"""
+        return [self.members[i] for i in self.closest_unique_batch(heart_rates)]
+
+
+@functools.lru_cache(maxsize=128)
+def _get_heart_rate_lookup(heart_rates):
+    return HeartRateLookup(heart_rates)
+
+
 def get_index_of_closest_heart_rate(heart_rate, heart_rates):
-    hrs = np.array(heart_rates, dtype=np.int32)
-    distances = heart_rate - hrs
-    # distances_abs = np.abs(distances)
-    min_distance = min(np.abs(distances))
-    if -min_distance in distances:
-        min_distance = -min_distance
-    (inds, ) = np.where(distances == min_distance)
-    inds = inds.tolist()
-    return inds
+    # 同一组候选只构建一次查找表
+    return list(_get_heart_rate_lookup(tuple(heart_rates)).lookup(heart_rate))
+
+
+# L2切换规则（标量和数组通用，数组时每个元素对应一个session）
+def evaluate_l2_rules(heart_rate, mean_hr, min_hr, max_hr, rule1_count, active):
+    """
+    规则1：心率高于平均值累计3次
+    规则2：心率波动幅度（含当前心率）超过阈值
+    :param active: 心率记忆是否已覆盖整个slide_window，否则规则不生效
+    :return: (switch, rule1_count, prefetch)
+        switch: 是否切换L2；切换后rule1_count清零
+        prefetch: 规则1再满足一次就会切换，适合提前预取
+    """
+    heart_rate = np.asarray(heart_rate, dtype=np.float64)
+    active = np.asarray(active, dtype=bool)
+    # 未生效的位置mean/min/max可能是nan，用当前心率填充，结果会被active屏蔽
+    mean_hr = np.where(active, mean_hr, heart_rate)
+    min_hr = np.where(active, min_hr, heart_rate)
+    max_hr = np.where(active, max_hr, heart_rate)
+
+    above_mean = active & (heart_rate > mean_hr)
+    rule1_count = np.where(above_mean, np.asarray(rule1_count) + 1, rule1_count)
+    rule1 = above_mean & (rule1_count >= 3)
+    prefetch = above_mean & (rule1_count == 2)
+
+    amp = np.maximum(max_hr, heart_rate) - np.minimum(min_hr, heart_rate)
+    rule2 = active & (
+        ((65 <= heart_rate) & (heart_rate < 85) & (amp > 4)) |
+        ((85 <= heart_rate) & (heart_rate < 105) & (amp > 7)) |
+        ((heart_rate >= 105) & (amp > 11))
+    )
+    switch = rule1 | rule2
+    rule1_count = np.where(switch, 0, rule1_count)
+    return switch, rule1_count, prefetch
@@ -19,4 +19,9 @@ if not os.path.isabs(cfg['sound_folders_root']) :
     cfg['sound_folders_root'] = os.path.abspath(
         os.path.join(this_file_root, '..', cfg['sound_folders_root'])
     )
+# 预解码的PCM store，空字符串表示不使用
+if cfg.get('pcm_store_root') and not os.path.isabs(cfg['pcm_store_root']):
+    cfg['pcm_store_root'] = os.path.abspath(
+        os.path.join(this_file_root, '..', cfg['pcm_store_root'])
+    )
 logger.info('sound folders root: {}'.format(cfg['sound_folders_root']))
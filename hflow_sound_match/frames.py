@@ -0,0 +1,205 @@
+"""低延迟帧模式
+#################################################
+10秒模式下心率只在每个transport_time片段边界被使用一次；帧模式每次只生成frame_ms（默认200ms）的音频：
+
+    session = FrameSession(emotion=Emotion.peaceful, frame_ms=200)
+    session.push_heart_rate(75)          # 心率随时写入
+    frame = session.match_and_generate() # 200ms，格式与10秒模式的输出一致
+
+- 每层一个播放头（Playhead），帧从播放头处读取，淡入/淡出按播放头位置计算，可以跨越帧边界
+- 切换规则与10秒模式相同（compute.evaluate_l2_rules、L1剩余不足2*transport_time时切换），但在每一帧用最新心率判断：
+    规则1（心率连续高于均值）每transport_time的音频计一次数，与10秒模式的计数尺度一致
+    规则2（波动幅度）每帧判断，距上次L2切换至少min_switch_ms（默认transport_time）
+  切换在下一帧即可听到，反应延迟从最多一个transport_time降到一帧
+- 混音后的响度归一化用指数平滑的RMS（时间常数normalize_ms），避免每帧单独归一化造成的音量抽动
+- 每帧只有几次数组切片与向量运算，每秒音频的CPU开销与numpy后端的10秒模式相当
+"""
+import numpy as np
+from pydub import AudioSegment
+from pydub.utils import db_to_float
+from .config import cfg
+from .cache import sound_cache
+from .compute import evaluate_l2_rules
+from .match_v2 import RelaxMusicSessionV2
+from .metrics import metrics
+from .mixer import ArraySound, fade_ramp, max_possible_amplitude, to_int_samples
+from .utils import Emotion
+
+
+class Playhead:
+    """某一层当前播放的文件与位置（以帧为单位）"""
+    __slots__ = ('file', 'samples', 'gain', 'length', 'pos', 'fade_in', 'prefetched')
+
+    def __init__(self, file, sound, fade_in=False):
+        self.file = file
+        self.samples = sound.samples
+        self.gain = sound.gain
+        self.length = len(sound.samples)
+        self.pos = 0
+        self.fade_in = fade_in
+        self.prefetched = False
+
+
+class FrameSession(RelaxMusicSessionV2):
+    """
+    帧模式session，复用RelaxMusicSessionV2的文件匹配、加载、缓存、预取与心率记忆。
+    match_and_generate 每次返回 frame_ms 的音频。
+    """
+    frame_mode = True
+
+    def __init__(self,
+                 emotion=Emotion.peaceful,
+                 args=None,
+                 config=cfg,
+                 transition_mode='fade',
+                 frame_ms=None,
+                 min_switch_ms=None,
+                 normalize_ms=None,
+                 **kwargs):
+        assert transition_mode in ('fade', 'direct'), 'frame mode supports fade / direct transitions'
+        kwargs['mix_backend'] = 'numpy'
+        super().__init__(emotion=emotion, args=args, config=config, transition_mode=transition_mode, **kwargs)
+        transport_time_ms = 1000 * self.config['transport_time']
+        self.frame_ms = frame_ms or self.config.get('frame_ms', 200)
+        self.min_switch_ms = transport_time_ms if min_switch_ms is None else min_switch_ms
+        self.normalize_ms = transport_time_ms if normalize_ms is None else normalize_ms
+
+        l0 = ArraySound(self.l0_sound)
+        self.frame_rate, self.channels, self.sample_width = l0.frame_rate, l0.samples.shape[1], l0.sample_width
+        self.playheads = {0: Playhead(self.l0_file, l0), 1: None, 2: None}
+        # 距上次规则1计数 / 上次L2切换的音频时长（毫秒）
+        self._since_rule1_ms = transport_time_ms
+        self._since_l2_switch_ms = self.min_switch_ms
+        self._mean_square = None
+
+    # ---------------------------------------------------------- 播放头
+    def _conformed(self, layer, sound_file, sound):
+        """与L0格式不同的音频转换一次（结果进入sound_cache）"""
+        array = ArraySound(sound)
+        if (array.frame_rate, array.samples.shape[1], array.sample_width) == \
+                (self.frame_rate, self.channels, self.sample_width):
+            return array
+
+        def convert():
+            segment = sound if isinstance(sound, AudioSegment) else sound.to_audio_segment()
+            return segment.set_frame_rate(self.frame_rate).set_channels(self.channels) \
+                .set_sample_width(self.sample_width)
+        params = ('conform', 'raw' if layer == 0 else 'preprocess', self.frame_rate, self.channels,
+                  self.sample_width, self.config['transport_time'], self.config['fade_time'])
+        return ArraySound(sound_cache.get_or_load(sound_file, convert, params))
+
+    def _sync_playheads(self):
+        """L1/L2文件变化（首次加载或切换）后换新的播放头；切换后的新音乐淡入"""
+        for layer, sound_file, sound, state in ((1, self.l1_file, self.l1_sound, self.l1_state),
+                                                (2, self.l2_file, self.l2_sound, self.l2_state)):
+            head = self.playheads[layer]
+            if sound is None or (head is not None and head.file == sound_file and not state.should_fade_in):
+                continue
+            self.playheads[layer] = Playhead(sound_file, self._conformed(layer, sound_file, sound),
+                                             fade_in=state.should_fade_in)
+            state.should_fade_in = False
+
+    def _read(self, layer, n, out, gain_db):
+        """从播放头读取n帧，乘上层增益与淡入淡出后累加到out"""
+        head = self.playheads[layer]
+        fade_frames = int(self.config['fade_time'] * self.frame_rate)
+        gain = np.float32(db_to_float(float(head.gain) + gain_db))
+        filled = 0
+        while filled < n:
+            if head.pos >= head.length:
+                # 循环：'fade'模式在结尾淡出、从头淡入
+                metrics.inc('loop')
+                head.pos = 0
+                head.fade_in = self.transition_mode == 'fade'
+            take = min(n - filled, head.length - head.pos)
+            chunk = head.samples[head.pos:head.pos + take].astype(np.float32)
+            chunk *= gain
+            start, end = head.pos, head.pos + take
+            if head.fade_in and start < fade_frames:
+                ramp = fade_ramp(self.frame_rate, 0, 1000 * self.config['fade_time'], True)
+                stop = min(end, len(ramp))
+                chunk[:stop - start] *= ramp[start:stop]
+            if self.transition_mode == 'fade' and end > head.length - fade_frames:
+                ramp = fade_ramp(self.frame_rate, 0, 1000 * self.config['fade_time'], False)
+                offset = head.length - len(ramp)
+                lo = max(start, offset)
+                chunk[lo - start:] *= ramp[lo - offset:end - offset]
+            out[filled:filled + take] += chunk
+            filled += take
+            head.pos = end
+
+    # ---------------------------------------------------------- 切换规则
+    def _rest_ms(self, layer):
+        head = self.playheads[layer]
+        return 1000 * (head.length - head.pos) / self.frame_rate
+
+    def decide(self, heart_rate):
+        """每帧调用：按10秒模式的规则决定L1/L2是否切换"""
+        transport_time_ms = 1000 * self.config['transport_time']
+
+        rest = self._rest_ms(1)
+        if rest <= 2 * transport_time_ms:
+            self.update_l1(heart_rate)
+        elif self.prefetcher is not None and rest <= 3 * transport_time_ms and not self.playheads[1].prefetched:
+            self.playheads[1].prefetched = True
+            self.prefetcher.request(1, self.match_by_layer(heart_rate, 1))
+
+        mean_hr, min_hr, max_hr, rule1_count, active = self.l2_rule_inputs()
+        if self._since_rule1_ms >= transport_time_ms:
+            # 规则1每transport_time计一次数
+            self._since_rule1_ms = 0
+            switch, rule1_count, prefetch = evaluate_l2_rules(heart_rate, mean_hr, min_hr, max_hr, rule1_count, active)
+            if prefetch and self.prefetcher is not None:
+                self.prefetcher.request(2, self.match_by_layer(heart_rate, 2))
+            self.l2_state.larger_than_mean_hr = int(rule1_count)
+        else:
+            # 只判断规则2：rule1_count传0时规则1不会触发
+            switch, _, _ = evaluate_l2_rules(heart_rate, mean_hr, min_hr, max_hr, 0, active)
+        if switch and self._since_l2_switch_ms >= self.min_switch_ms:
+            self._since_l2_switch_ms = 0
+            self.update_l2(heart_rate)
+            self.l2_state.larger_than_mean_hr = 0
+
+    # ---------------------------------------------------------- 生成
+    def _normalize(self, mixed):
+        """平滑后的RMS归一化到mixer.target_dBFS"""
+        mean_square = float(np.mean(np.square(mixed, dtype=np.float64)))
+        if self._mean_square is None:
+            self._mean_square = mean_square
+        else:
+            alpha = np.exp(-self.frame_ms / self.normalize_ms) if self.normalize_ms > 0 else 0.0
+            self._mean_square = alpha * self._mean_square + (1 - alpha) * mean_square
+        if self._mean_square > 0:
+            target_rms = max_possible_amplitude(self.sample_width) * db_to_float(self.mixer.target_dBFS)
+            mixed *= np.float32(target_rms / np.sqrt(self._mean_square))
+        return to_int_samples(mixed, self.sample_width)
+
+    def generate_frame(self, heart_rate):
+        self.prepare_layers(heart_rate)
+        self._sync_playheads()
+        self.decide(heart_rate)
+        self._sync_playheads()
+
+        n = int(self.frame_ms * self.frame_rate / 1000)
+        mixed = np.zeros((n, self.channels), dtype=np.float32)
+        with metrics.stage('overlay'):
+            for layer, gain_db in zip((0, 1, 2), self.mixer.layer_gains):
+                self._read(layer, n, mixed, gain_db)
+        with metrics.stage('mix_gain'):
+            samples = self._normalize(mixed)
+        self._since_rule1_ms += self.frame_ms
+        self._since_l2_switch_ms += self.frame_ms
+        return AudioSegment(data=samples.tobytes(), sample_width=self.sample_width, frame_rate=self.frame_rate,
+                            channels=self.channels)
+
+    def match_and_generate(self, heart_rate=None):
+        """生成一帧（frame_ms），heart_rate为None时使用push_heart_rate写入的最新心率"""
+        record = heart_rate is not None
+        if not record:
+            heart_rate = self.hr_memory.latest
+            assert heart_rate is not None, 'no heart rate pushed yet'
+        with metrics.stage('tick'):
+            segment = self.generate_frame(heart_rate)
+        if record:
+            self.hr_memory.append(heart_rate)
+        return segment
@@ -6,9 +6,12 @@ from dataclasses import dataclass
 import numpy as np
 import time
 import math
-from .compute import get_index_of_closest_heart_rate
 from .memory import HeartMemory
 from .utils import Emotion
+from .catalog import sound_catalog, layer_file
+from .cache import sound_cache
+from .pcm_store import open_sound, canonical_format, format_key
+from .sound_meta import sound_meta
 from .utils import (
     # TimeArguments,
     FilesHelper
@@ -33,7 +36,7 @@ class RelaxMusicSession:
         self.config = config
         self.fade_in_time = self.fade_out_time = self.config['fade_time']  # / 2
         self.l0_file = self.init_l0_file()
-        self.l0_sound = AudioSegment.from_file(self.l0_file)
+        self.l0_sound = self.load_sound(self.l0_file)
         self.l0_faded = self.fade(self.l0_sound)
         self.l1_file = None
         self.l2_file = None
@@ -56,13 +59,8 @@ class RelaxMusicSession:
         return sound.fade_in(1000 * self.fade_in_time).fade_out(1000 * self.fade_out_time)
 
     def match_by_layer(self, heart_rate, layer):
-        emotion_folder = FilesHelper.get_emotion_root_by_emotion(self.emotion)
-        emotion_fs, emotion_base_fs = FilesHelper.get_files_by_folder_root(emotion_folder)
-        emotion_fs, emotion_base_fs = FilesHelper.get_files_by_layer(emotion_fs, emotion_base_fs, layer=layer, )
-        hrs = [i.split('_')[1] for i in emotion_base_fs]
-        closest_inds = get_index_of_closest_heart_rate(heart_rate, hrs)
-        closest_ind = random.choice(closest_inds)
-        file = emotion_fs[closest_ind]
+        closest_fs = FilesHelper.get_closest_files_by_heart_rate(self.emotion, layer, heart_rate)
+        file = random.choice(closest_fs)
         return file
 
     @property
@@ -72,7 +70,7 @@ class RelaxMusicSession:
     # todo: ...
     def init_l0_file(self):
         """environment sound"""
-        return random.choice(FilesHelper.environment_files)
+        return random.choice(FilesHelper.environment_files())
 
     def check_emotion(self, heart_rate, *args):
         return False
@@ -114,7 +112,7 @@ class RelaxMusicSession:
 
     def generate_l2_segment_and_update_l2(self, heart_rate):
         # rest = len(self.l2_sound) - self.l2_state['end']
-        if len(self.hr_memory['time']) > 0 and max(self.hr_memory['time']) - min(self.hr_memory['time']) >= self.config['slide_window']:
+        if not self.hr_memory.is_empty and self.hr_memory.span >= self.config['slide_window']:
             # rule 1
             if heart_rate > self.hr_memory.mean_hr:
                 current_rule1_count = self.l2_state.get('larger_than_mean_hr', 0) + 1
@@ -122,8 +120,7 @@ class RelaxMusicSession:
                 if self.l2_state['larger_than_mean_hr'] >= 3:
                     self.update_l2(heart_rate)
                     self.l2_state['larger_than_mean_hr'] = 0
-            hrs_temp = self.hr_memory['hr'] + [heart_rate]
-            amp = max(hrs_temp) - min(hrs_temp)
+            amp = max(self.hr_memory.max_hr, heart_rate) - min(self.hr_memory.min_hr, heart_rate)
 
             # rule 2
             if (65 <= heart_rate < 85 and amp > 4) or \
@@ -202,13 +199,25 @@ class RelaxMusicSession:
         """
         return segment
 
+    def load_sound(self, sound_file):
+        # 缓存key包含规范格式，修改sample_format后不会拿到旧格式的音频
+        return sound_cache.get_or_load(sound_file, lambda: open_sound(sound_file),
+                                       ('raw', format_key(canonical_format())))
+
     def load_and_preprocess_sound(self, sound_file):
-        sound = AudioSegment.from_file(sound_file)
+        # 解码+归一化的结果在进程内共享
+        params = ('preprocess', self.config['transport_time'], self.config['fade_time'],
+                  format_key(canonical_format()))
+        return sound_cache.get_or_load(sound_file, lambda: self._load_and_preprocess_sound(sound_file), params)
+
+    def _load_and_preprocess_sound(self, sound_file):
+        sound = open_sound(sound_file)
 
         # 音量归一化到-20dBFS（避免过大或过小）
         # -20dBFS是一个合适的目标音量，既不会太大也不会太小
         target_dBFS = -20.0
-        change_in_dBFS = target_dBFS - sound.dBFS
+        # 文件的dBFS只扫描一次，之后从元数据中读取
+        change_in_dBFS = target_dBFS - sound_meta.dBFS(sound_file, sound)
         sound = sound.apply_gain(change_in_dBFS)
 
         if len(sound) < 1000 * self.config['transport_time']:
@@ -217,7 +226,7 @@ class RelaxMusicSession:
 
     def match_and_generate(self, heart_rate):
         if self.hr_memory.is_empty or (
-                max(self.hr_memory['time']) - min(self.hr_memory['time']) < self.config['memory_min_time']
+                self.hr_memory.span < self.config['memory_min_time']
         ):
             if self.l1_file is None:
                 self.l1_file = self.match_by_layer(heart_rate, 1)
@@ -225,8 +234,8 @@ class RelaxMusicSession:
             if self.l2_file is None:
                 # 优先尝试使用与L1文件相同bpm的L2文件
                 if self.l1_file is not None:
-                    potential_l2_file = self.l1_file.replace('_L1.mp3', '_L2.mp3')
-                    if os.path.exists(potential_l2_file):
+                    potential_l2_file = layer_file(self.l1_file, 2)
+                    if sound_catalog.contains(potential_l2_file):
                         self.l2_file = potential_l2_file
                     else:
                         self.l2_file = self.match_by_layer(heart_rate, 2)
@@ -80,13 +80,47 @@ from dataclasses import dataclass
 import numpy as np
 import time
 import math
-from .compute import get_index_of_closest_heart_rate
+from .compute import evaluate_l2_rules
 from .memory import HeartMemory
 from .utils import Emotion
+from .catalog import sound_catalog, layer_file
+from .cache import sound_cache, mix_cache
+from .pcm_store import open_sound, profile_format, format_key
+from .sound_meta import sound_meta
+from .mixer import ArraySound, get_mixer
+from .prefetch import Prefetcher
+from .metrics import metrics, timed
+from .tiles import SoundTiles
+from .windowed import WindowedSound, open_windowed
+from .streaming import stream_session
 from .utils import FilesHelper
 from loguru import logger
 from .config import cfg
-from easydict import EasyDict
+
+# L1/L2预处理时的响度归一化目标
+PREPROCESS_TARGET_DBFS = -20.0
+
+
+class LayerState:
+    """
+    一层的播放状态，只有几个整数和标记（__slots__，约100字节）：
+        start / end: 当前片段的位置（毫秒；循环之后不回绕，见simply_generate_next_sound_segment_and_update_state）
+        next_start / next_end / next_fade_in: 下一个片段的切片位置与是否淡入，None表示还没有播放过
+        should_fade_in: 音乐刚切换，第一个片段需要淡入
+        segment_key: 当前片段的 (序号, 淡入, 淡出)，与tile的key相同，见mix_key
+        larger_than_mean_hr: L2规则1的计数
+    下一个片段不预先生成，tick时才从共享音频中切出（numpy后端为视图，使用tile时为共享的tile）。
+    """
+    __slots__ = ('start', 'end', 'next_start', 'next_end', 'next_fade_in', 'should_fade_in', 'segment_key',
+                 'larger_than_mean_hr')
+
+    def __init__(self, should_fade_in=False):
+        self.start = self.end = None
+        self.next_start = self.next_end = None
+        self.next_fade_in = False
+        self.should_fade_in = should_fade_in
+        self.segment_key = None
+        self.larger_than_mean_hr = 0
 
 
 class RelaxMusicSessionV2:
@@ -101,21 +135,58 @@ class RelaxMusicSessionV2:
 
         loop_fade_enabled: 是否在循环时启用淡入淡出
         change_fade_enabled: 是否在切换音乐时启用淡入淡出
+
+        mix_backend: 混音/切片/淡入淡出的实现
+            - 'pydub': AudioSegment（默认）
+            - 'numpy': float32数组，切片为零拷贝视图，见mixer.NumpyMixer
+
+        prefetch: 是否在L1/L2快到切换点时后台预取下一首（见prefetch.Prefetcher），
+            统计见 prefetch_stats()
+
+        clock: 心率记忆使用的时钟，默认time.time（离线回放时传入模拟时钟）
+
+        tiles: 是否使用预渲染的片段（见tiles.SoundTiles），每个文件带淡入淡出的片段在加载时生成一次，
+            tick时只查表；仅支持 'fade' / 'direct' 模式，输出与不使用时完全一致
+
+        mix_cache: 是否缓存混音结果（见cache.mix_cache），三层的文件、片段位置、淡入淡出与增益都相同的tick
+            直接返回共享的同一个片段（只读）；仅支持 'fade' / 'direct' 模式，命中率见 mix_cache.stats()
+
+        profile: 质量档位，config quality_profiles 中的名字（例如单声道22kHz的 'wearable'），None为规范格式（sample_format）。
+            缓存的音频按档位的格式解码（同一文件+档位在进程内共享一份），切片、淡入淡出、混音和输出都在这个格式上进行，
+            CPU、内存和输出码率随采样率与声道数按比例降低
     """
 
     def __init__(self,
                  emotion=Emotion.peaceful,
                  args=None,
                  config=cfg,
-                 transition_mode='fade'):
+                 transition_mode='fade',
+                 mix_backend='pydub',
+                 prefetch=False,
+                 clock=None,
+                 tiles=False,
+                 mix_cache=False,
+                 profile=None):
         self.config = config
+        self.profile = profile
+        # 缓存key中的格式，同一格式的档位共享缓存
+        self.sample_format = profile_format(profile)
+        self.format_key = format_key(self.sample_format)
         self.fade_in_time = self.fade_out_time = self.config['fade_time']
         self.transition_mode = transition_mode
+        self.mix_backend = mix_backend
+        self.mixer = get_mixer(mix_backend)
+        self.prefetcher = Prefetcher(self.load_and_preprocess_sound) if prefetch else None
+        # 批量tick时由SessionPool设置，多个session共享同一次索引查询
+        self.match_memo = None
+        self.tiles = tiles and transition_mode in ('fade', 'direct')
+        # {layer: (文件, SoundTiles)}，避免每个tick都查一次缓存
+        self._layer_tiles = {}
+        self.mix_cache = mix_cache and transition_mode in ('fade', 'direct')
 
         # 初始化L0（环境音）
         self.l0_file = self.init_l0_file()
-        self.l0_sound = AudioSegment.from_file(self.l0_file)
-        self.l0_faded = self.fade(self.l0_sound)
+        self.l0_sound = self.load_sound(self.l0_file)
 
         # 初始化L1、L2
         self.l1_file = None
@@ -123,29 +194,55 @@ class RelaxMusicSessionV2:
         self.l1_sound, self.l2_sound = None, None
 
         # 初始化状态
-        self.l0_state = EasyDict({"start": None, "end": None, 'next': None, 'should_fade_in': False})
-        self.l1_state = EasyDict({"start": None, "end": None, 'next': None, 'should_fade_in': False})
-        self.l2_state = EasyDict({"start": None, "end": None, 'next': None, 'should_fade_in': False})
+        self.l0_state = LayerState()
+        self.l1_state = LayerState()
+        self.l2_state = LayerState()
 
         self.emotion = emotion
-        self.hr_memory = HeartMemory(self.config['slide_window'])
+        self.hr_memory = HeartMemory(self.config['slide_window'], clock=clock)
+
+    @property
+    def l0_faded(self):
+        """淡入淡出后的完整L0，按需生成（不在每个session中常驻一份拷贝）"""
+        return self.fade(self.l0_sound)
 
     def fade(self, sound):
         """给完整音频添加淡入淡出"""
         assert len(sound) / 1000 >= self.config['fade_time'], 'time of sound <= fade time configured'
         return sound.fade_in(1000 * self.fade_in_time).fade_out(1000 * self.fade_out_time)
 
+    def closest_files(self, layer, heart_rate):
+        """bpm与心率最接近的候选文件；批量tick时同一 (情绪, 层, 心率) 只查一次索引"""
+        with metrics.stage('match'):
+            if self.match_memo is None:
+                return FilesHelper.get_closest_files_by_heart_rate(self.emotion, layer, heart_rate)
+            key = (self.emotion, layer, heart_rate)
+            closest_fs = self.match_memo.get(key)
+            if closest_fs is None:
+                closest_fs = self.match_memo[key] = FilesHelper.get_closest_files_by_heart_rate(
+                    self.emotion, layer, heart_rate)
+            return closest_fs
+
     def match_by_layer(self, heart_rate, layer):
         """根据心率匹配指定层级的音乐文件"""
-        emotion_folder = FilesHelper.get_emotion_root_by_emotion(self.emotion)
-        emotion_fs, emotion_base_fs = FilesHelper.get_files_by_folder_root(emotion_folder)
-        emotion_fs, emotion_base_fs = FilesHelper.get_files_by_layer(emotion_fs, emotion_base_fs, layer=layer)
-        hrs = [i.split('_')[1] for i in emotion_base_fs]
-        closest_inds = get_index_of_closest_heart_rate(heart_rate, hrs)
-        closest_ind = random.choice(closest_inds)
-        file = emotion_fs[closest_ind]
+        closest_fs = self.closest_files(layer, heart_rate)
+        file = random.choice(closest_fs)
         return file
 
+    def match_and_load_by_layer(self, heart_rate, layer):
+        """匹配并加载，优先使用后台预取好的文件"""
+        if self.prefetcher is not None:
+            candidates = self.closest_files(layer, heart_rate)
+            file, sound = self.prefetcher.take(layer, candidates)
+            if file is not None:
+                # 预取未完成时同步加载同一文件，sound_cache会等待正在进行的那次解码
+                return file, sound if sound is not None else self.load_and_preprocess_sound(file)
+        file = self.match_by_layer(heart_rate, layer)
+        return file, self.load_and_preprocess_sound(file)
+
+    def prefetch_stats(self):
+        return self.prefetcher.stats() if self.prefetcher is not None else None
+
     def init_l0_file(self):
         """初始化环境音文件"""
         return random.choice(FilesHelper.environment_files())
@@ -170,11 +267,14 @@ class RelaxMusicSessionV2:
         1. 如果剩余时间充足（>2*transport_time），继续播放
         2. 否则，更新到新音乐
         """
-        if self.l1_state['end'] is None:
+        if self.l1_state.end is None:
             segment = self.simply_generate_next_sound_segment_and_update_state(1)
         else:
-            rest = len(self.l1_sound) - self.l1_state['end']
+            rest = len(self.l1_sound) - self.l1_state.end
             if rest > 2 * 1000 * self.config['transport_time']:
+                if self.prefetcher is not None and rest <= 3 * 1000 * self.config['transport_time']:
+                    # 下一次就要切换，提前在后台加载
+                    self.prefetcher.request(1, self.match_by_layer(heart_rate, 1))
                 segment = self.simply_generate_next_sound_segment_and_update_state(1)
             else:
                 # 剩余时间不足，更新音乐
@@ -182,33 +282,34 @@ class RelaxMusicSessionV2:
                 segment = self.simply_generate_next_sound_segment_and_update_state(1)
         return segment
 
-    def generate_l2_segment_and_update_l2(self, heart_rate):
+    def l2_rule_inputs(self):
+        """L2切换规则的输入 (mean_hr, min_hr, max_hr, rule1_count, active)，见compute.evaluate_l2_rules"""
+        active = not self.hr_memory.is_empty and self.hr_memory.span >= self.config['slide_window']
+        if not active:
+            return np.nan, np.nan, np.nan, self.l2_state.larger_than_mean_hr, False
+        return (self.hr_memory.mean_hr, self.hr_memory.min_hr, self.hr_memory.max_hr,
+                self.l2_state.larger_than_mean_hr, True)
+
+    def generate_l2_segment_and_update_l2(self, heart_rate, decision=None):
         """
         生成L2（和声）片段
 
-        更新规则：
+        更新规则（两条规则同时满足时只切换一次）：
         1. 心率持续高于平均值3次
         2. 心率波动幅度超过阈值
+
+        :param decision: compute.evaluate_l2_rules 的结果，批量tick时由外部统一计算；None时自行计算
         """
-        if len(self.hr_memory['time']) > 0 and \
-           max(self.hr_memory['time']) - min(self.hr_memory['time']) >= self.config['slide_window']:
-
-            # 规则1：心率持续高于平均值
-            if heart_rate > self.hr_memory.mean_hr:
-                current_rule1_count = self.l2_state.get('larger_than_mean_hr', 0) + 1
-                self.l2_state['larger_than_mean_hr'] = current_rule1_count
-                if self.l2_state['larger_than_mean_hr'] >= 3:
-                    self.update_l2(heart_rate)
-                    self.l2_state['larger_than_mean_hr'] = 0
-
-            # 规则2：心率波动幅度
-            hrs_temp = self.hr_memory['hr'] + [heart_rate]
-            amp = max(hrs_temp) - min(hrs_temp)
-
-            if (65 <= heart_rate < 85 and amp > 4) or \
-               (85 <= heart_rate < 105 and amp > 7) or \
-               (heart_rate >= 105 and amp > 11):
-                self.update_l2(heart_rate)
+        if decision is None:
+            decision = evaluate_l2_rules(heart_rate, *self.l2_rule_inputs())
+        switch, rule1_count, prefetch = decision
+
+        if prefetch and self.prefetcher is not None:
+            # 再满足一次规则1就会切换，提前在后台加载
+            self.prefetcher.request(2, self.match_by_layer(heart_rate, 2))
+        if switch:
+            self.update_l2(heart_rate)
+        self.l2_state.larger_than_mean_hr = int(rule1_count)
 
         segment = self.simply_generate_next_sound_segment_and_update_state(2)
         return segment
@@ -220,31 +321,20 @@ class RelaxMusicSessionV2:
         改进：添加淡入标记，下一个片段会淡入
         """
         logger.info(f"🔄 L1音乐切换：心率={heart_rate} bpm")
-        l1_file = self.match_by_layer(heart_rate, 1)
-        self.l1_file = l1_file
-        self.l1_sound = self.load_and_preprocess_sound(self.l1_file)
+        metrics.inc('l1_switch')
+        self.l1_file, self.l1_sound = self.match_and_load_by_layer(heart_rate, 1)
         # 重置状态，标记需要淡入
-        self.l1_state = EasyDict({
-            "start": None,
-            "end": None,
-            'next': None,
-            'should_fade_in': True  # 新增：标记下一个片段需要淡入
-        })
+        self.l1_state = LayerState(should_fade_in=True)
 
     def update_l2(self, heart_rate):
         """更新L2音乐"""
         logger.debug(f"🔄 L2音乐切换：心率={heart_rate} bpm")
-        l2_file = self.match_by_layer(heart_rate, 2)
-        self.l2_file = l2_file
-        self.l2_sound = self.load_and_preprocess_sound(self.l2_file)
+        metrics.inc('l2_switch')
+        self.l2_file, self.l2_sound = self.match_and_load_by_layer(heart_rate, 2)
         # 重置状态，标记需要淡入
-        self.l2_state = EasyDict({
-            "start": None,
-            "end": None,
-            'next': None,
-            'should_fade_in': True
-        })
+        self.l2_state = LayerState(should_fade_in=True)
 
+    @timed('slice_fade')
     def simply_generate_next_sound_segment_and_update_state(self, layer):
         """
         生成下一个音频片段并更新状态
@@ -263,105 +353,240 @@ class RelaxMusicSessionV2:
         """
         sound = {0: self.l0_sound, 1: self.l1_sound, 2: self.l2_sound}[layer]
         state = {0: self.l0_state, 1: self.l1_state, 2: self.l2_state}[layer]
+        if self.tiles and not isinstance(sound, WindowedSound):
+            # 按窗口解码的长文件不预渲染tile（否则又要整个解码）
+            return self._next_tile_and_update_state(layer, state)
+        if self.mix_backend == 'numpy':
+            # 切片为零拷贝视图，淡入淡出用预计算的增益曲线
+            sound = ArraySound(sound)
 
         transport_time_ms = 1000 * self.config['transport_time']
         fade_time_ms = 1000 * self.config['fade_time']
 
         # ============ 生成当前片段 ============
-        if state['end'] is None:
+        if state.end is None:
             # 第一次播放
             start = 0
             end = transport_time_ms
             segment = sound[start:end]
+            index, fade_in = 0, False
 
             # 如果标记了需要淡入（音乐刚切换），添加淡入效果
-            if state.get('should_fade_in', False):
+            if state.should_fade_in:
                 segment = segment.fade_in(fade_time_ms)
-                state['should_fade_in'] = False
+                state.should_fade_in = False
+                fade_in = True
                 logger.debug(f"  Layer {layer}: 添加淡入效果（音乐切换）")
         else:
-            # 使用预先准备好的next segment
-            assert state['next'] is not None, "next segment is None!"
-            start = state['end']
-            end = state['end'] + transport_time_ms
-            segment = state['next']
+            # 上一次只记录了下一个片段的位置，此时才从共享音频中切出
+            assert state.next_start is not None, "next segment is None!"
+            start = state.end
+            end = state.end + transport_time_ms
+            segment = sound[state.next_start:state.next_end]
+            index, fade_in = state.next_start // transport_time_ms, state.next_fade_in
+            if fade_in:
+                segment = segment.fade_in(fade_time_ms)
+        fade_out = False
 
         # ============ 准备下一个片段 ============
         start_next = start + transport_time_ms
         end_next = end + transport_time_ms
+        fade_in_next = False
 
         # 检查是否需要循环
         if end_next >= len(sound):
             # 需要循环：从头开始
             logger.debug(f"  Layer {layer}: 循环播放（{self.transition_mode}模式）")
+            metrics.inc('loop')
 
             if self.transition_mode == 'fade':
                 # 方案：使用淡入淡出
                 # 当前片段添加淡出，下一个片段添加淡入
                 segment = segment.fade_out(fade_time_ms)
+                fade_out = True
 
                 # 下一个片段从头开始并添加淡入
                 start_next = 0
                 end_next = transport_time_ms
-                segment_next = sound[start_next:end_next]
-                segment_next = segment_next.fade_in(fade_time_ms)
+                fade_in_next = True
 
             elif self.transition_mode == 'direct':
                 # 方案：直接循环（原始方式）
                 start_next = 0
                 end_next = transport_time_ms
-                segment_next = sound[start_next:end_next]
 
             else:  # crossfade模式
                 # 注意：这会改变segment长度！
                 logger.warning(f"  Layer {layer}: crossfade模式会改变片段长度！")
+                # crossfade会在使用时处理
                 start_next = 0
                 end_next = transport_time_ms + fade_time_ms
-                segment_next_temp = sound[start_next:end_next]
-                # crossfade会在使用时处理
-                segment_next = segment_next_temp
-        else:
-            # 正常情况：继续播放
-            segment_next = sound[start_next:end_next]
 
-        state['next'] = segment_next
-        state['start'] = start
-        state['end'] = end
+        # (片段序号, 淡入, 淡出)，与tile的key相同，混音缓存用它标识片段内容
+        state.segment_key = (index, fade_in, fade_out)
+        state.next_start, state.next_end, state.next_fade_in = start_next, end_next, fade_in_next
+        state.start = start
+        state.end = end
+
+        return segment
 
+    def layer_tiles(self, layer):
+        """当前文件的预渲染片段，同一文件+同样参数在进程内共享一份"""
+        sound_file = {0: self.l0_file, 1: self.l1_file, 2: self.l2_file}[layer]
+        cached = self._layer_tiles.get(layer)
+        if cached is not None and cached[0] == sound_file:
+            return cached[1]
+        sound = {0: self.l0_sound, 1: self.l1_sound, 2: self.l2_sound}[layer]
+        if self.mix_backend == 'numpy':
+            sound = ArraySound(sound)
+        transport_time_ms = 1000 * self.config['transport_time']
+        fade_time_ms = 1000 * self.config['fade_time']
+        params = ('tiles', 'raw' if layer == 0 else 'preprocess', self.mix_backend,
+                  self.config['transport_time'], self.config['fade_time'], self.format_key)
+        tiles = sound_cache.get_or_load(
+            sound_file, lambda: SoundTiles(sound, transport_time_ms, fade_time_ms), params)
+        self._layer_tiles[layer] = (sound_file, tiles)
+        return tiles
+
+    def _next_tile_and_update_state(self, layer, state):
+        """与 simply_generate_next_sound_segment_and_update_state 相同的状态转移，片段从tile中查表"""
+        tiles = self.layer_tiles(layer)
+        transport_time_ms = tiles.transport_ms
+        if state.end is None:
+            start, end = 0, transport_time_ms
+            index, fade_in = 0, state.should_fade_in
+            state.should_fade_in = False
+        else:
+            assert state.next_start is not None, "next segment is None!"
+            start, end = state.end, state.end + transport_time_ms
+            index, fade_in = state.next_start // transport_time_ms, state.next_fade_in
+
+        fade_out = False
+        if end + transport_time_ms >= tiles.length:
+            # 循环：'fade'模式当前片段淡出、下一个片段从头开始并淡入；'direct'模式直接从头开始
+            metrics.inc('loop')
+            fade_out = self.transition_mode == 'fade'
+            start_next, fade_in_next = 0, fade_out
+        else:
+            start_next, fade_in_next = start + transport_time_ms, False
+
+        segment = tiles.get(index, fade_in, fade_out)
+        state.segment_key = (index, fade_in, fade_out)
+        state.next_start, state.next_end, state.next_fade_in = \
+            start_next, start_next + transport_time_ms, fade_in_next
+        state.start = start
+        state.end = end
         return segment
 
+    def load_sound(self, sound_file):
+        """加载原始音频（不做预处理），同一文件在进程内共享一份；长文件按窗口解码（见windowed）"""
+        with metrics.stage('load'):
+            sound = open_windowed(sound_file, self.profile)
+            if sound is not None:
+                return sound
+            # 解码源文件时顺便记录时长与响度，之后这个文件（足够长时）可以按窗口解码
+            return sound_cache.get_or_load(sound_file, lambda: open_sound(sound_file, self.profile),
+                                           ('raw', self.format_key))
+
     def load_and_preprocess_sound(self, sound_file):
-        """加载并预处理音频文件"""
-        sound = AudioSegment.from_file(sound_file)
+        """加载并预处理音频文件，同一文件+同样的预处理参数在进程内共享一份；长文件按窗口解码（见windowed）"""
+        params = ('preprocess', self.config['transport_time'], self.config['fade_time'], self.format_key)
+        with metrics.stage('load'):
+            sound = open_windowed(sound_file, self.profile)
+            if sound is not None:
+                # 响度来自元数据，增益在读取窗口时才乘上；长文件不需要循环补长
+                return sound_cache.get_or_load(
+                    sound_file, lambda: sound.apply_gain(PREPROCESS_TARGET_DBFS - sound.dBFS), params + ('windowed',))
+            return sound_cache.get_or_load(sound_file, lambda: self._load_and_preprocess_sound(sound_file), params)
+
+    def _load_and_preprocess_sound(self, sound_file):
+        with metrics.stage('decode'):
+            sound = open_sound(sound_file, self.profile)
 
         # 音量归一化到-20dBFS（避免过大或过小）
         # -20dBFS是一个合适的目标音量，既不会太大也不会太小
-        target_dBFS = -20.0
-        change_in_dBFS = target_dBFS - sound.dBFS
-        sound = sound.apply_gain(change_in_dBFS)
+        target_dBFS = PREPROCESS_TARGET_DBFS
+        with metrics.stage('loudness'):
+            # 文件的dBFS只扫描一次，之后从元数据中读取
+            change_in_dBFS = target_dBFS - sound_meta.dBFS(sound_file, sound)
+            sound = sound.apply_gain(change_in_dBFS)
 
         # 如果文件太短，循环一次
         if len(sound) < 1000 * self.config['transport_time']:
             sound = sound.append(sound, crossfade=1000 * self.config['fade_time'])
         return sound
 
-    def match_and_generate(self, heart_rate):
+    def push_heart_rate(self, heart_rate, timestamp=None):
+        """写入一个心率样本（可以比音频tick频繁得多），之后用 match_and_generate() 不传心率来生成"""
+        self.hr_memory.append(heart_rate, timestamp)
+
+    def match_and_generate(self, heart_rate=None):
         """
         核心方法：根据心率匹配并生成音乐片段
 
+        heart_rate为None时使用 push_heart_rate 写入的最新心率（此时不再重复写入心率记忆）
         返回：10秒的混合音频片段（L0 + L1 + L2）
         """
-        # 初始化L1、L2（仅第一次）
+        record = heart_rate is not None
+        if not record:
+            heart_rate = self.hr_memory.latest
+            assert heart_rate is not None, 'no heart rate pushed yet'
+
+        with metrics.stage('tick'):
+            l0_segment, l1_segment, l2_segment = self.generate_layers(heart_rate)
+
+            # 混合三层音频：L0降低6dB，L1保持，L2降低3dB，最后归一化到-14dBFS（见mixer）
+            key = self.mix_key()
+            if key is None:
+                segment = self.mixer.mix(l0_segment, l1_segment, l2_segment)
+            else:
+                segment = mix_cache.get_or_create(key, lambda: self.mixer.mix(l0_segment, l1_segment, l2_segment))
+
+        # 更新心率记忆
+        if record:
+            self.hr_memory.append(heart_rate)
+
+        return segment
+
+    def mix_key(self):
+        """
+        当前tick混音结果的缓存key，未启用mix_cache或片段无法标识时返回None
+        key = (混音器, 增益, 目标响度, transport_time, fade_time, 每层(音频的sound_cache key, 片段序号, 淡入, 淡出))
+        sound_cache key = (文件, mtime, 加载参数)，同一文件的不同加载结果（例如文件被替换后重新加载）不会混淆，
+        对象被淘汰、id被复用也不影响
+        """
+        if not self.mix_cache:
+            return None
+        layers = []
+        for sound, state in ((self.l0_sound, self.l0_state), (self.l1_sound, self.l1_state),
+                             (self.l2_sound, self.l2_state)):
+            cache_key = getattr(sound, 'cache_key', None)
+            if state.segment_key is None or cache_key is None:
+                return None
+            layers.append((cache_key,) + state.segment_key)
+        mixer = self.mixer
+        return (type(mixer).__name__, tuple(mixer.layer_gains), mixer.target_dBFS,
+                self.config['transport_time'], self.config['fade_time'], tuple(layers))
+
+    def stream(self, heart_rates, fmt='pcm', chunk_ms=200, realtime=False, **kwargs):
+        """
+        流式生成：按heart_rates（可迭代对象或queue.Queue）连续生成，yield编码后的小块bytes
+        fmt: 'pcm' / 'wav' / 'mp3' / 'opus'，整个流只使用一个编码器，见streaming.stream_session
+        """
+        return stream_session(self, heart_rates, fmt=fmt, chunk_ms=chunk_ms, realtime=realtime, **kwargs)
+
+    def prepare_layers(self, heart_rate):
+        """初始化L1、L2（仅第一次）"""
         if self.hr_memory.is_empty or \
-           (max(self.hr_memory['time']) - min(self.hr_memory['time']) < self.config['memory_min_time']):
+           self.hr_memory.span < self.config['memory_min_time']:
             if self.l1_file is None:
                 self.l1_file = self.match_by_layer(heart_rate, 1)
                 self.l1_sound = self.load_and_preprocess_sound(self.l1_file)
             if self.l2_file is None:
                 # 优先使用与L1相同BPM的L2文件
                 if self.l1_file is not None:
-                    potential_l2_file = self.l1_file.replace('_L1.mp3', '_L2.mp3')
-                    if os.path.exists(potential_l2_file):
+                    potential_l2_file = layer_file(self.l1_file, 2)
+                    if sound_catalog.contains(potential_l2_file):
                         self.l2_file = potential_l2_file
                     else:
                         self.l2_file = self.match_by_layer(heart_rate, 2)
@@ -369,33 +594,19 @@ class RelaxMusicSessionV2:
                     self.l2_file = self.match_by_layer(heart_rate, 2)
                 self.l2_sound = self.load_and_preprocess_sound(self.l2_file)
 
+    def generate_layers(self, heart_rate, l2_decision=None):
+        """生成三层各自的片段（未混音），返回 (l0_segment, l1_segment, l2_segment)"""
+        self.prepare_layers(heart_rate)
+
         # 生成各层片段
         l0_segment = self.generate_l0_segment_and_update_l0(heart_rate)
         l1_segment = self.generate_l1_segment_and_update_l1(heart_rate)
-        l2_segment = self.generate_l2_segment_and_update_l2(heart_rate)
+        l2_segment = self.generate_l2_segment_and_update_l2(heart_rate, l2_decision)
 
         # 验证长度一致
         assert len(l0_segment) == len(l1_segment) == len(l2_segment), \
             f"segments are different length! L0={len(l0_segment)}, L1={len(l1_segment)}, L2={len(l2_segment)}"
-
-        # 混合三层音频（使用音量控制避免过载）
-        # L0: 环境音，降低6dB（音量减半）
-        # L1: 主旋律，保持原音量
-        # L2: 和声，降低3dB
-        segment = l0_segment - 6  # 环境音降低
-        segment = segment.overlay(l1_segment)  # 主旋律
-        segment = segment.overlay(l2_segment - 3)  # 和声降低
-
-        # 对最终混合结果进行音量归一化，避免削波失真
-        # 归一化到-14dBFS（比单轨略响，因为是混合音频）
-        target_dBFS = -14.0
-        change_in_dBFS = target_dBFS - segment.dBFS
-        segment = segment.apply_gain(change_in_dBFS)
-
-        # 更新心率记忆
-        self.hr_memory.append(heart_rate)
-
-        return segment
+        return l0_segment, l1_segment, l2_segment
 
 
 # ============ 使用示例 ============
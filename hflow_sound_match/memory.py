@@ -1,32 +1,102 @@
+import sys
 import time
+from collections import deque
 
 
 # ==============================================================
 class HeartMemory:
-    def __init__(self, time_length):
-        self.memory = {"hr": [], "time": []}
+    """
+    按时间滑动的心率窗口：保留最近time_length秒内的心率，以及窗口边缘处（恰好在或早于边缘）的一个样本，
+    这样样本时间有抖动时span也能达到time_length（L2规则用 span >= slide_window 判断窗口是否已覆盖）。
+
+    - append 均摊O(1)：按时间淘汰所有过期样本，维护累加和以及单调队列的最小/最大值
+    - mean_hr / min_hr / max_hr / span / amplitude 都是O(1)
+    - clock 可注入（离线回放时使用模拟时间），append 也可以直接传入timestamp
+    心率可以以1~4Hz的频率写入，与10秒一次的音频tick无关。
+    """
+
+    def __init__(self, time_length, clock=None):
         self.time_length = time_length
-        self.min_hr, self.max_hr, self.mean_hr = None, None, None
+        self.clock = clock
+        self._hrs = deque()
+        self._times = deque()
+        self._sum = 0.0
+        # 单调队列，元素为 (序号, 心率)
+        self._min_queue = deque()
+        self._max_queue = deque()
+        self._first_seq = 0
+        self._next_seq = 0
 
     def __getitem__(self, key):
-        """支持 memory['hr'] 和 memory['time'] 访问"""
-        return self.memory[key]
+        """支持 memory['hr'] 和 memory['time'] 访问（返回拷贝，仅为兼容旧代码）"""
+        return list({"hr": self._hrs, "time": self._times}[key])
+
+    def __len__(self):
+        return len(self._hrs)
 
     @property
     def is_empty(self):
-        return self.min_hr is None
+        return not self._hrs
+
+    @property
+    def mean_hr(self):
+        return self._sum / len(self._hrs) if self._hrs else None
+
+    @property
+    def min_hr(self):
+        return self._min_queue[0][1] if self._min_queue else None
+
+    @property
+    def max_hr(self):
+        return self._max_queue[0][1] if self._max_queue else None
+
+    @property
+    def amplitude(self):
+        return self._max_queue[0][1] - self._min_queue[0][1] if self._hrs else None
+
+    @property
+    def span(self):
+        """窗口覆盖的时间长度（最新与最早样本的时间差）"""
+        return self._times[-1] - self._times[0] if self._times else 0
+
+    @property
+    def latest(self):
+        return self._hrs[-1] if self._hrs else None
+
+    @property
+    def nbytes(self):
+        return sum(sys.getsizeof(i) for i in (self._hrs, self._times, self._min_queue, self._max_queue))
+
+    def now(self):
+        return self.clock() if self.clock is not None else time.time()
 
     def drop_first(self):
-        assert len(self.memory['hr']) > 0, "HeartMemory is empty."
-        self.memory['hr'].pop(0)
-        self.memory['time'].pop(0)
-
-    def append(self, heart_rate):
-        current_time = time.time()
-        self.memory['hr'].append(heart_rate)
-        self.memory['time'].append(current_time)
-        if current_time - min(self.memory['time']) > self.time_length:
+        assert len(self._hrs) > 0, "HeartMemory is empty."
+        self._sum -= self._hrs.popleft()
+        self._times.popleft()
+        seq = self._first_seq
+        self._first_seq += 1
+        if self._min_queue and self._min_queue[0][0] == seq:
+            self._min_queue.popleft()
+        if self._max_queue and self._max_queue[0][0] == seq:
+            self._max_queue.popleft()
+
+    def append(self, heart_rate, timestamp=None):
+        current_time = self.now() if timestamp is None else timestamp
+        if self._times and current_time < self._times[-1]:
+            # 时间戳必须单调不减，乱序样本按最新时间处理
+            current_time = self._times[-1]
+        seq = self._next_seq
+        self._next_seq += 1
+        self._hrs.append(heart_rate)
+        self._times.append(current_time)
+        self._sum += heart_rate
+        while self._min_queue and self._min_queue[-1][1] >= heart_rate:
+            self._min_queue.pop()
+        self._min_queue.append((seq, heart_rate))
+        while self._max_queue and self._max_queue[-1][1] <= heart_rate:
+            self._max_queue.pop()
+        self._max_queue.append((seq, heart_rate))
+        edge = current_time - self.time_length
+        while len(self._times) > 1 and self._times[1] <= edge:
             self.drop_first()
-        self.mean_hr = sum(self.memory['hr'])/len(self.memory['hr'])
-        self.min_hr = min(self.memory['hr'])
-        self.max_hr = max(self.memory['hr'])
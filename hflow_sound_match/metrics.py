@@ -0,0 +1,180 @@
+"""热路径耗时统计
+#################################################
+    with metrics.stage('decode'):
+        sound = open_sound(sound_file)
+    metrics.inc('l1_switch')
+
+    @timed('slice_fade')
+    def simply_generate_next_sound_segment_and_update_state(self, layer): ...
+
+- stage耗时按名字聚合成直方图（Prometheus风格的累积bucket），事件计数聚合成counter
+- export_prometheus() 输出Prometheus文本格式；add_callback(fn) 在每次记录时回调 fn(kind, name, value)
+- 默认关闭（config metrics_enabled）：关闭时 stage() 返回同一个空的context manager，inc() 直接返回
+
+阶段：
+    tick          一次 match_and_generate
+    batch_tick    一次 SessionPool.match_and_generate_batch
+    match         心率 -> 候选文件（索引查询）
+    catalog_scan  目录扫描/重建索引
+    load          load_and_preprocess_sound（含缓存命中）
+    decode        解码（ffmpeg或PCM store）
+    loudness      响度归一化（dBFS + apply_gain）
+    slice_fade    各层切片与淡入淡出
+    overlay       三层叠加
+    mix_gain      混音后的最终归一化(apply_gain)
+事件：l1_switch、l2_switch、loop、deadline_miss（scheduler）；缓存命中/未命中/淘汰在导出时从sound_cache.stats()、mix_cache.stats()读取。
+"""
+import bisect
+import functools
+import threading
+from contextlib import nullcontext
+from time import perf_counter
+from .config import cfg
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_NULL_STAGE = nullcontext()
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # 最后一个是 +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """[(le, 累积计数), ...]，最后一项le为'+Inf'"""
+        total, rows = 0, []
+        for le, count in zip(list(self.buckets) + ['+Inf'], self.counts):
+            total += count
+            rows.append((le, total))
+        return rows
+
+    def to_dict(self):
+        return {'count': self.count, 'sum': self.sum, 'buckets': self.cumulative()}
+
+
+class _StageTimer:
+    __slots__ = ('metrics', 'name', 'started_at')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.started_at = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, perf_counter() - self.started_at)
+        return False
+
+
+class Metrics:
+    def __init__(self, enabled=False, buckets=DEFAULT_BUCKETS, prefix='hflow'):
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self.prefix = prefix
+        self._stages = {}
+        self._counters = {}
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def stage(self, name):
+        return _StageTimer(self, name) if self.enabled else _NULL_STAGE
+
+    def observe(self, name, seconds):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._stages.get(name)
+            if histogram is None:
+                histogram = self._stages[name] = Histogram(self.buckets)
+            histogram.observe(seconds)
+        for callback in self._callbacks:
+            callback('stage', name, seconds)
+
+    def inc(self, name, value=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+        for callback in self._callbacks:
+            callback('counter', name, value)
+
+    def add_callback(self, callback):
+        self._callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        self._callbacks.remove(callback)
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self._counters.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'stages': {name: h.to_dict() for name, h in self._stages.items()},
+                'counters': dict(self._counters),
+            }
+
+    def export_prometheus(self):
+        from .cache import sound_cache, mix_cache
+        p = self.prefix
+        snapshot = self.snapshot()
+        lines = [
+            '# HELP {}_stage_seconds Time spent in each hot-path stage.'.format(p),
+            '# TYPE {}_stage_seconds histogram'.format(p),
+        ]
+        for name, h in sorted(snapshot['stages'].items()):
+            for le, count in h['buckets']:
+                lines.append('{}_stage_seconds_bucket{{stage="{}",le="{}"}} {}'.format(p, name, le, count))
+            lines.append('{}_stage_seconds_sum{{stage="{}"}} {}'.format(p, name, h['sum']))
+            lines.append('{}_stage_seconds_count{{stage="{}"}} {}'.format(p, name, h['count']))
+        lines += [
+            '# HELP {}_events_total Layer switches and loops.'.format(p),
+            '# TYPE {}_events_total counter'.format(p),
+        ]
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append('{}_events_total{{event="{}"}} {}'.format(p, name, value))
+        for name, cache in (('sound_cache', sound_cache.stats()), ('mix_cache', mix_cache.stats())):
+            for key in ('hits', 'misses', 'evictions'):
+                lines += ['# TYPE {}_{}_{}_total counter'.format(p, name, key),
+                          '{}_{}_{}_total {}'.format(p, name, key, cache[key])]
+            for key in ('items', 'bytes', 'max_bytes'):
+                lines += ['# TYPE {}_{}_{} gauge'.format(p, name, key),
+                          '{}_{}_{} {}'.format(p, name, key, cache[key])]
+        return '\n'.join(lines) + '\n'
+
+
+# 进程内共享
+metrics = Metrics(enabled=cfg.get('metrics_enabled', False))
+
+
+def timed(name):
+    """把整个函数记为一个stage的装饰器（关闭时只多一次属性判断）"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return func(*args, **kwargs)
+            with _StageTimer(metrics, name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,261 @@
+"""三层混音
+#################################################
+PydubMixer: 原始实现（AudioSegment的 -6 / overlay / dBFS / apply_gain）
+NumpyMixer: 在float32数组上做同样的事，每个tick只有几次向量化运算：
+    - 层增益、RMS归一化到-14dBFS、削波保护一次完成
+    - 切片是对原始样本的零拷贝视图（ArraySound/ArraySegment），淡入淡出用预先算好的增益曲线
+    - 输出与pydub路径的差异在量化误差级别（pydub每一步都取整/截断，这里只在最后取整一次）
+
+用法：RelaxMusicSessionV2(mix_backend='numpy')
+"""
+import functools
+import numpy as np
+from pydub import AudioSegment
+from pydub.utils import db_to_float
+from .metrics import metrics
+
+SAMPLE_DTYPES = {1: np.int8, 2: np.int16, 4: np.int32}
+
+# 与pydub的fade_in/fade_out一致：从-120dB线性（幅度）变化到0dB
+FADE_SILENCE_DB = -120
+
+
+def max_possible_amplitude(sample_width):
+    return (2 ** (sample_width * 8)) / 2
+
+
+def frame_position(ms, frame_rate):
+    """毫秒 -> 帧下标（与AudioSegment._parse_position一致）"""
+    return int(ms * (frame_rate / 1000.0))
+
+
+@functools.lru_cache(maxsize=256)
+def fade_ramp(frame_rate, start_ms, duration_ms, fade_in=True):
+    """
+    从start_ms开始、持续duration_ms的逐帧增益曲线（只读）。
+    与pydub一致：超过100ms的淡变每毫秒一个增益台阶，否则每帧一个台阶。
+    """
+    from_power = db_to_float(FADE_SILENCE_DB) if fade_in else 1.0
+    to_power = 1.0 if fade_in else db_to_float(FADE_SILENCE_DB)
+    start = frame_position(start_ms, frame_rate)
+    end = frame_position(start_ms + duration_ms, frame_rate)
+    if duration_ms > 100:
+        steps = from_power + (to_power - from_power) / duration_ms * np.arange(duration_ms)
+        bounds = [frame_position(start_ms + i, frame_rate) for i in range(duration_ms + 1)]
+        ramp = np.repeat(steps, np.diff(bounds))
+    else:
+        n = end - start
+        ramp = from_power + (to_power - from_power) / max(n, 1) * np.arange(n)
+    ramp = ramp.astype(np.float32)[:, None]
+    ramp.flags.writeable = False
+    return ramp
+
+
+class ArraySegment:
+    """
+    一段音频的数组表示，形状 (frames, channels)。
+    samples 可以是原始整型样本的视图（尚未拷贝），也可以是float32（做过淡入淡出之后）。
+    gain 为尚未乘上的增益（dB），与PCMSound的惰性增益对应。
+    """
+    __slots__ = ('samples', 'frame_rate', 'sample_width', 'gain')
+
+    def __init__(self, samples, frame_rate, sample_width, gain=0.0):
+        self.samples = samples
+        self.frame_rate = frame_rate
+        self.sample_width = sample_width
+        self.gain = gain
+
+    @property
+    def channels(self):
+        return self.samples.shape[1]
+
+    def __len__(self):
+        return round(1000 * (len(self.samples) / self.frame_rate))
+
+    def as_float(self):
+        """float32样本（幅度单位与原始整型一致），可能返回内部数组，不要原地修改"""
+        if self.samples.dtype == np.float32 and not self.gain:
+            return self.samples
+        samples = self.samples.astype(np.float32)
+        if self.gain:
+            samples *= np.float32(db_to_float(float(self.gain)))
+        return samples
+
+    def _faded(self, duration, fade_in):
+        duration = int(duration)
+        length = len(self)
+        if fade_in:
+            start_ms = 0
+        else:
+            start_ms = max(length - duration, 0)
+        duration = min(duration, length - start_ms)
+        samples = self.as_float().copy()
+        ramp = fade_ramp(self.frame_rate, start_ms, duration, fade_in)
+        start = frame_position(start_ms, self.frame_rate)
+        end = min(start + len(ramp), len(samples))
+        samples[start:end] *= ramp[:end - start]
+        if not fade_in:
+            # 与pydub一致：淡出结束之后的部分静音
+            samples[end:] *= np.float32(db_to_float(FADE_SILENCE_DB))
+        return ArraySegment(samples, self.frame_rate, self.sample_width)
+
+    def fade_in(self, duration):
+        return self._faded(duration, True)
+
+    def fade_out(self, duration):
+        return self._faded(duration, False)
+
+    def to_audio_segment(self):
+        return AudioSegment(
+            data=to_int_samples(self.as_float(), self.sample_width).tobytes(),
+            sample_width=self.sample_width,
+            frame_rate=self.frame_rate,
+            channels=self.channels,
+        )
+
+
+class ArraySound:
+    """
+    AudioSegment / PCMSound 的数组视图，切片返回ArraySegment（不拷贝数据）。
+    只在session内部临时使用，不改变缓存中的对象。
+    """
+    __slots__ = ('samples', 'frame_rate', 'sample_width', 'gain')
+
+    def __init__(self, sound):
+        self.frame_rate = sound.frame_rate
+        self.sample_width = sound.sample_width
+        if isinstance(sound, AudioSegment):
+            dtype = SAMPLE_DTYPES[sound.sample_width]
+            self.samples = np.frombuffer(sound.raw_data, dtype=dtype).reshape(-1, sound.channels)
+            self.gain = 0.0
+        else:
+            # PCMSound：memmap + 惰性增益
+            self.samples = sound.samples
+            self.gain = sound.gain
+
+    def __len__(self):
+        return round(1000 * (len(self.samples) / self.frame_rate))
+
+    def __getitem__(self, millisecond):
+        assert isinstance(millisecond, slice) and not millisecond.step, 'only [start:end] slicing is supported'
+        length = len(self)
+        start = min(millisecond.start if millisecond.start is not None else 0, length)
+        end = min(millisecond.stop if millisecond.stop is not None else length, length)
+        start, end = frame_position(start, self.frame_rate), frame_position(end, self.frame_rate)
+        samples = self.samples[start:end]
+        # 与AudioSegment一致：舍入误差导致的缺帧补静音
+        missing_frames = (end - start) - len(samples)
+        if missing_frames > 0:
+            samples = np.concatenate([samples, np.zeros((missing_frames, samples.shape[1]), dtype=samples.dtype)])
+        return ArraySegment(samples, self.frame_rate, self.sample_width, self.gain)
+
+
+def to_int_samples(samples, sample_width):
+    """float -> 整型样本，向下取整并截断到满幅（削波保护）"""
+    info = np.iinfo(SAMPLE_DTYPES[sample_width])
+    out = np.floor(samples)
+    np.clip(out, info.min, info.max, out=out)
+    return out.astype(info.dtype)
+
+
+class PydubMixer:
+    def __init__(self, layer_gains=(-6, 0, -3), target_dBFS=-14.0):
+        self.layer_gains = layer_gains
+        self.target_dBFS = target_dBFS
+
+    def mix(self, l0_segment, l1_segment, l2_segment):
+        # 混合三层音频（使用音量控制避免过载）
+        # L0: 环境音，降低6dB（音量减半）
+        # L1: 主旋律，保持原音量
+        # L2: 和声，降低3dB
+        g0, g1, g2 = self.layer_gains
+        with metrics.stage('overlay'):
+            segment = l0_segment + g0  # 环境音降低
+            segment = segment.overlay(l1_segment + g1 if g1 else l1_segment)  # 主旋律
+            segment = segment.overlay(l2_segment + g2)  # 和声降低
+
+        # 对最终混合结果进行音量归一化，避免削波失真
+        # 归一化到-14dBFS（比单轨略响，因为是混合音频）
+        with metrics.stage('mix_gain'):
+            change_in_dBFS = self.target_dBFS - segment.dBFS
+            segment = segment.apply_gain(change_in_dBFS)
+        return segment
+
+    def mix_batch(self, layers):
+        """layers: [(l0_segment, l1_segment, l2_segment), ...]"""
+        return [self.mix(*i) for i in layers]
+
+
+class NumpyMixer(PydubMixer):
+    @staticmethod
+    def _mixable(segments):
+        return all(isinstance(i, ArraySegment) for i in segments) and \
+            len({(i.frame_rate, i.channels, i.sample_width) for i in segments}) == 1
+
+    def _sum_layers(self, segments, out):
+        """按层增益把三层累加到out (frames, channels)"""
+        for segment, gain in zip(segments, self.layer_gains):
+            samples = segment.as_float()[:len(out)]
+            if gain:
+                out += samples * np.float32(db_to_float(gain))
+            else:
+                out += samples
+
+    def _normalize(self, mixed, sample_width):
+        """在最后两维 (frames, channels) 上把RMS归一化到target_dBFS，支持前面多一个batch维"""
+        rms = np.sqrt(np.mean(np.square(mixed, dtype=np.float64), axis=(-2, -1), keepdims=True))
+        target_rms = max_possible_amplitude(sample_width) * db_to_float(self.target_dBFS)
+        gain = np.divide(target_rms, rms, out=np.ones_like(rms), where=rms > 0)
+        mixed *= gain.astype(np.float32)
+        return to_int_samples(mixed, sample_width)
+
+    def mix(self, l0_segment, l1_segment, l2_segment):
+        segments = [l0_segment, l1_segment, l2_segment]
+        if not self._mixable(segments):
+            # 格式不一致时交给pydub做重采样/声道转换
+            segments = [i.to_audio_segment() if isinstance(i, ArraySegment) else i for i in segments]
+            return PydubMixer.mix(self, *segments)
+
+        n = min(len(i.samples) for i in segments)
+        mixed = np.zeros((n, segments[0].channels), dtype=np.float32)
+        with metrics.stage('overlay'):
+            self._sum_layers(segments, mixed)
+        with metrics.stage('mix_gain'):
+            samples = self._normalize(mixed, segments[0].sample_width)
+        return AudioSegment(
+            data=samples.tobytes(),
+            sample_width=segments[0].sample_width,
+            frame_rate=segments[0].frame_rate,
+            channels=segments[0].channels,
+        )
+
+    def mix_batch(self, layers):
+        """格式与长度相同的session堆叠成 (sessions, frames, channels) 一次完成归一化和量化"""
+        results = [None] * len(layers)
+        groups = {}
+        for i, segments in enumerate(layers):
+            if self._mixable(segments):
+                head = segments[0]
+                n = min(len(j.samples) for j in segments)
+                groups.setdefault((head.frame_rate, head.channels, head.sample_width, n), []).append(i)
+            else:
+                results[i] = self.mix(*segments)
+        for (frame_rate, channels, sample_width, n), indexes in groups.items():
+            mixed = np.zeros((len(indexes), n, channels), dtype=np.float32)
+            with metrics.stage('overlay'):
+                for row, i in enumerate(indexes):
+                    self._sum_layers(layers[i], mixed[row])
+            with metrics.stage('mix_gain'):
+                samples = self._normalize(mixed, sample_width)
+            for row, i in enumerate(indexes):
+                results[i] = AudioSegment(data=samples[row].tobytes(), sample_width=sample_width,
+                                          frame_rate=frame_rate, channels=channels)
+        return results
+
+
+# 混音器没有状态，所有session共享一个实例
+_MIXERS = {'pydub': PydubMixer(), 'numpy': NumpyMixer()}
+
+
+def get_mixer(backend):
+    return _MIXERS[backend]
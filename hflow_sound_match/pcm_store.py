@@ -0,0 +1,432 @@
+"""预解码的PCM音乐库
+#################################################
+离线把 sound_folders_root 下的所有音频解码成统一格式的裸PCM（每个文件一个 .pcm）并写一个 manifest.json；
+运行时用 np.memmap 打开，切片是零拷贝的视图，多个worker进程通过系统page cache共享同一份数据。
+
+编译：
+    python -m hflow_sound_match.pcm_store --out /data/pcm_store
+使用：
+    config.json 中设置 "pcm_store_root": "/data/pcm_store"
+    之后 open_sound 会优先从store中打开（源文件mtime/size与manifest一致时），否则回退到ffmpeg解码。
+
+统一格式：config.json 的 "sample_format"（frame_rate / channels / sample_width）是整个音乐库的规范格式，
+open_sound 返回的音频都已转换成这个格式（解码时转换一次，之后随sound_cache共享），
+所以三层格式总是一致，每个tick混音时pydub不再重采样/转换声道（AudioSegment._sync）。
+每秒音频占用 frame_rate * channels * sample_width 字节。"sample_format": null 时保持文件原格式。
+
+质量档位：config.json 的 "quality_profiles" 定义低成本的格式（例如单声道22kHz），session用 profile= 选择，
+open_sound(sound_file, profile) 返回该格式的音频，ffmpeg解码时直接重采样/下混（见profile_format、decode_file）。
+
+解码并发：ffmpeg解码经过 decode_limiter，同时进行的解码数不超过 "max_concurrent_decodes"（0为不限制）。
+"""
+import os
+import json
+import time
+import argparse
+import threading
+import subprocess
+import numpy as np
+from pydub import AudioSegment
+from pydub.exceptions import CouldntDecodeError
+from pydub.utils import db_to_float, ratio_to_db
+from loguru import logger
+from .config import cfg
+from .utils import FilesHelper, write_json_atomic
+from .sound_meta import sound_meta
+
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 1
+DEFAULT_FORMAT = {'frame_rate': 44100, 'channels': 2, 'sample_width': 2}
+SAMPLE_DTYPES = {1: np.int8, 2: np.int16, 4: np.int32}
+# ffmpeg输出的裸PCM格式（-f / -acodec pcm_*）
+PCM_CODECS = {1: 's8', 2: 's16le', 4: 's32le'}
+
+
+def canonical_format():
+    """配置的规范格式 {'frame_rate', 'channels', 'sample_width'}，未配置的字段取DEFAULT_FORMAT；null时返回None"""
+    fmt = cfg.get('sample_format', DEFAULT_FORMAT)
+    if fmt is None:
+        return None
+    return {key: fmt.get(key) or default for key, default in DEFAULT_FORMAT.items()}
+
+
+def profile_format(profile=None):
+    """
+    质量档位对应的格式：None为规范格式（canonical_format）；
+    否则为 quality_profiles 中的档位，未指定的字段取规范格式（sample_format为null时取DEFAULT_FORMAT）
+    """
+    if profile is None:
+        return canonical_format()
+    profiles = cfg.get('quality_profiles', {})
+    if profile not in profiles:
+        raise ValueError('unknown quality profile {!r}, configured: {}'.format(profile, sorted(profiles)))
+    return dict(canonical_format() or DEFAULT_FORMAT, **(profiles[profile] or {}))
+
+
+def format_key(fmt):
+    """缓存key中的格式 (frame_rate, channels, sample_width)，None为保持源格式"""
+    return None if fmt is None else (fmt['frame_rate'], fmt['channels'], fmt['sample_width'])
+
+
+def conform(sound, fmt):
+    """转换成fmt格式，格式已一致时原样返回（PCM store中的音频保持memmap）"""
+    if fmt is None or (sound.frame_rate, sound.channels, sound.sample_width) == \
+            (fmt['frame_rate'], fmt['channels'], fmt['sample_width']):
+        return sound
+    if isinstance(sound, PCMSound):
+        sound = sound.to_audio_segment()
+    return sound.set_frame_rate(fmt['frame_rate']).set_channels(fmt['channels']).set_sample_width(fmt['sample_width'])
+
+
+class PCMSound:
+    """
+    memmap之上的只读音频，接口与AudioSegment中session用到的部分保持一致
+
+    - 切片返回AudioSegment，只拷贝被切出的那一段
+    - apply_gain是惰性的，只记录增益，在切片时才乘到数据上
+    - window() 返回不带增益的ndarray视图（零拷贝）
+    """
+
+    def __init__(self, samples, frame_rate, sample_width, gain=0.0):
+        self.samples = samples
+        self.frame_rate = frame_rate
+        self.sample_width = sample_width
+        self.gain = gain
+
+    @property
+    def channels(self):
+        return self.samples.shape[1]
+
+    @property
+    def frame_width(self):
+        return self.channels * self.sample_width
+
+    @property
+    def nbytes(self):
+        # 数据在page cache中，不计入进程私有内存
+        return 0
+
+    @property
+    def max_possible_amplitude(self):
+        return (2 ** (self.sample_width * 8)) / 2
+
+    def frame_count(self, ms=None):
+        if ms is not None:
+            return ms * (self.frame_rate / 1000.0)
+        return float(len(self.samples))
+
+    def __len__(self):
+        return round(1000 * (self.frame_count() / self.frame_rate))
+
+    def _frame_position(self, ms):
+        if ms < 0:
+            ms = len(self) - abs(ms)
+        return int(self.frame_count(ms=ms))
+
+    def window(self, start, end):
+        """[start, end) 毫秒对应的样本视图，形状 (frames, channels)"""
+        return self.samples[self._frame_position(start):self._frame_position(end)]
+
+    def __getitem__(self, millisecond):
+        if isinstance(millisecond, slice):
+            start = millisecond.start if millisecond.start is not None else 0
+            end = millisecond.stop if millisecond.stop is not None else len(self)
+            start, end = min(start, len(self)), min(end, len(self))
+        else:
+            start, end = millisecond, millisecond + 1
+        start, end = self._frame_position(start), self._frame_position(end)
+        data = self._apply_gain_to(self.samples[start:end])
+        # 与AudioSegment一致：舍入误差导致的缺帧补静音
+        missing_frames = (end - start) - len(data)
+        if missing_frames > 0:
+            data = np.concatenate([data, np.zeros((missing_frames, self.channels), dtype=data.dtype)])
+        return self._spawn(data)
+
+    def _apply_gain_to(self, samples):
+        if not self.gain:
+            return samples
+        # 与audioop.mul一致：向下取整并截断
+        info = np.iinfo(samples.dtype)
+        scaled = np.floor(samples.astype(np.float64) * db_to_float(float(self.gain)))
+        return np.clip(scaled, info.min, info.max).astype(samples.dtype)
+
+    def _spawn(self, samples):
+        return AudioSegment(
+            data=np.ascontiguousarray(samples).tobytes(),
+            sample_width=self.sample_width,
+            frame_rate=self.frame_rate,
+            channels=self.channels,
+        )
+
+    @property
+    def rms(self):
+        # 分块计算，避免一次性把整个文件转成float64
+        total, n = 0.0, self.samples.size
+        flat = self.samples.reshape(-1)
+        for i in range(0, n, 1 << 20):
+            chunk = flat[i:i + (1 << 20)].astype(np.float64)
+            total += float(np.dot(chunk, chunk))
+        if not n:
+            return 0
+        return int(np.sqrt(total / n) * db_to_float(float(self.gain)))
+
+    @property
+    def dBFS(self):
+        rms = self.rms
+        if not rms:
+            return -float("infinity")
+        return ratio_to_db(rms / self.max_possible_amplitude)
+
+    def apply_gain(self, volume_change):
+        return PCMSound(self.samples, self.frame_rate, self.sample_width, self.gain + volume_change)
+
+    def to_audio_segment(self):
+        return self[:]
+
+    def fade_in(self, duration):
+        return self.to_audio_segment().fade_in(duration)
+
+    def fade_out(self, duration):
+        return self.to_audio_segment().fade_out(duration)
+
+    def append(self, seg, crossfade=100):
+        if isinstance(seg, PCMSound):
+            seg = seg.to_audio_segment()
+        return self.to_audio_segment().append(seg, crossfade=crossfade)
+
+
+class PCMStore:
+    def __init__(self, store_root):
+        self.store_root = os.path.abspath(store_root)
+        with open(os.path.join(self.store_root, MANIFEST_NAME), 'r') as f:
+            manifest = json.load(f)
+        assert manifest.get('version') == MANIFEST_VERSION, 'unsupported pcm store manifest version'
+        self.sound_root = manifest['sound_root']
+        self.format = manifest['format']
+        self.files = manifest['files']
+        self.dtype = SAMPLE_DTYPES[self.format['sample_width']]
+
+    def entry(self, sound_file):
+        """源文件在manifest中的记录；源文件已变化（mtime/size不一致）时返回None"""
+        rel = os.path.relpath(os.path.abspath(sound_file), self.sound_root)
+        entry = self.files.get(rel)
+        if entry is None:
+            return None
+        st = os.stat(sound_file)
+        if st.st_mtime_ns != entry['mtime_ns'] or st.st_size != entry['size']:
+            return None
+        return entry
+
+    def open(self, sound_file):
+        entry = self.entry(sound_file)
+        if entry is None:
+            return None
+        channels = self.format['channels']
+        if entry['frames'] == 0:
+            samples = np.zeros((0, channels), dtype=self.dtype)
+        else:
+            samples = np.memmap(os.path.join(self.store_root, entry['pcm']), dtype=self.dtype, mode='r',
+                                shape=(entry['frames'], channels))
+        return PCMSound(samples, self.format['frame_rate'], self.format['sample_width'])
+
+
+def compile_library(sound_root=None, store_root=None, frame_rate=None, channels=None, sample_width=None,
+                    file_formats=None):
+    """
+    把音乐库编译成PCM store，已编译且源文件未变化的文件会被跳过（增量编译）
+    file_formats默认为config的library_file_formats（与catalog一致）
+    :return: manifest
+    """
+    sound_root = os.path.abspath(sound_root or cfg['sound_folders_root'])
+    store_root = os.path.abspath(store_root or cfg['pcm_store_root'])
+    # 默认使用配置的规范格式，这样运行时从store打开的音频不需要再转换
+    default = canonical_format() or DEFAULT_FORMAT
+    fmt = {
+        'frame_rate': frame_rate or default['frame_rate'],
+        'channels': channels or default['channels'],
+        'sample_width': sample_width or default['sample_width'],
+    }
+    assert fmt['sample_width'] in SAMPLE_DTYPES, 'sample_width must be one of {}'.format(list(SAMPLE_DTYPES))
+    os.makedirs(store_root, exist_ok=True)
+    manifest_path = os.path.join(store_root, MANIFEST_NAME)
+
+    old_files = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            old = json.load(f)
+        if old.get('version') == MANIFEST_VERSION and old.get('format') == fmt and old.get('sound_root') == sound_root:
+            old_files = old['files']
+
+    if file_formats is None:
+        file_formats = cfg.get('library_file_formats', ['mp3'])
+    files = {}
+    for sound_file in FilesHelper.iter_library_files(sound_root, tuple(file_formats)):
+        rel = os.path.relpath(sound_file, sound_root)
+        st = os.stat(sound_file)
+        old_entry = old_files.get(rel)
+        if old_entry is not None and old_entry['mtime_ns'] == st.st_mtime_ns and old_entry['size'] == st.st_size \
+                and os.path.exists(os.path.join(store_root, old_entry['pcm'])):
+            files[rel] = old_entry
+            continue
+        sound = AudioSegment.from_file(sound_file)
+        # 顺便记录响度等元数据（源文件的格式），运行时不必再扫描整个文件；循环结束后一次写入
+        sound_meta.record(sound_file, sound)
+        sound = conform(sound, fmt)
+        pcm_rel = rel + '.pcm'
+        pcm_path = os.path.join(store_root, pcm_rel)
+        os.makedirs(os.path.dirname(pcm_path), exist_ok=True)
+        with open(pcm_path + '.tmp', 'wb') as f:
+            f.write(sound.raw_data)
+        os.replace(pcm_path + '.tmp', pcm_path)
+        files[rel] = {
+            'pcm': pcm_rel,
+            'mtime_ns': st.st_mtime_ns,
+            'size': st.st_size,
+            'frames': int(sound.frame_count()),
+        }
+        logger.info('pcm store: compiled {}'.format(rel))
+
+    manifest = {'version': MANIFEST_VERSION, 'sound_root': sound_root, 'format': fmt, 'files': files}
+    write_json_atomic(manifest_path, manifest)
+    sound_meta.save()
+    return manifest
+
+
+class DecodeLimiter:
+    """
+    限制同时进行的ffmpeg解码数量（limit<=0时不限制），避免切歌集中时解码占满CPU、拖慢其他session的tick。
+    统计：decodes 解码次数，waits 需要等待的次数，wait_seconds 累计等待时间
+    """
+
+    def __init__(self, limit=0):
+        self._cond = threading.Condition()
+        self.limit = limit
+        self.active = 0
+        self.decodes, self.waits, self.wait_seconds = 0, 0, 0.0
+
+    def set_limit(self, limit):
+        with self._cond:
+            self.limit = limit
+            self._cond.notify_all()
+
+    def __enter__(self):
+        with self._cond:
+            if 0 < self.limit <= self.active:
+                self.waits += 1
+                started_at = time.perf_counter()
+                while 0 < self.limit <= self.active:
+                    self._cond.wait()
+                self.wait_seconds += time.perf_counter() - started_at
+            self.active += 1
+            self.decodes += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {'limit': self.limit, 'active': self.active, 'decodes': self.decodes, 'waits': self.waits,
+                    'wait_seconds': round(self.wait_seconds, 3)}
+
+
+decode_limiter = DecodeLimiter(cfg.get('max_concurrent_decodes', 0))
+
+
+def ffmpeg_decode(sound_file, fmt, start_second=None, duration=None, preroll_s=0.1):
+    """
+    直接调用ffmpeg（经过decode_limiter）把 [start_second, start_second + duration) 解码成fmt格式的裸PCM，返回AudioSegment。
+    -ss/-t 放在 -i 之前（输入端定位，只解码需要的部分，耗时与位置无关）；mp3等格式定位后开头几十毫秒
+    与整个文件解码的结果不一致，所以多解码 preroll_s 再丢掉，结果与整个文件解码后的切片逐样本相同
+    """
+    frame_rate, channels, sample_width = fmt['frame_rate'], fmt['channels'], fmt['sample_width']
+    codec = PCM_CODECS[sample_width]
+    preroll_frames = int(round(min(preroll_s, start_second or 0) * frame_rate))
+    cmd = [AudioSegment.converter, '-nostdin', '-v', 'error']
+    if start_second:
+        cmd += ['-ss', '{:.6f}'.format(start_second - preroll_frames / frame_rate)]
+    if duration is not None:
+        cmd += ['-t', '{:.6f}'.format(duration + preroll_frames / frame_rate)]
+    cmd += ['-i', sound_file, '-vn', '-f', codec, '-acodec', 'pcm_' + codec,
+            '-ar', str(frame_rate), '-ac', str(channels), '-']
+    with decode_limiter:
+        p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if p.returncode != 0:
+        raise CouldntDecodeError('decoding {} failed, ffmpeg returned error code {}:\n{}'.format(
+            sound_file, p.returncode, p.stderr.decode(errors='replace')))
+    data = p.stdout[preroll_frames * channels * sample_width:]
+    return AudioSegment(data=data, sample_width=sample_width, frame_rate=frame_rate, channels=channels)
+
+
+_store_lock = threading.Lock()
+_store_state = {'root': None, 'mtime': None, 'store': None}
+
+
+def get_pcm_store():
+    """配置的PCM store（manifest变化后自动重新加载）；未配置或不存在时返回None"""
+    store_root = cfg.get('pcm_store_root')
+    if not store_root:
+        return None
+    manifest_path = os.path.join(store_root, MANIFEST_NAME)
+    try:
+        mtime = os.stat(manifest_path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _store_lock:
+        if _store_state['root'] != store_root or _store_state['mtime'] != mtime:
+            _store_state.update(root=store_root, mtime=mtime, store=PCMStore(store_root))
+        return _store_state['store']
+
+
+def decode_file(sound_file, fmt):
+    """
+    ffmpeg解码整个文件（经过decode_limiter）并转换为fmt。
+    fmt不是规范格式时（低质量档位）ffmpeg直接输出目标格式（-ar/-ac为输出参数，见ffmpeg_decode），不先解码出全格式的数据再转换；
+    否则按源格式解码，顺便记录元数据，再转换为fmt
+    """
+    if fmt is not None and fmt != canonical_format():
+        return ffmpeg_decode(sound_file, fmt)
+    with decode_limiter:
+        sound = AudioSegment.from_file(sound_file)
+    if sound_meta.get(sound_file) is None:
+        # 源格式的音频：顺便记录元数据（只记在内存中），之后长文件可以按窗口解码
+        sound_meta.record(sound_file, sound)
+    return conform(sound, fmt)
+
+
+def open_sound(sound_file, profile=None):
+    """
+    优先从PCM store打开（零拷贝），否则用ffmpeg解码；
+    结果转换为质量档位的格式（profile_format，默认规范格式canonical_format）
+    """
+    fmt = profile_format(profile)
+    store = get_pcm_store()
+    if store is not None:
+        sound = store.open(sound_file)
+        if sound is not None:
+            # 低档位从store转换是预期行为（每个文件+档位在sound_cache中只转换一次）
+            if profile is None and fmt is not None and store.format != fmt and not _store_state.get('format_warned'):
+                _store_state['format_warned'] = True
+                logger.warning('pcm store format {} differs from sample_format {}, converting on load '
+                               '(recompile the store to keep it zero-copy)'.format(store.format, fmt))
+            return conform(sound, fmt)
+    return decode_file(sound_file, fmt)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='compile the sound library into a memory-mappable PCM store')
+    parser.add_argument('--root', default=None, help='sound folders root, defaults to config sound_folders_root')
+    parser.add_argument('--out', default=None, help='store directory, defaults to config pcm_store_root')
+    parser.add_argument('--frame-rate', type=int, default=None, help='defaults to config sample_format')
+    parser.add_argument('--channels', type=int, default=None, help='defaults to config sample_format')
+    parser.add_argument('--sample-width', type=int, default=None, help='defaults to config sample_format')
+    args = parser.parse_args()
+    assert args.out or cfg.get('pcm_store_root'), 'either --out or config pcm_store_root is required'
+    manifest = compile_library(args.root, args.out, args.frame_rate, args.channels, args.sample_width)
+    logger.info('pcm store: {} files'.format(len(manifest['files'])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+"""多session运行时
+#################################################
+SessionPool 按id创建、驱动(tick)、回收 RelaxMusicSessionV2。
+所有session共享进程内的一份音乐库索引(catalog.sound_catalog)和解码/归一化后的音频(cache.sound_cache)，
+session自身只持有文件引用、播放位置、心率记忆等少量状态。
+默认使用 mix_backend='numpy'：切出的片段是共享音频上的视图而不是10秒的拷贝。
+
+每个session的常驻内存（session_memory 的 private_bytes，不含共享音频）：
+    - 三层 match_v2.LayerState：播放位置与标记，各约100字节；下一个片段在tick时才切出，不常驻
+    - 心率记忆：slide_window内的心率与时间戳（每个样本约100字节）
+    - session对象本身与少量引用（文件路径、混音器等）
+    合计约4KB；使用 tiles 时只多引用共享的tile。tick过程中的片段与混音结果是临时的（或在mix_cache中共享）。
+
+    pool = SessionPool()
+    sid = pool.create(emotion=Emotion.peaceful)
+    segment = pool.tick(sid, 75)
+    pool.memory_report()
+    pool.retire(sid)
+"""
+import sys
+import uuid
+import threading
+import numpy as np
+from .cache import sound_cache, mix_cache, sizeof_sound
+from .match_v2 import RelaxMusicSessionV2
+from .compute import evaluate_l2_rules
+from .metrics import timed
+from .utils import FilesHelper
+
+
+def session_memory(session, shared_ids=None):
+    """
+    估算一个session的内存：
+        private_bytes: session独占的数据（未共享的音频、各层状态与心率记忆）
+        shared_bytes: session引用的、与其他session共享的音频（不计入session自身）
+    """
+    if shared_ids is None:
+        shared_ids = sound_cache.shared_ids()
+    private, shared = 0, 0
+    for sound in (session.l0_sound, session.l1_sound, session.l2_sound):
+        if sound is None:
+            continue
+        if id(sound) in shared_ids:
+            shared += sizeof_sound(sound)
+        else:
+            private += sizeof_sound(sound)
+    for state in (session.l0_state, session.l1_state, session.l2_state):
+        private += sys.getsizeof(state)
+    private += session.hr_memory.nbytes
+    private += sys.getsizeof(session.__dict__)
+    return {'private_bytes': private, 'shared_bytes': shared}
+
+
+class SessionPool:
+    def __init__(self, session_cls=RelaxMusicSessionV2, **session_kwargs):
+        self.session_cls = session_cls
+        self.session_kwargs = dict({'mix_backend': 'numpy'}, **session_kwargs)
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, session_id):
+        return session_id in self._sessions
+
+    @property
+    def session_ids(self):
+        return list(self._sessions)
+
+    def create(self, session_id=None, **kwargs):
+        """创建session并返回其id；kwargs覆盖pool的默认session参数"""
+        session_id = session_id if session_id is not None else uuid.uuid4().hex
+        with self._lock:
+            assert session_id not in self._sessions, 'session {} already exists'.format(session_id)
+            # 先占位，避免并发创建同一个id
+            self._sessions[session_id] = None
+        try:
+            session = self.session_cls(**dict(self.session_kwargs, **kwargs))
+        except BaseException:
+            with self._lock:
+                self._sessions.pop(session_id, None)
+            raise
+        with self._lock:
+            self._sessions[session_id] = session
+        return session_id
+
+    def get(self, session_id):
+        session = self._sessions[session_id]
+        assert session is not None, 'session {} is being created'.format(session_id)
+        return session
+
+    def tick(self, session_id, heart_rate):
+        return self.get(session_id).match_and_generate(heart_rate)
+
+    @timed('batch_tick')
+    def match_and_generate_batch(self, heart_rates):
+        """
+        一次为多个session生成片段：{session_id: heart_rate} -> {session_id: segment}
+        heart_rate为None时使用该session通过push_heart_rate写入的最新心率
+
+        - 候选文件按 (情绪, 层) 对整个batch的心率一次向量化查询，session匹配时直接查表
+        - L2切换规则（compute.evaluate_l2_rules）对所有session向量化计算
+        - 混音参数相同的session在一个堆叠数组上完成混音与归一化（numpy后端）
+        - 启用mix_cache的session先查混音缓存，只有未命中的参与混音
+        每个session的结果与单独调用 match_and_generate 相同；帧模式session（frames.FrameSession）逐个生成
+        """
+        frame_ids = [i for i in heart_rates if getattr(self.get(i), 'frame_mode', False)]
+        if frame_ids:
+            results = {i: self.tick(i, heart_rates[i]) for i in frame_ids}
+            results.update(self.match_and_generate_batch(
+                {i: hr for i, hr in heart_rates.items() if i not in results}))
+            return results
+        session_ids = list(heart_rates)
+        sessions = [self.get(i) for i in session_ids]
+        if not sessions:
+            return {}
+        records = [heart_rates[i] is not None for i in session_ids]
+        hrs = [heart_rates[i] if record else session.hr_memory.latest
+               for i, record, session in zip(session_ids, records, sessions)]
+        assert None not in hrs, 'no heart rate pushed yet'
+
+        inputs = list(zip(*[session.l2_rule_inputs() for session in sessions]))
+        switch, rule1_count, prefetch = evaluate_l2_rules(
+            np.asarray(hrs, dtype=np.float64),
+            np.asarray(inputs[0], dtype=np.float64),
+            np.asarray(inputs[1], dtype=np.float64),
+            np.asarray(inputs[2], dtype=np.float64),
+            np.asarray(inputs[3], dtype=np.int64),
+            np.asarray(inputs[4], dtype=bool),
+        )
+
+        match_memo = self.match_candidates(sessions, hrs)
+        layers = []
+        try:
+            for i, (session, heart_rate) in enumerate(zip(sessions, hrs)):
+                session.match_memo = match_memo
+                layers.append(session.generate_layers(heart_rate, (switch[i], rule1_count[i], prefetch[i])))
+        finally:
+            for session in sessions:
+                session.match_memo = None
+
+        segments = [None] * len(sessions)
+        mix_keys = [session.mix_key() for session in sessions]
+        # 同一batch中状态相同的session只查询/混音一次
+        first_index = {}
+        for i, key in enumerate(mix_keys):
+            if key is not None and first_index.setdefault(key, i) == i:
+                segments[i] = mix_cache.get(key)
+
+        # 混音参数相同的session分为一组
+        groups = {}
+        for i, session in enumerate(sessions):
+            if segments[i] is not None or (mix_keys[i] is not None and first_index[mix_keys[i]] != i):
+                continue
+            mixer = session.mixer
+            key = (type(mixer), tuple(mixer.layer_gains), mixer.target_dBFS)
+            groups.setdefault(key, (mixer, []))[1].append(i)
+        for mixer, indexes in groups.values():
+            for i, segment in zip(indexes, mixer.mix_batch([layers[i] for i in indexes])):
+                segments[i] = segment if mix_keys[i] is None else mix_cache.put(mix_keys[i], segment)
+        for i, key in enumerate(mix_keys):
+            if segments[i] is None:
+                cached = mix_cache.get(key)
+                segments[i] = cached if cached is not None else segments[first_index[key]]
+
+        for session, heart_rate, record in zip(sessions, hrs, records):
+            if record:
+                session.hr_memory.append(heart_rate)
+        return dict(zip(session_ids, segments))
+
+    @staticmethod
+    def match_candidates(sessions, heart_rates):
+        """{(情绪, 层, 心率): 候选文件}，同一情绪的所有心率一次查询（catalog.LayerIndex.closest_files_batch）"""
+        by_emotion = {}
+        for session, heart_rate in zip(sessions, heart_rates):
+            by_emotion.setdefault(session.emotion, set()).add(heart_rate)
+        candidates = {}
+        for emotion, emotion_hrs in by_emotion.items():
+            emotion_hrs = sorted(emotion_hrs)
+            for layer in (1, 2):
+                for heart_rate, files in zip(emotion_hrs, FilesHelper.get_closest_files_by_heart_rates(
+                        emotion, layer, emotion_hrs)):
+                    candidates[(emotion, layer, heart_rate)] = files
+        return candidates
+
+    def retire(self, session_id):
+        with self._lock:
+            session = self._sessions.pop(session_id)
+        if session is not None and getattr(session, 'prefetcher', None) is not None:
+            session.prefetcher.close()
+        return session
+
+    def retire_all(self):
+        for session_id in self.session_ids:
+            self.retire(session_id)
+
+    def session_memory(self, session_id):
+        return session_memory(self.get(session_id))
+
+    def memory_report(self):
+        """pool整体与每个session的内存估算（字节）"""
+        shared_ids = sound_cache.shared_ids()
+        per_session = {}
+        for session_id, session in list(self._sessions.items()):
+            if session is not None:
+                per_session[session_id] = session_memory(session, shared_ids)
+        private = np.array([i['private_bytes'] for i in per_session.values()], dtype=np.int64)
+        cache_stats = sound_cache.stats()
+        return {
+            'sessions': len(per_session),
+            'shared_bytes': cache_stats['bytes'],
+            'private_bytes_total': int(private.sum()) if len(private) else 0,
+            'private_bytes_per_session': float(private.mean()) if len(private) else 0.0,
+            'private_bytes_max': int(private.max()) if len(private) else 0,
+            'total_bytes': cache_stats['bytes'] + (int(private.sum()) if len(private) else 0),
+            'per_session': per_session,
+        }
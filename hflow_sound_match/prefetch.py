@@ -0,0 +1,94 @@
+"""L1/L2下一首的后台预取
+#################################################
+某一层快到切换点时，按当前心率先选出候选文件，在后台线程中解码+归一化；
+真正切换时如果预取的文件仍在当前心率的候选集中就直接使用，否则丢弃（wasted）并同步加载。
+
+统计：
+    requested: 发起的预取次数
+    hits: 切换时预取已完成并被使用
+    late: 切换时预取的文件被使用，但还没加载完（同步等待，经由sound_cache合并为一次解码）
+    wasted: 预取了但没有被使用
+    pending: 还在等待切换的预取
+    hit_rate: hits / requested，所有预取中真正省掉了同步加载的比例
+    used_hit_rate: hits / (hits + late)，被使用的预取中已经加载完的比例（不反映浪费的预取）
+    wasted_rate: wasted / requested
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .config import cfg
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_prefetch_executor():
+    """进程内共享的预取线程池"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=cfg.get('prefetch_workers', 2),
+                                               thread_name_prefix='hflow-prefetch')
+    return _executor
+
+
+class Prefetcher:
+    def __init__(self, loader, executor=None):
+        self.loader = loader
+        self.executor = executor
+        self.requested, self.hits, self.late, self.wasted = 0, 0, 0, 0
+        self._pending = {}
+
+    def request(self, layer, file):
+        """后台加载layer的下一首；同一文件已在预取中则忽略"""
+        pending = self._pending.get(layer)
+        if pending is not None:
+            if pending[0] == file:
+                return
+            self._discard(layer)
+        executor = self.executor or get_prefetch_executor()
+        self._pending[layer] = (file, executor.submit(self.loader, file))
+        self.requested += 1
+
+    def take(self, layer, candidates):
+        """
+        切换时调用。预取的文件在candidates中则返回 (file, sound)，
+        sound 为None表示还没加载完，调用者需要同步加载同一个文件；
+        没有可用的预取时返回 (None, None)。
+        """
+        pending = self._pending.pop(layer, None)
+        if pending is None:
+            return None, None
+        file, future = pending
+        if file not in candidates:
+            future.cancel()
+            self.wasted += 1
+            return None, None
+        if future.done() and future.exception() is None:
+            self.hits += 1
+            return file, future.result()
+        self.late += 1
+        return file, None
+
+    def _discard(self, layer):
+        pending = self._pending.pop(layer, None)
+        if pending is not None:
+            pending[1].cancel()
+            self.wasted += 1
+
+    def close(self):
+        for layer in list(self._pending):
+            self._discard(layer)
+
+    def stats(self):
+        used = self.hits + self.late
+        return {
+            'requested': self.requested,
+            'hits': self.hits,
+            'late': self.late,
+            'wasted': self.wasted,
+            'pending': len(self._pending),
+            'hit_rate': self.hits / self.requested if self.requested else 0.0,
+            'used_hit_rate': self.hits / used if used else 0.0,
+            'wasted_rate': self.wasted / self.requested if self.requested else 0.0,
+        }
@@ -0,0 +1,229 @@
+"""离线渲染
+#################################################
+用记录下来的心率轨迹驱动session，在模拟时间上渲染整段音乐，速度只受解码/混音限制：
+
+    python -m hflow_sound_match.render trace1.csv trace2.npy --out-dir out --fmt wav --processes 4
+
+心率轨迹：
+    - CSV: 每行 "timestamp,heart_rate"（秒，可带表头），或每行一个心率
+    - .npy: (n, 2) 的 [timestamp, heart_rate]，或 (n,) 的心率
+    只有心率没有时间戳时，认为每个tick（transport_time秒）一个心率。
+
+- 心率记忆使用模拟时钟（session的clock参数），slide_window / memory_min_time 的判断与实时播放一致
+- 每个tick生成的片段直接写入输出文件（wav/pcm，mp3/opus走一个常驻ffmpeg进程），不在内存中拼接
+- render_many 用进程池并行渲染多条轨迹，子进程使用主进程当前的配置（包括运行时修改过的项）
+"""
+import os
+import sys
+import csv
+import time
+import random
+import wave
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from loguru import logger
+from .config import cfg
+from .streaming import FFmpegStreamEncoder
+
+
+def load_trace(path):
+    """返回 (timestamps或None, heart_rates)"""
+    if path.endswith('.npy'):
+        data = np.load(path)
+    else:
+        rows = []
+        with open(path, newline='') as f:
+            for row in csv.reader(f):
+                try:
+                    rows.append([float(i) for i in row if i.strip()])
+                except ValueError:
+                    # 表头
+                    continue
+        data = np.asarray(rows, dtype=np.float64)
+    data = np.asarray(data, dtype=np.float64)
+    if data.ndim == 2 and data.shape[1] == 1:
+        data = data[:, 0]
+    if data.ndim == 1:
+        return None, data
+    assert data.ndim == 2 and data.shape[1] >= 2, 'trace must be heart rates or (timestamp, heart_rate) rows'
+    order = np.argsort(data[:, 0], kind='stable')
+    return data[order, 0], data[order, 1]
+
+
+class SegmentWriter:
+    """按片段追加写入音频文件，格式由第一个片段决定"""
+
+    def __init__(self, path, fmt=None, bitrate='192k'):
+        self.path = path
+        self.fmt = fmt or os.path.splitext(path)[1].lstrip('.').lower() or 'wav'
+        self.bitrate = bitrate
+        self._file = None
+        self._wave = None
+        self._encoder = None
+        self.frame_rate, self.channels, self.sample_width = None, None, None
+
+    def _open(self, segment):
+        self.frame_rate, self.channels, self.sample_width = segment.frame_rate, segment.channels, segment.sample_width
+        if self.fmt == 'wav':
+            # wave在close时回填RIFF/data长度
+            self._wave = wave.open(self.path, 'wb')
+            self._wave.setnchannels(self.channels)
+            self._wave.setsampwidth(self.sample_width)
+            self._wave.setframerate(self.frame_rate)
+            return
+        self._file = open(self.path, 'wb')
+        if self.fmt != 'pcm':
+            self._encoder = FFmpegStreamEncoder(self.fmt, bitrate=self.bitrate)
+            self._encoder.feed(segment)
+
+    def write(self, segment):
+        if self.frame_rate is None:
+            self._open(segment)
+        elif (segment.frame_rate, segment.channels, segment.sample_width) != \
+                (self.frame_rate, self.channels, self.sample_width):
+            segment = segment.set_frame_rate(self.frame_rate).set_channels(self.channels) \
+                .set_sample_width(self.sample_width)
+        if self._wave is not None:
+            self._wave.writeframesraw(segment.raw_data)
+        elif self._encoder is not None:
+            self._file.write(self._encoder.encode(segment.raw_data))
+        else:
+            self._file.write(segment.raw_data)
+
+    def close(self):
+        if self._wave is not None:
+            self._wave.close()
+        if self._encoder is not None:
+            self._file.write(self._encoder.close())
+        if self._file is not None:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def iter_ticks(timestamps, heart_rates, transport_time):
+    """
+    把心率轨迹切成tick，yield (tick时间, [(时间戳, 心率), ...])
+    tick时间 = 轨迹起点 + k * transport_time，每个tick带上 (上一个tick, 这个tick] 内的样本；
+    最后一个tick之后还有样本时再补一个tick（渲染结果最多比轨迹长不到一个transport_time）
+    """
+    if timestamps is None:
+        for i, heart_rate in enumerate(heart_rates):
+            yield i * transport_time, [(i * transport_time, float(heart_rate))]
+        return
+    if not len(timestamps):
+        return
+    start, end = timestamps[0], timestamps[-1]
+    n_ticks = int(np.floor((end - start) / transport_time)) + 1
+    bounds = np.searchsorted(timestamps, start + np.arange(n_ticks) * transport_time, side='right')
+    lo = 0
+    for k, hi in enumerate(bounds):
+        yield start + k * transport_time, list(zip(timestamps[lo:hi].tolist(), heart_rates[lo:hi].tolist()))
+        lo = hi
+    if lo < len(timestamps):
+        yield start + n_ticks * transport_time, list(zip(timestamps[lo:].tolist(), heart_rates[lo:].tolist()))
+
+
+def render_trace(trace, out_path, fmt=None, emotion=None, seed=0, session_kwargs=None):
+    """
+    渲染一条心率轨迹到out_path，返回统计信息
+    :param trace: 轨迹文件路径，或 (timestamps或None, heart_rates)
+    """
+    from .match_v2 import RelaxMusicSessionV2
+    from .utils import Emotion
+    timestamps, heart_rates = load_trace(trace) if isinstance(trace, str) else trace
+    random.seed(seed)
+    now = [0.0]
+    session = RelaxMusicSessionV2(emotion=emotion or Emotion.peaceful, clock=lambda: now[0],
+                                  **(session_kwargs or {}))
+    transport_time = session.config['transport_time']
+    started_at = time.perf_counter()
+    ticks, audio_ms = 0, 0
+    with SegmentWriter(out_path, fmt) as writer:
+        for tick_time, samples in iter_ticks(timestamps, heart_rates, transport_time):
+            now[0] = tick_time
+            if timestamps is None:
+                # 每个tick一个心率：与实时调用 match_and_generate(heart_rate) 完全一致
+                segment = session.match_and_generate(samples[0][1])
+            else:
+                for timestamp, heart_rate in samples:
+                    session.push_heart_rate(heart_rate, timestamp)
+                segment = session.match_and_generate()
+            writer.write(segment)
+            ticks += 1
+            audio_ms += len(segment)
+    wall = time.perf_counter() - started_at
+    return {
+        'trace': trace if isinstance(trace, str) else None,
+        'out': out_path,
+        'ticks': ticks,
+        'audio_s': audio_ms / 1000,
+        'wall_s': round(wall, 3),
+        'realtime_factor': round(audio_ms / 1000 / wall, 2) if wall > 0 else None,
+    }
+
+
+def _apply_config(config):
+    """子进程不一定继承主进程修改过的配置（spawn），这里整体覆盖，并同步import时按配置创建的单例"""
+    from .catalog import sound_catalog
+    from .cache import sound_cache, mix_cache
+    cfg.update(config)
+    sound_catalog.file_formats = tuple(cfg.get('library_file_formats', ['mp3']))
+    sound_catalog.check_interval = cfg.get('catalog_check_interval', 5)
+    sound_cache.max_bytes = int(cfg.get('sound_cache_max_mb', 1024) * 1024 * 1024)
+    mix_cache.max_bytes = int(cfg.get('mix_cache_max_mb', 256) * 1024 * 1024)
+
+
+def _render_job(config, job):
+    _apply_config(config)
+    # 进程池中每个任务只打印警告以上的日志
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING')
+    return render_trace(**job)
+
+
+def render_many(jobs, processes=None, mp_context=None):
+    """
+    并行渲染，jobs为 render_trace 的参数dict列表；结果顺序与jobs一致
+    """
+    if processes == 1 or len(jobs) <= 1:
+        return [render_trace(**job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=processes, mp_context=mp_context) as executor:
+        return list(executor.map(_render_job, [dict(cfg)] * len(jobs), jobs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='render heart-rate traces to audio files offline')
+    parser.add_argument('traces', nargs='+', help='csv/npy heart-rate traces')
+    parser.add_argument('--out-dir', required=True)
+    parser.add_argument('--fmt', default='wav', choices=['wav', 'pcm', 'mp3', 'opus'])
+    parser.add_argument('--emotion', default=None, help='P / H / S')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--mix-backend', default='numpy', choices=['pydub', 'numpy'])
+    parser.add_argument('--sound-root', default=None, help='overrides config sound_folders_root')
+    args = parser.parse_args()
+    if args.sound_root:
+        cfg['sound_folders_root'] = args.sound_root
+    os.makedirs(args.out_dir, exist_ok=True)
+    ext = {'opus': 'ogg'}.get(args.fmt, args.fmt)
+    jobs = [{
+        'trace': trace,
+        'out_path': os.path.join(args.out_dir, '{}.{}'.format(os.path.splitext(os.path.basename(trace))[0], ext)),
+        'fmt': args.fmt,
+        'emotion': args.emotion,
+        'seed': args.seed + i,
+        'session_kwargs': {'mix_backend': args.mix_backend},
+    } for i, trace in enumerate(args.traces)]
+    for result in render_many(jobs, args.processes):
+        logger.info('render: {out} ({audio_s:.0f}s audio in {wall_s}s, x{realtime_factor})'.format(**result))
+
+
+if __name__ == '__main__':
+    main()
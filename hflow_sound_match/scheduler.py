@@ -0,0 +1,203 @@
+"""按播放截止时间调度多个session的tick
+#################################################
+每个session必须在当前片段播放完之前交付下一个片段：
+    第一个片段的截止时间是开始播放的时刻（默认加入调度后lead_ms），之后每个片段的截止时间 = 上一个截止时间 + 上一个片段的时长
+TickScheduler 用N个工作线程按截止时间最早优先（EDF）执行 match_and_generate，
+片段最早在截止时间前 lead_ms 开始生成（不会无限超前），某个session切歌解码慢时只占用一个线程，
+截止时间更早的session由其他线程先处理；同时进行的ffmpeg解码数由 pcm_store.decode_limiter 限制。
+
+    scheduler = TickScheduler(workers=4, max_decodes=2)
+    session.push_heart_rate(75)
+    scheduler.add(session_id, session, on_segment=lambda session_id, segment: ...)
+    scheduler.start()
+    scheduler.report()    # 每个session的截止时间余量(slack)与错过次数
+    scheduler.stop()
+
+slack = 截止时间 - 交付时间（毫秒），<0 即错过截止时间（播放端会断音）。
+错过之后从交付时刻重新计时（播放端在片段到达后才继续播放），避免一次错过拖累之后所有片段。
+"""
+import os
+import time
+import heapq
+import threading
+from collections import deque
+import numpy as np
+from loguru import logger
+from .metrics import metrics
+from .pcm_store import decode_limiter
+
+
+class SessionDeadline:
+    """一个session的调度状态与统计"""
+    __slots__ = ('session', 'on_segment', 'deadline', 'version', 'ticks', 'misses', 'slack_sum', 'slack_min',
+                 'slack_last')
+
+    def __init__(self, session, on_segment, deadline):
+        self.session = session
+        self.on_segment = on_segment
+        self.deadline = deadline
+        self.version = 0
+        self.ticks, self.misses = 0, 0
+        self.slack_sum, self.slack_min, self.slack_last = 0.0, None, None
+
+    def record(self, slack):
+        self.ticks += 1
+        self.misses += slack < 0
+        self.slack_sum += slack
+        self.slack_min = slack if self.slack_min is None else min(self.slack_min, slack)
+        self.slack_last = slack
+
+    def to_dict(self):
+        return {
+            'ticks': self.ticks,
+            'misses': self.misses,
+            'slack_min_ms': round(1000 * self.slack_min, 3) if self.slack_min is not None else None,
+            'slack_mean_ms': round(1000 * self.slack_sum / self.ticks, 3) if self.ticks else None,
+            'slack_last_ms': round(1000 * self.slack_last, 3) if self.slack_last is not None else None,
+        }
+
+
+class TickScheduler:
+    def __init__(self, workers=None, max_decodes=None, lead_ms=2000, clock=time.monotonic, history=10000):
+        """
+        :param workers: 工作线程数，默认CPU核数（tick主要是CPU计算，线程多于核数只会让每个tick都变慢）
+        :param max_decodes: 同时进行的解码数上限，None时保持配置 max_concurrent_decodes
+        :param lead_ms: 最多提前多久开始生成下一个片段
+        :param history: 用于统计分位数的最近slack个数
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.lead = lead_ms / 1000
+        self.clock = clock
+        if max_decodes is not None:
+            decode_limiter.set_limit(max_decodes)
+        self._entries = {}
+        self._heap = []
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._threads = []
+        self._running = False
+        self._slacks = deque(maxlen=history)
+        self.errors = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _push(self, session_id, entry):
+        """调用时需持有self._cond"""
+        entry.version += 1
+        self._seq += 1
+        heapq.heappush(self._heap, (entry.deadline, self._seq, session_id, entry.version))
+        self._cond.notify()
+
+    def add(self, session_id, session, on_segment=None, start=None):
+        """
+        加入调度，session需要已经写入过心率（push_heart_rate），每次tick使用最新心率
+        :param on_segment: on_segment(session_id, segment)，在工作线程中调用
+        :param start: 开始播放的时刻（clock时间），默认现在+lead_ms（留出生成第一个片段的时间）
+        """
+        with self._cond:
+            assert session_id not in self._entries, 'session {} already scheduled'.format(session_id)
+            entry = self._entries[session_id] = SessionDeadline(
+                session, on_segment, self.clock() + self.lead if start is None else start)
+            self._push(session_id, entry)
+
+    def remove(self, session_id):
+        """移出调度，返回该session的统计；正在生成的片段仍会交付"""
+        with self._cond:
+            entry = self._entries.pop(session_id, None)
+        return entry.to_dict() if entry is not None else None
+
+    def _next(self):
+        """取出截止时间最早且已到生成时间的session；停止时返回None"""
+        with self._cond:
+            while self._running:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                deadline, _, session_id, version = self._heap[0]
+                entry = self._entries.get(session_id)
+                if entry is None or entry.version != version:
+                    # 已移出调度
+                    heapq.heappop(self._heap)
+                    continue
+                wait = deadline - self.lead - self.clock()
+                if wait > 0:
+                    # clock不一定是真实时间（例如加速的模拟时钟），最多等待20毫秒后重新检查
+                    self._cond.wait(min(wait, 0.02))
+                    continue
+                heapq.heappop(self._heap)
+                return session_id, entry
+            return None
+
+    def _tick(self, session_id, entry):
+        """执行一次tick并交付，更新统计与下一个截止时间；出错的session移出调度"""
+        try:
+            segment = entry.session.match_and_generate()
+            if entry.on_segment is not None:
+                entry.on_segment(session_id, segment)
+        except Exception:
+            logger.exception('scheduler: tick of session {} failed, removed'.format(session_id))
+            with self._cond:
+                self.errors += 1
+                self._entries.pop(session_id, None)
+            return
+        finished_at = self.clock()
+        slack = entry.deadline - finished_at
+        if slack < 0:
+            metrics.inc('deadline_miss')
+        with self._cond:
+            entry.record(slack)
+            self._slacks.append(slack)
+            # 错过截止时间时，播放从交付时刻继续
+            entry.deadline = max(entry.deadline, finished_at) + len(segment) / 1000
+            if self._entries.get(session_id) is entry:
+                self._push(session_id, entry)
+
+    def _work(self):
+        while True:
+            item = self._next()
+            if item is None:
+                return
+            self._tick(*item)
+
+    def start(self):
+        with self._cond:
+            assert not self._running, 'scheduler already started'
+            self._running = True
+        self._threads = [threading.Thread(target=self._work, name='hflow-tick-{}'.format(i), daemon=True)
+                         for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """停止调度（正在执行的tick会完成）"""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def report(self):
+        """整体与每个session的截止时间统计（毫秒）"""
+        with self._cond:
+            per_session = {session_id: entry.to_dict() for session_id, entry in self._entries.items()}
+            slacks = np.asarray(self._slacks, dtype=np.float64) * 1000
+            errors = self.errors
+        ticks = sum(i['ticks'] for i in per_session.values())
+        misses = sum(i['misses'] for i in per_session.values())
+        return {
+            'sessions': len(per_session),
+            'ticks': ticks,
+            'misses': misses,
+            'miss_rate': round(misses / ticks, 4) if ticks else None,
+            'errors': errors,
+            'slack_ms': {
+                'min': round(float(slacks.min()), 3),
+                'p1': round(float(np.percentile(slacks, 1)), 3),
+                'p50': round(float(np.percentile(slacks, 50)), 3),
+            } if slacks.size else None,
+            'decodes': decode_limiter.stats(),
+            'per_session': per_session,
+        }
@@ -0,0 +1,394 @@
+"""本地流式服务
+#################################################
+python -m hflow_sound_match.serve --host 127.0.0.1 --port 8765
+
+纯asyncio实现的HTTP服务，不依赖外部服务，可直接用于本地压测：
+    POST   /sessions?emotion=P              创建session，返回 {"session_id": ...}
+                                            &profile=wearable 选择质量档位（config quality_profiles，例如单声道22kHz）
+    POST   /sessions/{id}/hr                写入心率，body为数字、{"heart_rate": 75} 或数字列表
+    GET    /sessions/{id}/stream?fmt=mp3    chunked流式返回混音后的音频（pcm/wav/mp3/opus）
+    DELETE /sessions/{id}                   结束session
+    GET    /stats                           session数、缓存与线程池状态
+    GET    /metrics                         各阶段耗时直方图（Prometheus文本格式，需开启metrics_enabled）
+
+- 解码与混音(match_and_generate)、编码都在有界线程池中执行，事件循环不会被 AudioSegment.from_file 阻塞
+- 每个连接一个有界队列：客户端读得慢时生成端等待（背压），生成端按播放速度最多领先 lead_ms
+- 客户端断开时停止生成并回收编码器；进程收到SIGINT/SIGTERM时停止接受连接、结束所有流并回收session
+- 没有在流式输出、且超过 idle_timeout_s 没有写入心率的session自动回收（客户端断开后不再DELETE也不会一直占用名额）
+- 响应头发出之后生成端出错：记录错误并直接断开连接（不写chunked结束块，客户端能看出流不完整）
+"""
+import json
+import time
+import signal
+import asyncio
+import argparse
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+from .config import cfg
+from .pool import SessionPool
+from .cache import sound_cache, mix_cache
+from .metrics import metrics
+from .streaming import get_stream_encoder
+from .utils import Emotion
+
+EMOTIONS = (Emotion.peaceful, Emotion.sleepy, Emotion.happy)
+
+CONTENT_TYPES = {
+    'pcm': 'application/octet-stream',
+    'wav': 'audio/wav',
+    'mp3': 'audio/mpeg',
+    'opus': 'audio/ogg',
+}
+REASONS = {200: 'OK', 201: 'Created', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           409: 'Conflict', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message=''):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class SessionHandle:
+    """一个session在服务端的附加状态"""
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        # 进行中的tick（线程池中执行）；其间写入的心率先暂存在pending中，tick结束后在事件循环中写入心率记忆，
+        # 这样心率记忆只会被一个线程修改，写入心率也不需要等待tick
+        self.tick = None
+        self.pending = []
+        self.has_heart_rate = asyncio.Event()
+        self.streaming = False
+        self.closed = False
+        # 最近一次写入心率/流式输出结束的时刻（time.monotonic），用于回收闲置的session
+        self.active_at = time.monotonic()
+
+
+class StreamServer:
+    def __init__(self, host='127.0.0.1', port=8765, max_workers=4, max_sessions=1000, queue_chunks=16,
+                 lead_ms=2000, idle_timeout_s=60, **session_kwargs):
+        self.host = host
+        self.port = port
+        self.max_sessions = max_sessions
+        self.queue_chunks = queue_chunks
+        self.lead_ms = lead_ms
+        self.idle_timeout_s = idle_timeout_s
+        self.pool = SessionPool(**session_kwargs)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hflow-serve')
+        self.handles = {}
+        self.server = None
+        self._connections = set()
+        self._reaper = None
+
+    # ---------------------------------------------------------- 执行器
+    async def run_blocking(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    # ---------------------------------------------------------- HTTP
+    @staticmethod
+    async def read_request(reader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        method, target, _ = request_line.decode('latin-1').split(' ', 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+        body = b''
+        if int(headers.get('content-length', 0)):
+            body = await reader.readexactly(int(headers['content-length']))
+        url = urllib.parse.urlsplit(target)
+        query = {k: v[-1] for k, v in urllib.parse.parse_qs(url.query).items()}
+        return method.upper(), [i for i in url.path.split('/') if i], query, body
+
+    @staticmethod
+    async def write_response(writer, status, body, content_type):
+        writer.write('HTTP/1.1 {} {}\r\nContent-Type: {}\r\nContent-Length: {}\r\nConnection: close\r\n\r\n'
+                     .format(status, REASONS.get(status, ''), content_type, len(body)).encode('latin-1'))
+        writer.write(body)
+        await writer.drain()
+
+    async def write_json(self, writer, status, obj):
+        await self.write_response(writer, status, json.dumps(obj, ensure_ascii=False).encode('utf-8'),
+                                  'application/json')
+
+    async def handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            request = await self.read_request(reader)
+            if request is None:
+                return
+            method, path, query, body = request
+            try:
+                await self.route(method, path, query, body, reader, writer)
+            except HTTPError as e:
+                await self.write_json(writer, e.status, {'error': e.message})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            # shutdown()取消进行中的连接；不再向上抛出，否则asyncio.streams会把取消当作异常打印
+            pass
+        except Exception as e:
+            logger.exception('serve: request failed: {}'.format(e))
+            try:
+                await self.write_json(writer, 500, {'error': str(e)})
+            except ConnectionError:
+                pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    async def route(self, method, path, query, body, reader, writer):
+        if path == ['stats'] and method == 'GET':
+            return await self.write_json(writer, 200, self.stats())
+        if path == ['metrics'] and method == 'GET':
+            return await self.write_response(writer, 200, metrics.export_prometheus().encode('utf-8'),
+                                             'text/plain; version=0.0.4')
+        if path == ['sessions'] and method == 'POST':
+            return await self.write_json(writer, 201, await self.create_session(query))
+        if len(path) >= 2 and path[0] == 'sessions':
+            handle = self.handles.get(path[1])
+            if handle is None:
+                raise HTTPError(404, 'no such session')
+            if len(path) == 2 and method == 'DELETE':
+                await self.retire_session(handle)
+                return await self.write_json(writer, 200, {'session_id': handle.session_id})
+            if path[2:] == ['hr'] and method == 'POST':
+                return await self.write_json(writer, 200, await self.push_heart_rates(handle, body))
+            if path[2:] == ['stream'] and method == 'GET':
+                return await self.stream(handle, query, reader, writer)
+        raise HTTPError(404, 'not found')
+
+    # ---------------------------------------------------------- session
+    async def create_session(self, query):
+        if len(self.handles) >= self.max_sessions:
+            raise HTTPError(503, 'too many sessions')
+        kwargs = {}
+        if 'emotion' in query:
+            if query['emotion'] not in EMOTIONS:
+                raise HTTPError(400, 'unknown emotion')
+            kwargs['emotion'] = query['emotion']
+        if 'profile' in query:
+            if query['profile'] not in cfg.get('quality_profiles', {}):
+                raise HTTPError(400, 'unknown quality profile')
+            kwargs['profile'] = query['profile']
+        # 创建session会解码L0，放到线程池中
+        session_id = await self.run_blocking(lambda: self.pool.create(**kwargs))
+        self.handles[session_id] = SessionHandle(session_id)
+        return {'session_id': session_id}
+
+    async def push_heart_rates(self, handle, body):
+        try:
+            value = json.loads(body.decode('utf-8') or 'null')
+        except ValueError:
+            raise HTTPError(400, 'body must be json')
+        if isinstance(value, dict):
+            value = value.get('heart_rate')
+        values = value if isinstance(value, list) else [value]
+        if not values or not all(isinstance(i, (int, float)) and not isinstance(i, bool) for i in values):
+            raise HTTPError(400, 'heart rate must be a number')
+        session = self.pool.get(handle.session_id)
+        if handle.tick is None:
+            for heart_rate in values:
+                session.push_heart_rate(heart_rate)
+        else:
+            # 时间戳取写入时刻，而不是tick结束的时刻
+            now = session.hr_memory.now()
+            handle.pending.extend((heart_rate, now) for heart_rate in values)
+        handle.has_heart_rate.set()
+        handle.active_at = time.monotonic()
+        return {'session_id': handle.session_id, 'count': len(values)}
+
+    async def retire_session(self, handle):
+        self.handles.pop(handle.session_id, None)
+        handle.closed = True
+        handle.has_heart_rate.set()
+        if handle.tick is not None:
+            # 生成端被取消时线程中的tick仍可能在执行，等它结束后再回收
+            await asyncio.gather(handle.tick, return_exceptions=True)
+        await self.run_blocking(self.pool.retire, handle.session_id)
+
+    async def reap_idle(self):
+        """定期回收闲置的session：没有在流式输出，且超过idle_timeout_s没有写入心率"""
+        while True:
+            await asyncio.sleep(max(0.05, self.idle_timeout_s / 4))
+            deadline = time.monotonic() - self.idle_timeout_s
+            for handle in list(self.handles.values()):
+                if not handle.streaming and handle.active_at < deadline:
+                    logger.info('serve: retiring idle session {}'.format(handle.session_id))
+                    await self.retire_session(handle)
+
+    # ---------------------------------------------------------- 流式输出
+    def start_tick(self, handle, session):
+        """在线程池中执行一次tick，返回其future；tick结束后写入期间暂存的心率"""
+        def done(_):
+            handle.tick = None
+            pending, handle.pending = handle.pending, []
+            if not handle.closed:
+                for heart_rate, timestamp in pending:
+                    session.push_heart_rate(heart_rate, timestamp)
+
+        handle.tick = asyncio.get_running_loop().run_in_executor(self.executor, session.match_and_generate)
+        handle.tick.add_done_callback(done)
+        return handle.tick
+
+    async def produce(self, handle, encoder, chunk_ms, chunks):
+        """按播放速度生成片段并编码，放入有界队列（队列满时等待，即背压）；session结束时放入None"""
+        loop = asyncio.get_running_loop()
+        session = self.pool.get(handle.session_id)
+        await handle.has_heart_rate.wait()
+        started_at, played_ms = loop.time(), 0.0
+        while True:
+            ahead = played_ms - self.lead_ms - 1000 * (loop.time() - started_at)
+            if ahead > 0:
+                await asyncio.sleep(ahead / 1000)
+            if handle.closed:
+                break
+            # shield：生成端被取消时不取消tick的future，retire_session据此等待线程中的tick结束
+            segment = await asyncio.shield(self.start_tick(handle, session))
+            segment, header = encoder.feed(segment)
+            if header:
+                await chunks.put(header)
+            data = segment.raw_data
+            frame_width = segment.channels * segment.sample_width
+            step = max(1, int(segment.frame_rate * chunk_ms / 1000)) * frame_width
+            for start in range(0, len(data), step):
+                encoded = await self.run_blocking(encoder.encode, data[start:start + step])
+                if encoded:
+                    await chunks.put(encoded)
+            played_ms += len(segment)
+        tail = await self.run_blocking(encoder.close)
+        if tail:
+            await chunks.put(tail)
+        await chunks.put(None)
+
+    async def stream(self, handle, query, reader, writer):
+        fmt = query.get('fmt', 'pcm')
+        if fmt not in CONTENT_TYPES:
+            raise HTTPError(400, 'unsupported fmt')
+        if handle.streaming:
+            raise HTTPError(409, 'session is already streaming')
+        chunk_ms = int(query.get('chunk_ms', 200))
+        handle.streaming = True
+        encoder = get_stream_encoder(fmt)
+        chunks = asyncio.Queue(maxsize=self.queue_chunks)
+        producer = asyncio.ensure_future(self.produce(handle, encoder, chunk_ms, chunks))
+        # 客户端不会再发送数据，读到EOF即表示连接已断开
+        hangup = asyncio.ensure_future(reader.read())
+        getter = None
+        waiting = {producer, hangup}
+        try:
+            writer.write('HTTP/1.1 200 OK\r\nContent-Type: {}\r\nTransfer-Encoding: chunked\r\n'
+                         'Cache-Control: no-cache\r\nConnection: close\r\n\r\n'.format(CONTENT_TYPES[fmt])
+                         .encode('latin-1'))
+            await writer.drain()
+            while True:
+                if getter is None:
+                    getter = asyncio.ensure_future(chunks.get())
+                done, _ = await asyncio.wait(waiting | {getter}, return_when=asyncio.FIRST_COMPLETED)
+                if hangup in done:
+                    raise ConnectionResetError('client hung up')
+                if producer in done and producer in waiting:
+                    error = producer.exception()
+                    if error is not None:
+                        # 响应头已发出，不能再返回500：记录错误后直接断开（handle_connection关闭连接）
+                        logger.opt(exception=error).error(
+                            'serve: stream of {} failed: {}'.format(handle.session_id, error))
+                        break
+                    # 正常结束（session已结束）：继续发送队列中剩余的块，最后一个是None
+                    waiting.discard(producer)
+                if getter not in done:
+                    continue
+                chunk, getter = getter.result(), None
+                if chunk is None:
+                    writer.write(b'0\r\n\r\n')
+                    await writer.drain()
+                    break
+                writer.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                await writer.drain()
+        except ConnectionError:
+            logger.debug('serve: stream of {} closed by client'.format(handle.session_id))
+        finally:
+            tasks = [i for i in (producer, hangup, getter) if i is not None]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self.run_blocking(encoder.close)
+            handle.streaming = False
+            handle.active_at = time.monotonic()
+
+    # ---------------------------------------------------------- 生命周期
+    def stats(self):
+        return {
+            'sessions': len(self.handles),
+            'streaming': sum(1 for i in self.handles.values() if i.streaming),
+            'sound_cache': sound_cache.stats(),
+            'mix_cache': mix_cache.stats(),
+        }
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        if self.idle_timeout_s and self.idle_timeout_s > 0:
+            self._reaper = asyncio.ensure_future(self.reap_idle())
+        logger.info('serve: listening on {}:{}'.format(self.host, self.port))
+        return self.server
+
+    async def shutdown(self):
+        logger.info('serve: shutting down')
+        if self._reaper is not None:
+            self._reaper.cancel()
+            await asyncio.gather(self._reaper, return_exceptions=True)
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        # 取消进行中的连接，流在finally中回收编码器
+        connections = list(self._connections)
+        for task in connections:
+            task.cancel()
+        await asyncio.gather(*connections, return_exceptions=True)
+        for handle in list(self.handles.values()):
+            await self.retire_session(handle)
+        self.executor.shutdown(wait=True)
+
+    async def serve_forever(self):
+        await self.start()
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except NotImplementedError:
+                pass
+        await stop.wait()
+        await self.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='local heart-rate driven music streaming server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=4, help='threads for decoding/mixing/encoding')
+    parser.add_argument('--max-sessions', type=int, default=1000)
+    parser.add_argument('--queue-chunks', type=int, default=16, help='buffered chunks per connection')
+    parser.add_argument('--lead-ms', type=int, default=2000, help='how far generation may run ahead of playback')
+    parser.add_argument('--idle-timeout', type=float, default=60,
+                        help='retire idle sessions (not streaming, no heart rate) after this many seconds, 0 disables')
+    parser.add_argument('--sound-root', default=None, help='overrides config sound_folders_root')
+    args = parser.parse_args()
+    if args.sound_root:
+        cfg['sound_folders_root'] = args.sound_root
+    server = StreamServer(args.host, args.port, max_workers=args.workers, max_sessions=args.max_sessions,
+                          queue_chunks=args.queue_chunks, lead_ms=args.lead_ms, idle_timeout_s=args.idle_timeout)
+    asyncio.run(server.serve_forever())
+
+
+if __name__ == '__main__':
+    main()
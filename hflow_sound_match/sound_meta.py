@@ -0,0 +1,179 @@
+"""音频文件元数据（响度、时长、采样率、声道）
+#################################################
+每个文件的dBFS只在第一次完整解码源文件（或离线刷新、编译PCM store）时扫描一次，结果写入一个json manifest，
+之后 load_and_preprocess_sound 直接读取，不再对整个解码后的文件求RMS。
+记录只来自源格式的解码结果（见pcm_store.decode_file），转换过格式的音频不会写入元数据。
+记录里保存了源文件的 mtime/size，文件被替换后记录自动失效并在下次加载时重新计算。
+
+manifest默认位于 <sound_folders_root>/.hflow_sound_meta.json，可用 config 的 sound_meta_path 指定；
+目录不可写时只保存在内存中。
+
+运行时（服务进程）新扫描的记录只保存在内存中，不写入音乐库目录；manifest只由离线工具
+（本模块的main、pcm_store.compile_library）在整个循环结束后写一次。写入时在文件锁内重新读取manifest，
+只合并本进程新增/删除的记录，多个进程同时写入不会互相覆盖。
+
+离线刷新整个音乐库：
+    python -m hflow_sound_match.sound_meta
+"""
+import os
+import json
+import fcntl
+import argparse
+import threading
+from loguru import logger
+from .config import cfg
+from .utils import FilesHelper, write_json_atomic
+
+SOUND_META_NAME = '.hflow_sound_meta.json'
+SOUND_META_VERSION = 1
+
+
+class SoundMetaIndex:
+    def __init__(self, path=None, sound_root=None):
+        self.sound_root = os.path.abspath(sound_root or cfg['sound_folders_root'])
+        self.path = path or cfg.get('sound_meta_path') or os.path.join(self.sound_root, SOUND_META_NAME)
+        self.writable = True
+        self._lock = threading.Lock()
+        # 本进程新增/删除、尚未写入manifest的记录
+        self._dirty = set()
+        self._removed = set()
+        self.files = self._read_files()
+
+    def _read_files(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'r') as f:
+            manifest = json.load(f)
+        return manifest['files'] if manifest.get('version') == SOUND_META_VERSION else {}
+
+    def _key(self, sound_file):
+        path = os.path.abspath(sound_file)
+        rel = os.path.relpath(path, self.sound_root)
+        return path if rel.startswith('..') else rel
+
+    def get(self, sound_file):
+        """未记录或源文件已变化时返回None"""
+        entry = self.files.get(self._key(sound_file))
+        if entry is None:
+            return None
+        st = os.stat(sound_file)
+        if st.st_mtime_ns != entry['mtime_ns'] or st.st_size != entry['size']:
+            return None
+        return entry
+
+    def record(self, sound_file, sound, save=False):
+        """扫描已解码的音频并记录元数据（先只记在内存中，save时写入manifest）"""
+        st = os.stat(sound_file)
+        dBFS = sound.dBFS
+        entry = {
+            'mtime_ns': st.st_mtime_ns,
+            'size': st.st_size,
+            # json不支持-inf，静音文件记为None
+            'dBFS': None if dBFS == -float('infinity') else dBFS,
+            'duration_ms': len(sound),
+            'frame_rate': sound.frame_rate,
+            'channels': sound.channels,
+            'sample_width': sound.sample_width,
+        }
+        key = self._key(sound_file)
+        with self._lock:
+            self.files[key] = entry
+            self._dirty.add(key)
+            self._removed.discard(key)
+        if save:
+            self.save()
+        return entry
+
+    def dBFS(self, sound_file, sound):
+        """已记录则直接返回，否则扫描sound（不记录，sound可能已转换过格式）"""
+        entry = self.get(sound_file)
+        if entry is None:
+            return sound.dBFS
+        return -float('infinity') if entry['dBFS'] is None else entry['dBFS']
+
+    def save(self):
+        """在文件锁内重新读取manifest，合并本进程新增/删除的记录后写回"""
+        if not self.writable:
+            return
+        with self._lock:
+            dirty = {key: self.files[key] for key in self._dirty}
+            removed = set(self._removed)
+        if not dirty and not removed:
+            return
+        try:
+            with open(self.path + '.lock', 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                files = self._read_files()
+                files.update(dirty)
+                for key in removed:
+                    files.pop(key, None)
+                write_json_atomic(self.path, {'version': SOUND_META_VERSION, 'files': files})
+        except OSError as e:
+            self.writable = False
+            logger.warning('sound meta: {} is not writable, keep metadata in memory only ({})'.format(self.path, e))
+            return
+        with self._lock:
+            for key, entry in dirty.items():
+                if self.files.get(key) is entry:
+                    self._dirty.discard(key)
+            self._removed -= removed
+            # 顺便读入其他进程写入的记录
+            for key, entry in files.items():
+                self.files.setdefault(key, entry)
+
+    def refresh(self, file_formats=None):
+        """离线刷新：只重新扫描新增或变化过的文件，并删除已不存在文件的记录（file_formats默认为library_file_formats）"""
+        from pydub import AudioSegment
+        if file_formats is None:
+            file_formats = cfg.get('library_file_formats', ['mp3'])
+        seen = set()
+        for sound_file in FilesHelper.iter_library_files(self.sound_root, tuple(file_formats)):
+            seen.add(self._key(sound_file))
+            if self.get(sound_file) is None:
+                self.record(sound_file, AudioSegment.from_file(sound_file), save=False)
+                logger.info('sound meta: scanned {}'.format(sound_file))
+        with self._lock:
+            for key in list(self.files):
+                if key not in seen and not os.path.isabs(key):
+                    del self.files[key]
+                    self._dirty.discard(key)
+                    self._removed.add(key)
+        self.save()
+
+
+class _LazySoundMeta:
+    """首次使用时才读取manifest（sound_folders_root可能在import之后才被修改）"""
+
+    def __init__(self):
+        self._index = None
+        self._lock = threading.Lock()
+
+    def _get(self):
+        sound_root = os.path.abspath(cfg['sound_folders_root'])
+        index = self._index
+        if index is None or index.sound_root != sound_root:
+            with self._lock:
+                if self._index is None or self._index.sound_root != sound_root:
+                    self._index = SoundMetaIndex(sound_root=sound_root)
+                index = self._index
+        return index
+
+    def __getattr__(self, item):
+        return getattr(self._get(), item)
+
+
+sound_meta = _LazySoundMeta()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='scan loudness/duration metadata of the sound library')
+    parser.add_argument('--root', default=None, help='sound folders root, defaults to config sound_folders_root')
+    parser.add_argument('--out', default=None, help='manifest path, defaults to <root>/' + SOUND_META_NAME)
+    args = parser.parse_args()
+    index = SoundMetaIndex(path=args.out, sound_root=args.root)
+    index.refresh()
+    logger.info('sound meta: {} files -> {}'.format(len(index.files), index.path))
+
+
+if __name__ == '__main__':
+    main()
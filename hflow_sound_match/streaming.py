@@ -0,0 +1,188 @@
+"""流式输出
+#################################################
+把 match_and_generate 生成的10秒片段切成小块(chunk)连续输出，整个流只使用一个编码器：
+    - 'pcm': 裸PCM（s8/s16le/s32le，取决于音频的sample_width，与AudioSegment.raw_data相同）
+    - 'wav': 带一个“长度未知”WAV头的PCM流（8位WAV按规范为无符号）
+    - 'mp3' / 'opus': 一个常驻的ffmpeg进程持续编码，片段之间没有编码器重新初始化造成的边界杂音
+
+    for chunk in session.stream(heart_rates, fmt='mp3', chunk_ms=200):
+        send(chunk)
+
+heart_rates 可以是任意可迭代对象，也可以是 queue.Queue（放入None表示结束）。
+内存中任意时刻只有当前一个片段；realtime=True 时按播放速度输出（允许提前lead_ms）。
+"""
+import queue
+import struct
+import threading
+import time
+import subprocess
+import audioop
+from pydub import AudioSegment
+from loguru import logger
+from .pcm_store import PCM_CODECS
+
+FFMPEG_FORMATS = {
+    'mp3': ['-f', 'mp3', '-c:a', 'libmp3lame'],
+    'opus': ['-f', 'ogg', '-c:a', 'libopus'],
+}
+
+
+class PCMStreamEncoder:
+    def __init__(self):
+        self.frame_rate, self.channels, self.sample_width = None, None, None
+
+    def _conform(self, segment):
+        """第一个片段决定整个流的格式，之后的片段转换成同样的格式"""
+        if self.frame_rate is None:
+            self.frame_rate, self.channels, self.sample_width = \
+                segment.frame_rate, segment.channels, segment.sample_width
+            self.start()
+        if segment.frame_rate != self.frame_rate:
+            segment = segment.set_frame_rate(self.frame_rate)
+        if segment.channels != self.channels:
+            segment = segment.set_channels(self.channels)
+        if segment.sample_width != self.sample_width:
+            segment = segment.set_sample_width(self.sample_width)
+        return segment
+
+    def start(self):
+        pass
+
+    def header(self):
+        return b''
+
+    def encode(self, data):
+        return data
+
+    def feed(self, segment):
+        """返回 (已对齐格式的片段, 需要在片段数据之前输出的头)"""
+        started = self.frame_rate is not None
+        segment = self._conform(segment)
+        return segment, (b'' if started else self.header())
+
+    def close(self):
+        return b''
+
+
+class WavStreamEncoder(PCMStreamEncoder):
+    def header(self):
+        # 流式WAV：RIFF和data块的长度未知，按惯例写0xFFFFFFFF
+        block_align = self.channels * self.sample_width
+        return struct.pack(
+            '<4sI4s4sIHHIIHH4sI',
+            b'RIFF', 0xFFFFFFFF, b'WAVE',
+            b'fmt ', 16, 1, self.channels, self.frame_rate, self.frame_rate * block_align, block_align,
+            self.sample_width * 8,
+            b'data', 0xFFFFFFFF,
+        )
+
+    def encode(self, data):
+        # AudioSegment的8位数据是有符号的，WAV中是无符号的（与AudioSegment.export一致）
+        if self.sample_width == 1:
+            return audioop.bias(data, 1, 128)
+        return data
+
+
+class FFmpegStreamEncoder(PCMStreamEncoder):
+    """一个常驻的ffmpeg进程：stdin写PCM，后台线程读取stdout中的编码数据"""
+
+    def __init__(self, fmt='mp3', bitrate='128k'):
+        super().__init__()
+        assert fmt in FFMPEG_FORMATS, 'unsupported stream format: {}'.format(fmt)
+        self.fmt = fmt
+        self.bitrate = bitrate
+        self.process = None
+        self._chunks = []
+        self._lock = threading.Lock()
+        self._reader = None
+
+    def start(self):
+        command = [
+            AudioSegment.converter, '-hide_banner', '-loglevel', 'error',
+            '-f', PCM_CODECS[self.sample_width], '-ar', str(self.frame_rate), '-ac', str(self.channels),
+            '-i', 'pipe:0',
+        ] + FFMPEG_FORMATS[self.fmt] + ['-b:a', self.bitrate, '-flush_packets', '1', 'pipe:1']
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL)
+        self._reader = threading.Thread(target=self._read, daemon=True, name='hflow-stream-encoder')
+        self._reader.start()
+
+    def _read(self):
+        while True:
+            data = self.process.stdout.read1(1 << 16)
+            if not data:
+                break
+            with self._lock:
+                self._chunks.append(data)
+
+    def _drain(self):
+        with self._lock:
+            data, self._chunks = b''.join(self._chunks), []
+        return data
+
+    def encode(self, data):
+        self.process.stdin.write(data)
+        self.process.stdin.flush()
+        return self._drain()
+
+    def close(self):
+        if self.process is None:
+            return b''
+        self.process.stdin.close()
+        self.process.wait()
+        self._reader.join()
+        return self._drain()
+
+
+def get_stream_encoder(fmt, **kwargs):
+    if fmt == 'pcm':
+        return PCMStreamEncoder()
+    if fmt == 'wav':
+        return WavStreamEncoder()
+    return FFmpegStreamEncoder(fmt, **kwargs)
+
+
+def iter_heart_rates(heart_rates):
+    """可迭代对象原样迭代；queue.Queue 阻塞读取直到取到None"""
+    if isinstance(heart_rates, queue.Queue):
+        while True:
+            heart_rate = heart_rates.get()
+            if heart_rate is None:
+                return
+            yield heart_rate
+    else:
+        yield from heart_rates
+
+
+def stream_session(session, heart_rates, fmt='pcm', chunk_ms=200, realtime=False, lead_ms=1000, **encoder_kwargs):
+    """每个心率生成一个片段，切成chunk_ms的小块编码后逐块yield（bytes）"""
+    encoder = get_stream_encoder(fmt, **encoder_kwargs)
+    started_at, played_ms = None, 0
+    completed = False
+    try:
+        for heart_rate in iter_heart_rates(heart_rates):
+            segment, header = encoder.feed(session.match_and_generate(heart_rate))
+            if header:
+                yield header
+            data = memoryview(segment.raw_data)
+            frame_width = segment.channels * segment.sample_width
+            chunk_frames = max(1, int(segment.frame_rate * chunk_ms / 1000))
+            for start in range(0, len(data) // frame_width, chunk_frames):
+                encoded = encoder.encode(bytes(data[start * frame_width:(start + chunk_frames) * frame_width]))
+                if realtime:
+                    # 按播放速度输出，最多领先lead_ms
+                    if started_at is None:
+                        started_at = time.monotonic()
+                    ahead = played_ms - lead_ms - 1000 * (time.monotonic() - started_at)
+                    if ahead > 0:
+                        time.sleep(ahead / 1000)
+                    played_ms += 1000 * chunk_frames / segment.frame_rate
+                if encoded:
+                    yield encoded
+        completed = True
+    finally:
+        # 提前结束（调用方close/异常）时也要回收编码器进程
+        tail = encoder.close()
+    if completed and tail:
+        logger.debug('stream: flushed {} bytes from encoder'.format(len(tail)))
+        yield tail
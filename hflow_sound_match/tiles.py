@@ -0,0 +1,82 @@
+"""预渲染的transport_time片段(tile)
+#################################################
+transport_time 与 fade_time 在配置中是固定的，session从一个音频中取出的片段只可能是：
+    plain[k]        sound[k*T:(k+1)*T]
+    fade_in[0]      音乐刚切换/循环回到开头时的第一个片段
+    fade_out[k]     到达循环点（(k+2)*T >= len）时的最后一个片段
+    loop_wrap       循环之后的片段：从开头取、前后都淡入淡出（见 simply_generate_next_sound_segment_and_update_state）
+SoundTiles 在加载音频时一次性生成带淡入淡出的片段，tick时只需按 (k, 淡入, 淡出) 查表，不再计算淡入淡出。
+tile 与按原方式切片+淡入淡出得到的结果完全一致。
+
+内存：
+    - numpy后端（mixer.ArraySound）下 plain tile 是共享音频上的视图，不占额外内存（PCM store时即memmap上的视图）
+    - pydub后端下切片就是拷贝，plain tile 不缓存，每次从原音频切出（与不用tile时相同），否则每个文件要多存一整份
+    - 带淡入淡出的tile每个文件只有几个（fade_in[0]、loop_wrap 和循环点附近的 fade_out[k]），是新数据
+tile只存在于进程内的sound_cache中，不持久化到磁盘，进程重启后重新生成。
+"""
+import sys
+from .mixer import ArraySegment, ArraySound
+
+
+class SoundTiles:
+    __slots__ = ('sound', 'transport_ms', 'fade_ms', 'length', '_tiles')
+
+    def __init__(self, sound, transport_ms, fade_ms, prerender=True):
+        """sound: AudioSegment / PCMSound / mixer.ArraySound"""
+        self.sound = sound
+        self.transport_ms = int(transport_ms)
+        self.fade_ms = int(fade_ms)
+        self.length = len(sound)
+        self._tiles = {}
+        if prerender:
+            self.prerender()
+
+    def __len__(self):
+        """完整tile的个数"""
+        return self.length // self.transport_ms
+
+    def loop_indexes(self):
+        """到达循环点的tile序号：(k+2)*T >= len"""
+        return [k for k in range(len(self)) if (k + 2) * self.transport_ms >= self.length]
+
+    def prerender(self):
+        if isinstance(self.sound, ArraySound):
+            for k in range(max(len(self), 1)):
+                self.get(k)
+        self.get(0, fade_in=True)
+        for k in self.loop_indexes():
+            self.get(k, fade_out=True)
+        self.get(0, fade_in=True, fade_out=True)
+        return self
+
+    def _render(self, index, fade_in, fade_out):
+        start = index * self.transport_ms
+        segment = self.sound[start:start + self.transport_ms]
+        # 与session中的顺序一致：先淡入，再淡出
+        if fade_in:
+            segment = segment.fade_in(self.fade_ms)
+        if fade_out:
+            segment = segment.fade_out(self.fade_ms)
+        return segment
+
+    def get(self, index, fade_in=False, fade_out=False):
+        if not (fade_in or fade_out) and not isinstance(self.sound, ArraySound):
+            # pydub：plain tile 不缓存（见模块说明）
+            return self._render(index, False, False)
+        key = (index, fade_in, fade_out)
+        tile = self._tiles.get(key)
+        if tile is None:
+            # 预渲染之外的组合（例如文件比一个tile还短）按需生成，结果同样被共享
+            tile = self._tiles[key] = self._render(index, fade_in, fade_out)
+        return tile
+
+    @property
+    def nbytes(self):
+        """tile自身占用的字节数（视图不计）"""
+        total = 0
+        for tile in self._tiles.values():
+            if isinstance(tile, ArraySegment):
+                total += tile.samples.nbytes if tile.samples.base is None else 0
+            else:
+                total += len(tile.raw_data)
+        return total + sys.getsizeof(self._tiles)
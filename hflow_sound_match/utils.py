@@ -1,4 +1,5 @@
 import os
+import json
 import glob
 import random
 from pydub import AudioSegment
@@ -9,6 +10,7 @@ import math
 import soundfile as sf
 from io import BytesIO
 from .config import cfg as config
+from .catalog import sound_catalog
 
 
 class Emotion:
@@ -34,11 +36,8 @@ class FilesHelper:
 
     @staticmethod
     def get_files_by_folder_root(folder_root):
-        file_formats = ('mp3',)
-        base_fs = os.listdir(folder_root)
-        base_fs = [i for i in base_fs if i.endswith(file_formats)]
-        fs = [os.path.join(folder_root, i) for i in base_fs]
-        return fs, base_fs
+        # 走进程内的索引，目录未变化时不再listdir
+        return sound_catalog.list_files(folder_root)
 
     @staticmethod
     def get_files_by_layer(*args, layer):
@@ -62,14 +61,22 @@ class FilesHelper:
 
     @staticmethod
     def environment_files():
-        # 可以更简单的实现： 用get_files_by_folder_root实现
         L0_folder = os.path.join(config['sound_folders_root'], '01 环境文件')
-        file_formats = ('mp3',)
-        fs = os.listdir(L0_folder)
-        fs = [i for i in fs if i.endswith(file_formats)]
-        fs = [os.path.join(L0_folder, i) for i in fs]
+        fs, _ = FilesHelper.get_files_by_folder_root(L0_folder)
         return fs
 
+    @staticmethod
+    def get_closest_files_by_heart_rate(emotion, layer, heart_rate):
+        """某情绪、某层中bpm与心率最接近的所有文件（二分查找，不扫描目录）"""
+        emotion_folder = FilesHelper.get_emotion_root_by_emotion(emotion)
+        return sound_catalog.closest_files(emotion_folder, layer, heart_rate)
+
+    @staticmethod
+    def get_closest_files_by_heart_rates(emotion, layer, heart_rates):
+        """多个心率一次查询（向量化），返回与heart_rates一一对应的候选文件列表"""
+        emotion_folder = FilesHelper.get_emotion_root_by_emotion(emotion)
+        return sound_catalog.closest_files_batch(emotion_folder, layer, heart_rates)
+
     @staticmethod
     def get_emotion_root_by_emotion(emotion):
         map_dict = {
@@ -80,6 +87,23 @@ class FilesHelper:
         map_dict = {key: os.path.join(config['sound_folders_root'], value) for key,value in map_dict.items()}
         return map_dict[emotion]
 
+    @staticmethod
+    def iter_library_files(sound_root, file_formats=('mp3',)):
+        """递归遍历音乐库下的所有音频文件（顺序固定）"""
+        for dirpath, dirnames, filenames in os.walk(sound_root):
+            dirnames.sort()
+            for name in sorted(filenames):
+                if name.endswith(tuple(file_formats)):
+                    yield os.path.join(dirpath, name)
+
+
+def write_json_atomic(path, obj):
+    """先写临时文件再rename，避免其他进程读到写了一半的json"""
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(obj, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+
 
 class SoundObjHelper:
     @staticmethod
@@ -0,0 +1,163 @@
+"""长文件的按窗口解码
+#################################################
+session每次只读取播放位置处transport_time长的一段，长的环境录音没有必要整个解码进内存。
+WindowedSound 只在读到某一段时解码它所在的块（block_ms，默认2*transport_time，比一次读取多出的部分就是预读）：
+    - wav直接用wave模块按帧定位读取，不启动ffmpeg
+    - 其他格式用ffmpeg输入端定位（-ss在-i之前，见pcm_store.ffmpeg_decode），耗时与块在文件中的位置无关
+文件开头的块始终保留（循环回到开头时使用），其余块放在sound_cache中，按总字节数与其他音频一起LRU淘汰。
+同一文件+格式的WindowedSound在进程内只有一份（也在sound_cache中），所有session共享已解码的块。
+
+接口与PCMSound一致（切片、惰性增益、mixer.ArraySound、帧模式的播放头）。窗口与整个文件解码后的切片逐样本相同；
+与PCM store一样，numpy后端的响度增益以float乘上（量化误差级别的差异）。
+需要文件的元数据（时长、响度、源格式）已在sound_meta中，否则回退到整个文件解码（同时记录元数据，下次加载即可按窗口解码）。
+
+config.json:
+    "windowed_decode_min_s": 300    # 超过这个时长的文件按窗口解码，0为关闭
+    "windowed_block_s": 20
+"""
+import wave
+import numpy as np
+from pydub import AudioSegment
+from .config import cfg
+from .cache import sound_cache
+from .pcm_store import PCMSound, SAMPLE_DTYPES, conform, ffmpeg_decode, format_key, profile_format, get_pcm_store
+from .sound_meta import sound_meta
+
+
+def read_wav_window(sound_file, start_second, duration):
+    """PCM wav按帧定位直接读取，返回源格式的AudioSegment；不是可以直接读取的wav时返回None"""
+    if not sound_file.lower().endswith('.wav'):
+        return None
+    try:
+        with wave.open(sound_file, 'rb') as f:
+            frame_rate, channels, sample_width = f.getframerate(), f.getnchannels(), f.getsampwidth()
+            # 8位wav是无符号的，24位需要转换，交给ffmpeg
+            if sample_width not in (2, 4):
+                return None
+            f.setpos(min(int(round(start_second * frame_rate)), f.getnframes()))
+            data = f.readframes(int(round(duration * frame_rate)))
+    except (wave.Error, EOFError):
+        return None
+    return AudioSegment(data=data, sample_width=sample_width, frame_rate=frame_rate, channels=channels)
+
+
+class WindowedSamples:
+    """
+    形状为 (frames, channels) 的类数组对象，[start:end] 返回ndarray，只解码用到的块。
+    块0在构造时解码并常驻，其余块以 (key, 块序号) 放在sound_cache中（key为这个对象在sound_cache中的key）。
+    source_format为源文件的格式（来自sound_meta），先按源格式解码再转换成fmt，与整个文件解码的路径一致。
+    """
+
+    def __init__(self, sound_file, frames, fmt, source_format, block_frames, key):
+        self.sound_file = sound_file
+        self.shape = (frames, fmt['channels'])
+        self.dtype = np.dtype(SAMPLE_DTYPES[fmt['sample_width']])
+        self.format = fmt
+        self.source_format = source_format
+        self.frame_rate = fmt['frame_rate']
+        self.sample_width = fmt['sample_width']
+        self.block_frames = block_frames
+        self.key = key
+        self.decodes = 0
+        self._head = self._decode(0)
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def nbytes(self):
+        """常驻的字节数（文件开头的块），其余块计入sound_cache"""
+        return self._head.nbytes
+
+    def _decode(self, index):
+        start_second = index * self.block_frames / self.frame_rate
+        duration = self.block_frames / self.frame_rate
+        segment = read_wav_window(self.sound_file, start_second, duration)
+        if segment is None:
+            segment = ffmpeg_decode(self.sound_file, self.source_format, start_second, duration)
+        segment = conform(segment, self.format)
+        self.decodes += 1
+        return np.frombuffer(segment.raw_data, dtype=self.dtype).reshape(-1, self.shape[1])
+
+    def block(self, index):
+        if index == 0:
+            return self._head
+        # 同一个块并发读取时只解码一次（见SoundCache.get_or_create）
+        return sound_cache.get_or_create((self.key, index), lambda: self._decode(index))
+
+    def __getitem__(self, key):
+        assert isinstance(key, slice) and not key.step, 'only [start:end] slicing is supported'
+        start, end, _ = key.indices(len(self))
+        if end <= start:
+            return np.zeros((0, self.shape[1]), dtype=self.dtype)
+        first, last = start // self.block_frames, (end - 1) // self.block_frames
+        parts = []
+        for index in range(first, last + 1):
+            offset = index * self.block_frames
+            parts.append(self.block(index)[max(start - offset, 0):end - offset])
+        samples = parts[0] if len(parts) == 1 else np.concatenate(parts)
+        # 实际解码出的帧数可能比元数据中的时长少几帧，与AudioSegment一致补静音
+        missing_frames = (end - start) - len(samples)
+        if missing_frames > 0:
+            samples = np.concatenate([samples, np.zeros((missing_frames, self.shape[1]), dtype=self.dtype)])
+        return samples
+
+
+class WindowedSound(PCMSound):
+    """按窗口解码的音频，响度来自元数据（不扫描整个文件）"""
+
+    def __init__(self, samples, frame_rate, sample_width, gain=0.0, dBFS=None, view=False):
+        super().__init__(samples, frame_rate, sample_width, gain)
+        self._dBFS = dBFS
+        self.view = view
+
+    @property
+    def nbytes(self):
+        # apply_gain返回的是共享同一份样本的视图，不重复计入
+        return 0 if self.view else self.samples.nbytes
+
+    @property
+    def dBFS(self):
+        if self._dBFS is None:
+            return -float('infinity')
+        return self._dBFS + self.gain
+
+    def apply_gain(self, volume_change):
+        return WindowedSound(self.samples, self.frame_rate, self.sample_width, self.gain + volume_change, self._dBFS,
+                             view=True)
+
+
+def open_windowed(sound_file, profile=None):
+    """
+    满足条件时返回WindowedSound（质量档位profile的格式，见pcm_store.profile_format），否则返回None（由调用方整个解码）：
+    已开启、文件不在PCM store中（store本身就是零拷贝的）、元数据已记录且时长超过阈值。
+    同一文件+格式在sound_cache中只有一份
+    """
+    min_seconds = cfg.get('windowed_decode_min_s', 0)
+    if not min_seconds or min_seconds <= 0:
+        return None
+    store = get_pcm_store()
+    if store is not None and store.entry(sound_file) is not None:
+        return None
+    entry = sound_meta.get(sound_file)
+    block_ms = 1000 * cfg.get('windowed_block_s', 2 * cfg['transport_time'])
+    # 至少要比两个块长，否则整个解码更省事
+    if entry is None or entry['duration_ms'] < max(1000 * min_seconds, 2 * block_ms):
+        return None
+    source_format = {key: entry[key] for key in ('frame_rate', 'channels', 'sample_width')}
+    fmt = profile_format(profile) or source_format
+    frame_rate = fmt['frame_rate']
+    key = sound_cache.make_key(sound_file, ('windowed', format_key(fmt), block_ms))
+
+    def load():
+        samples = WindowedSamples(
+            sound_file,
+            frames=int(entry['duration_ms'] * frame_rate / 1000),
+            fmt=fmt,
+            source_format=source_format,
+            block_frames=int(block_ms * frame_rate / 1000),
+            key=key,
+        )
+        return WindowedSound(samples, frame_rate, fmt['sample_width'], dBFS=entry['dBFS'])
+
+    return sound_cache.get_or_create(key, load)
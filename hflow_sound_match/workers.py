@@ -0,0 +1,189 @@
+"""预热 + prefork 多进程
+#################################################
+父进程先把音乐库索引、解码并归一化后的音频全部加载进 sound_cache，gc.freeze() 之后再fork出N个worker，
+worker通过copy-on-write共享这些只读数据，启动后第一个session不再需要解码。
+
+    python -m hflow_sound_match.workers --workers 4 --port 8765     # worker i 监听 port+i
+
+    supervisor = PreforkSupervisor(target, workers=4)   # target(worker_index) 在子进程中运行
+    supervisor.start()
+    supervisor.memory_report()    # 每个进程的 shared/private 内存（/proc/<pid>/smaps_rollup）
+    supervisor.wait()
+
+session只存在于创建它的worker中，所以每个worker使用独立端口，客户端按端口保持亲和。
+"""
+import os
+import gc
+import time
+import signal
+import argparse
+from loguru import logger
+from .config import cfg
+from .catalog import sound_catalog
+from .cache import sound_cache
+from .utils import Emotion, FilesHelper
+
+SMAPS_FIELDS = ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty')
+
+
+def warm_up(emotions=None, layers=(1, 2), profiles=(None,)):
+    """
+    加载所有L0（原始）和各情绪L1/L2（预处理后）音频到sound_cache，缓存key与session加载时一致。
+    profiles: 要预热的质量档位（None为规范格式），每个档位各占一份缓存
+    返回 {'seconds', 'files', 'cache'}
+    """
+    from .match_v2 import RelaxMusicSessionV2
+    started_at = time.perf_counter()
+    evictions = sound_cache.stats()['evictions']
+    files = 0
+    for profile in profiles:
+        # 借用一个session的加载方法，保证预处理参数与缓存key和正常加载完全一致
+        session = RelaxMusicSessionV2(profile=profile)
+        for sound_file in FilesHelper.environment_files():
+            session.load_sound(sound_file)
+            files += 1
+        for emotion in emotions or (Emotion.peaceful, Emotion.happy, Emotion.sleepy):
+            folder = FilesHelper.get_emotion_root_by_emotion(emotion)
+            for layer in layers:
+                index = sound_catalog.layer(folder, layer)
+                # 提前建好心率查找表
+                index.lookup
+                for sound_file in index.files:
+                    session.load_and_preprocess_sound(sound_file)
+                    files += 1
+    cache = sound_cache.stats()
+    if cache['evictions'] > evictions:
+        logger.warning('warm up: sound cache too small, {} sounds evicted (sound_cache_max_mb)'.format(
+            cache['evictions'] - evictions))
+    return {'seconds': round(time.perf_counter() - started_at, 3), 'files': files, 'cache': cache}
+
+
+def process_memory(pid='self'):
+    """/proc/<pid>/smaps_rollup 中的内存统计（字节），不支持时返回None"""
+    try:
+        with open('/proc/{}/smaps_rollup'.format(pid)) as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None
+    values = {}
+    for line in lines:
+        key, _, rest = line.partition(':')
+        if key in SMAPS_FIELDS:
+            values[key] = int(rest.split()[0]) * 1024
+    return {
+        'rss_bytes': values.get('Rss', 0),
+        'pss_bytes': values.get('Pss', 0),
+        'shared_bytes': values.get('Shared_Clean', 0) + values.get('Shared_Dirty', 0),
+        'private_bytes': values.get('Private_Clean', 0) + values.get('Private_Dirty', 0),
+    }
+
+
+class PreforkSupervisor:
+    def __init__(self, target, workers=2, warm=True, respawn=True, warm_kwargs=None):
+        self.target = target
+        self.workers = workers
+        self.warm = warm
+        self.respawn = respawn
+        self.warm_kwargs = warm_kwargs or {}
+        self.warm_report = None
+        self.pids = {}
+        self._stopping = False
+
+    def _spawn(self, index):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                self.target(index)
+            except BaseException:
+                logger.exception('worker {} crashed'.format(index))
+                code = 1
+            finally:
+                os._exit(code)
+        self.pids[pid] = index
+        logger.info('worker {} started (pid {})'.format(index, pid))
+        return pid
+
+    def start(self):
+        if self.warm:
+            self.warm_report = warm_up(**self.warm_kwargs)
+            logger.info('warm up: {files} files in {seconds}s, {mb:.1f} MB cached'.format(
+                mb=self.warm_report['cache']['bytes'] / 2 ** 20, **self.warm_report))
+        # 之后的GC不再扫描（触碰）这些对象，避免子进程里的共享页被写脏
+        gc.collect()
+        gc.freeze()
+        for index in range(self.workers):
+            self._spawn(index)
+        return self
+
+    def memory_report(self):
+        """父进程与每个worker的内存，shared为与其他进程共享的页"""
+        return {
+            'supervisor': process_memory(os.getpid()),
+            'workers': {index: dict(pid=pid, **(process_memory(pid) or {})) for pid, index in self.pids.items()},
+        }
+
+    def stop(self, sig=signal.SIGTERM):
+        self._stopping = True
+        for pid in list(self.pids):
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def wait(self):
+        """等待所有worker退出；respawn=True时意外退出的worker会被重新fork"""
+        while self.pids:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            index = self.pids.pop(pid, None)
+            if index is None:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            if self._stopping or not self.respawn:
+                logger.info('worker {} exited ({})'.format(index, code))
+            else:
+                logger.warning('worker {} exited unexpectedly ({}), respawning'.format(index, code))
+                self._spawn(index)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='prefork streaming workers sharing a warmed sound cache')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765, help='worker i listens on port + i')
+    parser.add_argument('--threads', type=int, default=4, help='decode/mix threads per worker')
+    parser.add_argument('--no-warm', action='store_true')
+    parser.add_argument('--warm-profiles', nargs='*', default=[], help='quality profiles to warm besides the default')
+    parser.add_argument('--report-interval', type=int, default=0, help='log memory report every N seconds')
+    parser.add_argument('--sound-root', default=None, help='overrides config sound_folders_root')
+    args = parser.parse_args()
+    if args.sound_root:
+        cfg['sound_folders_root'] = args.sound_root
+
+    def serve(index):
+        import asyncio
+        from .serve import StreamServer
+        asyncio.run(StreamServer(args.host, args.port + index, max_workers=args.threads).serve_forever())
+
+    supervisor = PreforkSupervisor(serve, workers=args.workers, warm=not args.no_warm,
+                                   warm_kwargs={'profiles': [None] + args.warm_profiles}).start()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: supervisor.stop())
+    if args.report_interval > 0:
+        def report(*_):
+            logger.info('memory: {}'.format(supervisor.memory_report()))
+            signal.alarm(args.report_interval)
+        signal.signal(signal.SIGALRM, report)
+        signal.alarm(args.report_interval)
+    supervisor.wait()
+
+
+if __name__ == '__main__':
+    main()
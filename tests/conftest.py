@@ -0,0 +1,36 @@
+import random
+import pytest
+from hflow_sound_match.config import cfg
+from hflow_sound_match.benchmarks.library import generate_library
+
+
+@pytest.fixture(scope='session')
+def library(tmp_path_factory):
+    """小的合成音乐库（wav），整个测试会话共用"""
+    from hflow_sound_match.catalog import sound_catalog
+    root = str(tmp_path_factory.mktemp('library'))
+    generate_library(root, files_per_emotion=3, duration_s=(25, 35), env_files=1, env_duration_s=40, fmt='wav')
+    saved = {key: cfg.get(key) for key in ('sound_folders_root', 'library_file_formats', 'sound_meta_path')}
+    saved_formats = sound_catalog.file_formats
+    cfg.update({'sound_folders_root': root, 'library_file_formats': ['wav'],
+                'sound_meta_path': str(tmp_path_factory.mktemp('meta') / 'meta.json')})
+    sound_catalog.file_formats = ('wav',)
+    yield root
+    cfg.update(saved)
+    sound_catalog.file_formats = saved_formats
+
+
+@pytest.fixture
+def sim_clock():
+    """可手动推进的模拟时钟，[0]为当前时间"""
+    now = [1e6]
+    return now, lambda: now[0]
+
+
+def heart_rates(ticks, seed=0):
+    rng = random.Random(seed)
+    hr, out = 70.0, []
+    for _ in range(ticks):
+        hr = min(125.0, max(50.0, hr + rng.uniform(-8, 8)))
+        out.append(round(hr, 1))
+    return out
@@ -0,0 +1,37 @@
+import os
+import random
+from hflow_sound_match.cache import SoundCache, sound_cache
+
+
+class Sound:
+    def __init__(self, nbytes):
+        self.nbytes = nbytes
+
+
+def test_loaded_values_carry_their_key_after_eviction(tmp_path):
+    path = tmp_path / 'a.wav'
+    path.write_bytes(b'x')
+    cache = SoundCache(max_bytes=10)
+    first = cache.get_or_load(str(path), lambda: Sound(8), ('raw',))
+    cache.get_or_load(str(path), lambda: Sound(8), ('preprocess',))
+    assert cache.make_key(str(path), ('raw',)) not in cache
+    again = cache.get_or_load(str(path), lambda: Sound(8), ('raw',))
+    assert again is not first and again.cache_key == first.cache_key
+    # 文件被替换：新的加载结果有不同的key
+    os.utime(path, ns=(0, 0))
+    assert cache.get_or_load(str(path), lambda: Sound(8), ('raw',)).cache_key != first.cache_key
+
+
+def test_mix_key_is_stable_across_reloads(library, sim_clock):
+    from hflow_sound_match.match_v2 import RelaxMusicSessionV2
+    keys = []
+    for _ in range(2):
+        # 每次清空缓存，第二个session拿到的是重新加载的对象（id可能不同也可能被复用）
+        sound_cache.clear()
+        random.seed(0)
+        session = RelaxMusicSessionV2(mix_cache=True, clock=sim_clock[1])
+        session.match_and_generate(80)
+        keys.append(session.mix_key())
+    assert keys[0] is not None and keys[0] == keys[1]
+    files = (session.l0_file, session.l1_file, session.l2_file)
+    assert [layer[0][0] for layer in keys[0][-1]] == [os.path.abspath(f) for f in files]
@@ -0,0 +1,22 @@
+import pytest
+from hflow_sound_match.catalog import layer_file, parse_music_filename
+
+
+@pytest.mark.parametrize('file, expected', [
+    ('/lib/02 平静/00_61_平静_L1.mp3', '/lib/02 平静/00_61_平静_L2.mp3'),
+    ('/lib/02 平静/00_61_平静_L1.wav', '/lib/02 平静/00_61_平静_L2.wav'),
+    ('/lib/x_L1/03_90_a_L1.flac', '/lib/x_L1/03_90_a_L2.flac'),
+])
+def test_layer_file_keeps_extension(file, expected):
+    assert layer_file(file, 2) == expected
+    assert parse_music_filename(expected.rsplit('/', 1)[1]) == parse_music_filename(file.rsplit('/', 1)[1])[:1] + (2,)
+
+
+@pytest.mark.parametrize('module, cls', [('match', 'RelaxMusicSession'), ('match_v2', 'RelaxMusicSessionV2')])
+def test_l2_follows_l1_in_wav_library(library, sim_clock, module, cls):
+    import importlib
+    session = getattr(importlib.import_module('hflow_sound_match.' + module), cls)()
+    session.hr_memory.clock = sim_clock[1]
+    session.match_and_generate(80)
+    assert session.l1_file.endswith('_L1.wav')
+    assert session.l2_file == layer_file(session.l1_file, 2)
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from hflow_sound_match.compute import HeartRateLookup, get_index_of_closest_heart_rate
+
+
+def reference_closest(heart_rate, heart_rates):
+    """原始实现（逐次计算），查找表必须与它给出相同的结果"""
+    hrs = np.array(heart_rates, dtype=np.int32)
+    distances = heart_rate - hrs
+    min_distance = min(np.abs(distances))
+    if -min_distance in distances:
+        min_distance = -min_distance
+    (inds, ) = np.where(distances == min_distance)
+    return inds.tolist()
+
+
+def test_tie_prefers_larger_bpm():
+    assert get_index_of_closest_heart_rate(65, [60, 70]) == [1]
+    assert get_index_of_closest_heart_rate(65.0, [70, 60, 70]) == [0, 2]
+    assert HeartRateLookup([58, 62, 62]).closest_bpm(60) == 62
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_lookup_matches_reference(seed):
+    rng = np.random.default_rng(seed)
+    # 含重复bpm，心率含小数、整数和超出查表范围的值
+    bpms = rng.integers(50, 130, rng.integers(1, 12)).tolist()
+    heart_rates = np.concatenate([np.arange(10, 260), rng.uniform(30, 150, 200).round(1), [0.5, 300, 65.5]])
+    lookup = HeartRateLookup(bpms)
+    batch = lookup.lookup_batch(heart_rates)
+    for heart_rate, batched in zip(heart_rates, batch):
+        expected = reference_closest(heart_rate, bpms)
+        assert lookup.lookup(heart_rate) == expected
+        assert get_index_of_closest_heart_rate(heart_rate, bpms) == expected
+        assert batched == expected
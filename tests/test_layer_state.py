@@ -0,0 +1,62 @@
+import random
+import pytest
+from hflow_sound_match.match_v2 import LayerState, RelaxMusicSessionV2
+from .conftest import heart_rates
+
+
+def _states(session):
+    return [(s.start, s.end, s.next_start, s.next_end, s.next_fade_in, s.should_fade_in, s.segment_key,
+             s.larger_than_mean_hr) for s in (session.l0_state, session.l1_state, session.l2_state)]
+
+
+def _run(sim_clock, ticks=20, **kwargs):
+    now, clock = sim_clock
+    now[0] = 1e6
+    random.seed(0)
+    session = RelaxMusicSessionV2(clock=clock, **kwargs)
+    out = []
+    for heart_rate in heart_rates(ticks, seed=3):
+        segment = session.match_and_generate(heart_rate)
+        out.append((segment.raw_data, _states(session), session.l1_file, session.l2_file))
+        now[0] += 10
+    return out
+
+
+def test_layer_state_is_compact():
+    state = LayerState(should_fade_in=True)
+    assert not hasattr(state, '__dict__')
+    assert (state.start, state.end, state.next_start, state.segment_key) == (None, None, None, None)
+    assert state.should_fade_in and not state.next_fade_in and state.larger_than_mean_hr == 0
+    with pytest.raises(AttributeError):
+        state.next = None
+
+
+def test_loop_and_switch_transitions(library, sim_clock):
+    now, clock = sim_clock
+    random.seed(0)
+    session = RelaxMusicSessionV2(clock=clock)
+    transport_ms = 1000 * session.config['transport_time']
+    session.match_and_generate(80)
+    state = session.l1_state
+    assert (state.start, state.end, state.segment_key) == (0, transport_ms, (0, False, False))
+    # 一直播放到循环：当前片段淡出，下一个片段从头开始并淡入
+    for _ in range(10):
+        if state.next_start == 0:
+            break
+        session.l1_segment = session.simply_generate_next_sound_segment_and_update_state(1)
+    assert state.segment_key[2] and state.next_fade_in and state.next_end == transport_ms
+    session.simply_generate_next_sound_segment_and_update_state(1)
+    assert state.segment_key[:2] == (0, True) and state.start == state.end - transport_ms
+    # 切歌：新状态的第一个片段淡入
+    session.update_l1(100)
+    assert session.l1_state.should_fade_in
+    session.simply_generate_next_sound_segment_and_update_state(1)
+    assert session.l1_state.segment_key == (0, True, False) and not session.l1_state.should_fade_in
+
+
+@pytest.mark.parametrize('mix_backend', ['numpy', 'pydub'])
+def test_tiles_follow_the_same_state_transitions(library, sim_clock, mix_backend):
+    sliced = _run(sim_clock, mix_backend=mix_backend)
+    tiled = _run(sim_clock, mix_backend=mix_backend, tiles=True)
+    assert [i[1:] for i in tiled] == [i[1:] for i in sliced]
+    assert [i[0] for i in tiled] == [i[0] for i in sliced]
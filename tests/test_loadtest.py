@@ -0,0 +1,29 @@
+import copy
+from hflow_sound_match.benchmarks.loadtest import evaluate, format_report, run_loadtest
+
+LEVEL_KEYS = {'sessions', 'wall_seconds', 'segments', 'segments_per_second', 'audio_seconds_per_second', 'tick_ms',
+              'switches', 'switches_per_session_min', 'cpu_cores', 'rss_bytes', 'mode', 'speed', 'realtime_users',
+              'budget_ms', 'misses', 'miss_rate', 'slack_ms', 'decodes', 'failures'}
+
+
+def test_loadtest_smoke(library):
+    report = run_loadtest([1, 2], duration=1, speed=20, stop_on_failure=False)
+    assert set(report) == {'meta', 'levels', 'capacity'}
+    assert report['meta']['mode'] == 'inproc' and report['meta']['speed'] == 20
+    assert [level['sessions'] for level in report['levels']] == [1, 2]
+    for level in report['levels']:
+        assert set(level) == LEVEL_KEYS
+        assert level['segments'] > 0 and level['realtime_users'] == 20 * level['sessions']
+        assert level['budget_ms'] == 500 and {'p50', 'p95', 'p99'} <= set(level['tick_ms'])
+        assert isinstance(level['failures'], list)
+    if report['capacity'] is not None:
+        assert report['capacity']['sessions'] in (1, 2)
+    assert 'capacity:' in format_report(report)
+
+    level = copy.deepcopy(report['levels'][0])
+    level.update(miss_rate=0.0)
+    assert evaluate(level) == [] or level['tick_ms']['p99'] > level['budget_ms']
+    level['tick_ms']['p99'] = level['budget_ms'] + 1
+    assert [i.startswith('p99 tick') for i in evaluate(level)] == [True]
+    level.update(miss_rate=0.5, segments=0)
+    assert len(evaluate(level, max_miss_rate=0.01)) == 3
@@ -0,0 +1,52 @@
+import random
+import pytest
+from hflow_sound_match.memory import HeartMemory
+from hflow_sound_match.config import cfg
+
+
+@pytest.mark.parametrize('interval', [0.25, 0.5, 1.0, 10.0])
+def test_span_reaches_window_with_jitter(interval):
+    rng = random.Random(0)
+    memory = HeartMemory(60)
+    t = 0.0
+    for i in range(int(300 / interval)):
+        t += interval + rng.uniform(-0.01, 0.01)
+        memory.append(70 + i % 5, timestamp=t)
+        if t > 70:
+            # 窗口已填满：覆盖整个窗口，且只多保留窗口边缘外的一个样本
+            assert 60 <= memory.span < 60 + interval + 0.02
+
+
+def test_window_statistics_follow_eviction():
+    memory = HeartMemory(60)
+    for t, hr in enumerate([100] + [70] * 70):
+        memory.append(hr, timestamp=float(t))
+    assert memory.max_hr == 70 and memory.min_hr == 70
+    assert memory.span == 60
+
+
+def test_l2_rules_activate_with_jittered_ticks(library, sim_clock):
+    from hflow_sound_match.match_v2 import RelaxMusicSessionV2
+    now, clock = sim_clock
+    rng = random.Random(1)
+    session = RelaxMusicSessionV2(clock=clock)
+    active = 0
+    for tick in range(40):
+        session.match_and_generate(75)
+        now[0] += cfg['transport_time'] + rng.uniform(-0.01, 0.01)
+        active += session.l2_rule_inputs()[4]
+    # 第6个tick之后窗口已覆盖slide_window
+    assert active >= 40 - cfg['slide_window'] // cfg['transport_time'] - 1
+
+
+def test_l2_rules_activate_in_frame_mode(library, sim_clock):
+    from hflow_sound_match.frames import FrameSession
+    now, clock = sim_clock
+    session = FrameSession(frame_ms=200, clock=clock)
+    active = []
+    for frame in range(5 * 40):
+        session.match_and_generate(75)
+        now[0] += 0.2
+        active.append(session.l2_rule_inputs()[4])
+    # 每帧写入一次心率，窗口填满（slide_window秒）后规则一直生效
+    assert all(active[int(cfg['slide_window'] / 0.2) + 1:])
@@ -0,0 +1,57 @@
+import re
+from hflow_sound_match.metrics import Metrics, Histogram, _NULL_STAGE
+
+
+def test_disabled_metrics_record_nothing():
+    metrics = Metrics(enabled=False)
+    calls = []
+    metrics.add_callback(lambda *args: calls.append(args))
+    assert metrics.stage('decode') is _NULL_STAGE and metrics.stage('load') is _NULL_STAGE
+    with metrics.stage('decode'):
+        pass
+    metrics.observe('decode', 0.1)
+    metrics.inc('loop')
+    assert metrics.snapshot() == {'stages': {}, 'counters': {}} and not calls
+
+
+def test_buckets_are_cumulative_and_le_inclusive():
+    histogram = Histogram(buckets=(0.1, 0.5, 1.0))
+    for value in (0.05, 0.1, 0.3, 0.5, 2.0):
+        histogram.observe(value)
+    # le 是包含边界的：0.1 计入 le=0.1，0.5 计入 le=0.5
+    assert histogram.cumulative() == [(0.1, 2), (0.5, 4), (1.0, 4), ('+Inf', 5)]
+    assert histogram.count == 5 and abs(histogram.sum - 2.95) < 1e-9
+
+
+def test_enabled_metrics_record_and_call_back():
+    metrics = Metrics(enabled=True, buckets=(0.1, 1.0))
+    calls = []
+    metrics.add_callback(lambda *args: calls.append(args))
+    with metrics.stage('decode') as timer:
+        pass
+    assert timer is not _NULL_STAGE
+    metrics.observe('decode', 0.5)
+    metrics.inc('loop')
+    metrics.inc('loop', 2)
+    snapshot = metrics.snapshot()
+    assert snapshot['stages']['decode']['count'] == 2 and snapshot['counters'] == {'loop': 3}
+    assert [i[:2] for i in calls] == [('stage', 'decode')] * 2 + [('counter', 'loop')] * 2
+    assert calls[1][2] == 0.5 and calls[3][2] == 2
+
+
+def test_prometheus_export_has_one_type_line_per_family():
+    metrics = Metrics(enabled=True, buckets=(0.1, 1.0))
+    for name in ('decode', 'load', 'tick'):
+        metrics.observe(name, 0.05)
+    metrics.inc('loop')
+    metrics.inc('l1_switch')
+    text = metrics.export_prometheus()
+    types = re.findall(r'^# TYPE (\S+) ', text, flags=re.M)
+    assert len(types) == len(set(types))
+    assert 'hflow_stage_seconds' in types and 'hflow_events_total' in types
+    # 每个样本行都属于一个声明过的family
+    for line in text.splitlines():
+        if not line.startswith('#'):
+            name = re.match(r'[a-z_]+', line).group()
+            assert any(name == t or name in (t + '_bucket', t + '_sum', t + '_count') for t in types), line
+    assert 'hflow_stage_seconds_bucket{stage="decode",le="+Inf"} 1' in text
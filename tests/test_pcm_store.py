@@ -0,0 +1,88 @@
+import os
+import numpy as np
+import pytest
+from pydub import AudioSegment
+from hflow_sound_match import pcm_store
+from hflow_sound_match.pcm_store import (PCMSound, PCMStore, canonical_format, compile_library, conform, decode_file,
+                                         profile_format)
+
+
+def test_unknown_profile_raises_value_error():
+    with pytest.raises(ValueError):
+        profile_format('no-such-profile')
+    assert profile_format('low')['frame_rate'] == 16000
+
+
+def test_low_profile_is_converted_by_ffmpeg(tmp_path, monkeypatch):
+    sound_file = str(tmp_path / 'a.wav')
+    AudioSegment.silent(1000, frame_rate=44100).set_channels(2).export(sound_file, format='wav')
+    commands = []
+    run = pcm_store.subprocess.run
+    monkeypatch.setattr(pcm_store.subprocess, 'run', lambda cmd, **kwargs: commands.append(cmd) or run(cmd, **kwargs))
+    sound = decode_file(sound_file, profile_format('low'))
+    assert (sound.frame_rate, sound.channels, sound.sample_width, len(sound)) == (16000, 1, 2, 1000)
+    # -ar/-ac 是ffmpeg的输出参数（在 -i 之后、输出 - 之前）
+    cmd = commands[0]
+    assert cmd.index('-i') < cmd.index('-ar') < cmd.index('-') and cmd[cmd.index('-ac') + 1] == '1'
+
+
+def _write_library(root, seconds):
+    rng = np.random.default_rng(0)
+    for name, duration in seconds.items():
+        path = root / '02 平静' / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        samples = rng.integers(-8000, 8000, (int(duration * 22050), 1)).astype(np.int16)
+        AudioSegment(samples.tobytes(), sample_width=2, frame_rate=22050, channels=1).export(str(path), format='wav')
+    return str(root)
+
+
+def test_compile_library_is_incremental(library, tmp_path, monkeypatch):
+    root = _write_library(tmp_path / 'lib', {'00_60_P_L1.wav': 1.5, '00_60_P_L2.wav': 2.0})
+    store_root = str(tmp_path / 'store')
+    decoded = []
+    from_file = AudioSegment.from_file
+    monkeypatch.setattr(AudioSegment, 'from_file', lambda f, *a, **kw: decoded.append(f) or from_file(f, *a, **kw))
+    # file_formats默认取library_file_formats（测试库为wav）
+    l1, l2 = os.path.join('02 平静', '00_60_P_L1.wav'), os.path.join('02 平静', '00_60_P_L2.wav')
+    manifest = compile_library(root, store_root)
+    assert sorted(manifest['files']) == [l1, l2]
+    assert manifest['format'] == canonical_format() and len(decoded) == 2
+    # 22050Hz单声道转换成规范格式（重采样可能少一帧）
+    assert abs(manifest['files'][l1]['frames'] - 1.5 * 44100) <= 1
+    compile_library(root, store_root)
+    assert len(decoded) == 2
+    # 只重新编译变化过的文件
+    _write_library(tmp_path / 'lib', {'00_60_P_L2.wav': 2.5})
+    manifest = compile_library(root, store_root)
+    assert decoded[2:] == [os.path.join(root, '02 平静', '00_60_P_L2.wav')]
+    assert abs(manifest['files'][l2]['frames'] - 2.5 * 44100) <= 1
+
+
+def test_store_slices_match_decode(library, tmp_path):
+    root = _write_library(tmp_path / 'lib', {'00_60_P_L1.wav': 2.0})
+    compile_library(root, str(tmp_path / 'store'))
+    store = PCMStore(str(tmp_path / 'store'))
+    sound_file = os.path.join(root, '02 平静', '00_60_P_L1.wav')
+    sound = store.open(sound_file)
+    decoded = conform(AudioSegment.from_file(sound_file), store.format)
+    assert isinstance(sound.samples, np.memmap) and len(sound) == len(decoded) == 2000
+    for start, end in ((0, 2000), (250, 1250), (1990, 2000)):
+        assert sound[start:end].raw_data == decoded[start:end].raw_data
+    # 增益是惰性的：只在切片时乘上，与AudioSegment.apply_gain一致
+    gained = sound.apply_gain(-6.5)
+    assert gained.samples is sound.samples
+    assert gained[100:900].raw_data == decoded.apply_gain(-6.5)[100:900].raw_data
+    assert abs(gained.dBFS - (decoded.dBFS - 6.5)) < 0.05
+    # 源文件变化后store中的记录失效
+    os.utime(sound_file, ns=(0, 0))
+    assert store.open(sound_file) is None
+
+
+def test_conform_to_non_canonical_format():
+    samples = np.random.default_rng(1).integers(-8000, 8000, (44100, 2)).astype(np.int16)
+    sound = PCMSound(samples, 44100, 2)
+    fmt = {'frame_rate': 22050, 'channels': 1, 'sample_width': 2}
+    converted = conform(sound, fmt)
+    assert (converted.frame_rate, converted.channels, converted.sample_width, len(converted)) == (22050, 1, 2, 1000)
+    # 格式已一致时原样返回（保持memmap / 零拷贝）
+    assert conform(sound, {'frame_rate': 44100, 'channels': 2, 'sample_width': 2}) is sound
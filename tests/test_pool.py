@@ -0,0 +1,47 @@
+import random
+import pytest
+from hflow_sound_match.pool import SessionPool
+from .conftest import heart_rates
+
+
+def _run(sim_clock, batch, sessions=3, ticks=20, **kwargs):
+    now, clock = sim_clock
+    now[0] = 1e6
+    random.seed(0)
+    pool = SessionPool(clock=clock, **kwargs)
+    ids = [pool.create() for _ in range(sessions)]
+    traces = {sid: heart_rates(ticks, seed=i) for i, sid in enumerate(ids)}
+    out, l2_files = [], []
+    for tick in range(ticks):
+        hrs = {sid: traces[sid][tick] for sid in ids}
+        if batch:
+            segments = pool.match_and_generate_batch(hrs)
+        else:
+            segments = {sid: pool.tick(sid, hr) for sid, hr in hrs.items()}
+        out.append([segments[sid].raw_data for sid in ids])
+        l2_files.append([pool.get(sid).l2_file for sid in ids])
+        now[0] += 10
+    pool.retire_all()
+    return out, l2_files
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'mix_backend': 'pydub'}, {'tiles': True, 'mix_cache': True}])
+def test_batch_matches_sequential_ticks(library, sim_clock, kwargs):
+    sequential, sequential_l2 = _run(sim_clock, False, **kwargs)
+    batched, batched_l2 = _run(sim_clock, True, **kwargs)
+    assert batched_l2 == sequential_l2
+    # L2规则在这段心率中确实触发过切换
+    assert any(a != b for a, b in zip(sequential_l2, sequential_l2[1:]))
+    assert batched == sequential
+
+
+def test_batch_matches_candidates_in_one_query(library, sim_clock, monkeypatch):
+    from hflow_sound_match.catalog import sound_catalog
+    single, batched = [], []
+    closest_files, closest_files_batch = sound_catalog.closest_files, sound_catalog.closest_files_batch
+    monkeypatch.setattr(sound_catalog, 'closest_files', lambda *a: single.append(a) or closest_files(*a))
+    monkeypatch.setattr(sound_catalog, 'closest_files_batch', lambda *a: batched.append(a) or closest_files_batch(*a))
+    out, l2_files = _run(sim_clock, True)
+    # 每个tick每层一次向量化查询，session不再逐个查索引
+    assert not single and len(batched) == 2 * len(out)
+    assert (out, l2_files) == _run(sim_clock, False)
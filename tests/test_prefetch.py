@@ -0,0 +1,22 @@
+from concurrent.futures import ThreadPoolExecutor
+from hflow_sound_match.prefetch import Prefetcher
+
+
+def test_hit_rate_counts_wasted_prefetches():
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        prefetcher = Prefetcher(lambda file: file.upper(), executor=executor)
+        prefetcher.request(1, 'a')
+        prefetcher._pending[1][1].result()
+        assert prefetcher.take(1, ['a', 'b']) == ('a', 'A')
+        # 切换时心率已变化，预取的文件不在候选中
+        prefetcher.request(2, 'c')
+        assert prefetcher.take(2, ['d']) == (None, None)
+        # 被同一层的新预取替换
+        prefetcher.request(1, 'e')
+        prefetcher.request(1, 'f')
+        prefetcher._pending[1][1].result()
+        stats = prefetcher.stats()
+    assert (stats['requested'], stats['hits'], stats['wasted'], stats['pending']) == (4, 1, 2, 1)
+    assert stats['hit_rate'] == 0.25
+    assert stats['used_hit_rate'] == 1.0
+    assert stats['wasted_rate'] == 0.5
@@ -0,0 +1,34 @@
+import hashlib
+import multiprocessing
+import numpy as np
+from hflow_sound_match.render import iter_ticks, render_many
+
+
+def test_samples_after_last_tick_get_a_final_tick():
+    timestamps = np.array([0.0, 4.0, 10.0, 12.0, 23.5])
+    heart_rates = np.array([70.0, 71.0, 72.0, 73.0, 74.0])
+    ticks = list(iter_ticks(timestamps, heart_rates, 10))
+    assert [t for t, _ in ticks] == [0.0, 10.0, 20.0, 30.0]
+    assert sum(len(samples) for _, samples in ticks) == len(timestamps)
+    assert ticks[-1][1] == [(23.5, 74.0)]
+    # 轨迹正好结束在tick边界上时不补tick
+    assert len(list(iter_ticks(timestamps[:3], heart_rates[:3], 10))) == 2
+
+
+def test_render_is_deterministic_across_processes(library, tmp_path):
+    rng = np.random.default_rng(0)
+    timestamps = np.arange(0, 47, 1.5)
+    trace = (timestamps, 75 + np.cumsum(rng.uniform(-3, 3, len(timestamps))))
+
+    def jobs(folder):
+        return [{'trace': trace, 'out_path': str(tmp_path / '{}-{}.wav'.format(folder, seed)), 'seed': seed}
+                for seed in (1, 2)]
+
+    serial = render_many(jobs('serial'), processes=1)
+    # spawn：子进程不继承测试里修改过的配置，必须由render_many传过去
+    parallel = render_many(jobs('spawn'), processes=2, mp_context=multiprocessing.get_context('spawn'))
+    for a, b in zip(serial, parallel):
+        # 31个样本跨越45秒：5个tick + 最后补的1个tick
+        assert a['ticks'] == b['ticks'] == 6 and a['audio_s'] == b['audio_s'] == 60
+        digests = [hashlib.md5(open(i['out'], 'rb').read()).hexdigest() for i in (a, b)]
+        assert digests[0] == digests[1]
@@ -0,0 +1,85 @@
+import time
+from hflow_sound_match.scheduler import TickScheduler
+
+
+class FakeSession:
+    """每次tick在模拟时钟上花费cost秒，返回length_ms长的片段"""
+
+    def __init__(self, now, cost=0.1, length_ms=10000, fail=False):
+        self.now = now
+        self.cost = cost
+        self.length_ms = length_ms
+        self.fail = fail
+
+    def match_and_generate(self):
+        self.now[0] += self.cost
+        if self.fail:
+            raise RuntimeError('decode failed')
+        return b'\0' * self.length_ms
+
+
+def _scheduler(sim_clock, **sessions):
+    """sessions: {session_id: (session, start相对现在的秒数)}"""
+    now, clock = sim_clock
+    scheduler = TickScheduler(workers=1, lead_ms=2000, clock=clock)
+    delivered = []
+    for session_id, (session, start) in sessions.items():
+        scheduler.add(session_id, session, on_segment=lambda *args: delivered.append(args[0]), start=now[0] + start)
+    return scheduler, delivered
+
+
+def _step(scheduler):
+    """在当前线程执行下一个tick（不启动工作线程）"""
+    scheduler._running = True
+    scheduler._tick(*scheduler._next())
+
+
+def test_ticks_run_earliest_deadline_first(sim_clock):
+    now, _ = sim_clock
+    start = now[0]
+    scheduler, delivered = _scheduler(sim_clock, a=(FakeSession(now), 1.5), b=(FakeSession(now, length_ms=5000), 0.5))
+    for _ in range(2):
+        _step(scheduler)
+    assert delivered == ['b', 'a']
+    # 截止时间按片段时长前进
+    assert scheduler._entries['b'].deadline == start + 0.5 + 5
+    assert scheduler._entries['a'].deadline == start + 1.5 + 10
+    # b的下一个截止时间也更早，但还没到生成时间（截止时间前lead_ms）
+    now[0] = start + 0.5 + 5 - 2
+    _step(scheduler)
+    assert delivered == ['b', 'a', 'b']
+    report = scheduler.report()
+    assert (report['ticks'], report['misses'], report['errors']) == (3, 0, 0)
+
+
+def test_missed_deadline_restarts_from_delivery(sim_clock):
+    now, _ = sim_clock
+    start = now[0]
+    scheduler, _ = _scheduler(sim_clock, slow=(FakeSession(now, cost=1.5), 1))
+    _step(scheduler)
+    entry = scheduler._entries['slow']
+    assert (entry.ticks, entry.misses) == (1, 1)
+    assert abs(entry.slack_last + 0.5) < 1e-6
+    # 播放端在片段交付之后才继续播放：下一个截止时间从交付时刻算起
+    assert entry.deadline == start + 1.5 + 10
+    entry.session.cost = 0.1
+    now[0] = entry.deadline - 2
+    _step(scheduler)
+    assert (entry.ticks, entry.misses) == (2, 1)
+    assert scheduler.report()['per_session']['slow']['misses'] == 1
+
+
+def test_failing_session_is_removed(sim_clock):
+    now, _ = sim_clock
+    scheduler, delivered = _scheduler(sim_clock, ok=(FakeSession(now), 1), bad=(FakeSession(now, fail=True), 0.5))
+    scheduler.start()
+    try:
+        for _ in range(200):
+            if delivered and scheduler.errors:
+                break
+            time.sleep(0.01)
+    finally:
+        scheduler.stop()
+    assert delivered == ['ok'] and scheduler.errors == 1
+    assert 'bad' not in scheduler._entries and len(scheduler) == 1
+    assert scheduler.remove('bad') is None and scheduler.remove('ok')['ticks'] == 1
@@ -0,0 +1,121 @@
+import json
+import asyncio
+from hflow_sound_match.serve import StreamServer
+from hflow_sound_match.benchmarks.loadtest import _request
+
+
+async def _start(**kwargs):
+    server = StreamServer('127.0.0.1', 0, max_workers=2, **kwargs)
+    await server.start()
+    return server, server.server.sockets[0].getsockname()[1]
+
+
+def test_heart_rates_during_tick_are_applied_after_it(library):
+    async def main():
+        server, port = await _start()
+        try:
+            _, body = await _request(port, 'POST', '/sessions')
+            handle = server.handles[json.loads(body)['session_id']]
+            session = server.pool.get(handle.session_id)
+            await server.push_heart_rates(handle, b'75')
+            tick = server.start_tick(handle, session)
+            # tick进行中：不等待，先暂存
+            await server.push_heart_rates(handle, b'[80, 81]')
+            assert session.hr_memory.latest == 75 and len(handle.pending) == 2
+            assert len(await tick) == 10000
+            assert session.hr_memory.latest == 81 and len(session.hr_memory) == 3
+            assert handle.tick is None and not handle.pending
+        finally:
+            await server.shutdown()
+    asyncio.run(main())
+
+
+def test_stream_ends_cleanly_when_session_is_deleted(library):
+    async def main():
+        server, port = await _start(lead_ms=0)
+        try:
+            _, body = await _request(port, 'POST', '/sessions')
+            session_id = json.loads(body)['session_id']
+            assert (await _request(port, 'POST', '/sessions/{}/hr'.format(session_id), b'75'))[0] == 200
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write('GET /sessions/{}/stream?fmt=pcm HTTP/1.1\r\n\r\n'.format(session_id).encode('latin-1'))
+            assert (await reader.readline()).startswith(b'HTTP/1.1 200')
+            await reader.readuntil(b'\r\n\r\n')
+            await reader.readuntil(b'\r\n')
+            assert (await _request(port, 'DELETE', '/sessions/{}'.format(session_id)))[0] == 200
+            rest = await asyncio.wait_for(reader.read(), 30)
+            writer.close()
+            # 生成端正常结束，流以chunked的结束块收尾（而不是连接被异常关闭）
+            assert rest.endswith(b'0\r\n\r\n')
+            assert session_id not in server.pool
+        finally:
+            await server.shutdown()
+    asyncio.run(main())
+
+
+def test_unknown_emotion_is_rejected(library):
+    async def main():
+        server, port = await _start()
+        try:
+            status, body = await _request(port, 'POST', '/sessions?emotion=X')
+            assert status == 400 and json.loads(body)['error'] == 'unknown emotion'
+            assert not server.handles and len(server.pool) == 0
+        finally:
+            await server.shutdown()
+    asyncio.run(main())
+
+
+def test_producer_error_after_headers_closes_stream(library):
+    async def main():
+        server, port = await _start(lead_ms=0)
+        try:
+            _, body = await _request(port, 'POST', '/sessions')
+            session_id = json.loads(body)['session_id']
+            session = server.pool.get(session_id)
+            generate = session.match_and_generate
+            ticks = []
+
+            def failing(*args, **kwargs):
+                ticks.append(1)
+                if len(ticks) > 1:
+                    raise RuntimeError('decode failed')
+                return generate(*args, **kwargs)
+            session.match_and_generate = failing
+            await _request(port, 'POST', '/sessions/{}/hr'.format(session_id), b'75')
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write('GET /sessions/{}/stream?fmt=pcm HTTP/1.1\r\n\r\n'.format(session_id).encode('latin-1'))
+            assert (await reader.readline()).startswith(b'HTTP/1.1 200')
+            rest = await asyncio.wait_for(reader.read(), 30)
+            writer.close()
+            # 响应头已发出：不会在body里再写一个500响应，也不写结束块（客户端能看出流被截断）
+            assert b'HTTP/1.1 500' not in rest
+            assert not rest.endswith(b'0\r\n\r\n')
+            assert not server.handles[session_id].streaming
+        finally:
+            await server.shutdown()
+    asyncio.run(main())
+
+
+def test_idle_session_is_retired_after_stream_hangup(library):
+    async def main():
+        server, port = await _start(lead_ms=0, max_sessions=1, idle_timeout_s=0.5)
+        try:
+            _, body = await _request(port, 'POST', '/sessions')
+            session_id = json.loads(body)['session_id']
+            await _request(port, 'POST', '/sessions/{}/hr'.format(session_id), b'75')
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write('GET /sessions/{}/stream?fmt=pcm HTTP/1.1\r\n\r\n'.format(session_id).encode('latin-1'))
+            assert (await reader.readline()).startswith(b'HTTP/1.1 200')
+            await reader.readuntil(b'\r\n\r\n')
+            # 客户端断开且不DELETE
+            writer.close()
+            for _ in range(100):
+                if session_id not in server.handles and session_id not in server.pool:
+                    break
+                await asyncio.sleep(0.05)
+            assert session_id not in server.handles and session_id not in server.pool
+            # 名额被释放
+            assert (await _request(port, 'POST', '/sessions'))[0] == 201
+        finally:
+            await server.shutdown()
+    asyncio.run(main())
@@ -0,0 +1,61 @@
+import os
+import json
+from pydub import AudioSegment
+from hflow_sound_match.sound_meta import SoundMetaIndex
+
+
+def _write_sound(path, duration_ms):
+    AudioSegment.silent(duration_ms).export(str(path), format='wav')
+    return AudioSegment.from_file(str(path))
+
+
+def test_record_stays_in_memory_until_save(tmp_path):
+    path = tmp_path / 'meta.json'
+    sound = _write_sound(tmp_path / 'a.wav', 500)
+    index = SoundMetaIndex(path=str(path), sound_root=str(tmp_path))
+    index.record(str(tmp_path / 'a.wav'), sound)
+    assert not path.exists()
+    index.save()
+    assert set(json.loads(path.read_text())['files']) == {'a.wav'}
+
+
+def test_save_merges_entries_of_other_writers(tmp_path):
+    path = str(tmp_path / 'meta.json')
+    a = _write_sound(tmp_path / 'a.wav', 500)
+    b = _write_sound(tmp_path / 'b.wav', 700)
+    # 两个进程各自读取了（空的）manifest
+    first = SoundMetaIndex(path=path, sound_root=str(tmp_path))
+    second = SoundMetaIndex(path=path, sound_root=str(tmp_path))
+    first.record(str(tmp_path / 'a.wav'), a)
+    second.record(str(tmp_path / 'b.wav'), b)
+    first.save()
+    second.save()
+    files = json.load(open(path))['files']
+    assert set(files) == {'a.wav', 'b.wav'}
+    assert files['b.wav']['duration_ms'] == 700
+    # 合并写入后second也能看到first的记录
+    assert second.get(str(tmp_path / 'a.wav'))['duration_ms'] == 500
+
+
+def test_metadata_comes_from_the_source_decode(tmp_path):
+    from hflow_sound_match.config import cfg
+    from hflow_sound_match.pcm_store import open_sound
+    from hflow_sound_match.sound_meta import sound_meta
+    sound_file = str(tmp_path / 'a.wav')
+    AudioSegment.silent(1500, frame_rate=48000).set_channels(2).export(sound_file, format='wav')
+    saved = cfg.get('sample_format')
+    cfg['sample_format'] = {'frame_rate': 22050, 'channels': 1, 'sample_width': 2}
+    try:
+        # 低档位由ffmpeg直接转换，不是源格式，不记录
+        assert open_sound(sound_file, 'low').frame_rate == 16000
+        assert sound_meta.get(sound_file) is None
+        sound = open_sound(sound_file)
+        assert (sound.frame_rate, sound.channels) == (22050, 1)
+        entry = sound_meta.get(sound_file)
+        assert (entry['frame_rate'], entry['channels'], entry['duration_ms']) == (48000, 2, 1500)
+        # 未记录时只扫描，不把转换后的音频写入元数据
+        os.utime(sound_file, ns=(0, 0))
+        sound_meta.dBFS(sound_file, sound)
+        assert sound_meta.get(sound_file) is None
+    finally:
+        cfg['sample_format'] = saved
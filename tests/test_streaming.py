@@ -0,0 +1,68 @@
+import io
+import wave
+import struct
+import audioop
+import numpy as np
+import pytest
+from pydub import AudioSegment
+from hflow_sound_match.config import cfg
+from hflow_sound_match.pcm_store import DEFAULT_FORMAT, profile_format
+from hflow_sound_match.streaming import stream_session
+
+PROFILES = [None] + sorted(cfg.get('quality_profiles', {}))
+
+
+class ToneSession:
+    """每个心率返回一秒的正弦波"""
+
+    def __init__(self, fmt):
+        t = np.arange(fmt['frame_rate']) / fmt['frame_rate']
+        tone = np.sin(2 * np.pi * 440 * t) * 0.5 * 2 ** (8 * fmt['sample_width'] - 1)
+        samples = np.repeat(tone[:, None], fmt['channels'], axis=1).astype('<i{}'.format(fmt['sample_width']))
+        self.segment = AudioSegment(samples.tobytes(), frame_rate=fmt['frame_rate'], channels=fmt['channels'],
+                                    sample_width=fmt['sample_width'])
+
+    def match_and_generate(self, heart_rate):
+        return self.segment
+
+
+def _format(profile, sample_width=None):
+    fmt = dict(profile_format(profile) or DEFAULT_FORMAT)
+    if sample_width is not None:
+        fmt['sample_width'] = sample_width
+    return fmt
+
+
+def test_pcm_stream_is_raw_data():
+    session = ToneSession(_format(None))
+    data = b''.join(stream_session(session, [70, 71, 72], fmt='pcm', chunk_ms=300))
+    assert data == session.segment.raw_data * 3
+
+
+@pytest.mark.parametrize('sample_width', [1, 2])
+def test_wav_stream_header_and_length(sample_width):
+    fmt = _format('low', sample_width)
+    session = ToneSession(fmt)
+    data = b''.join(stream_session(session, [70, 71], fmt='wav'))
+    riff, _, wave_id, fmt_id, _, codec, channels, frame_rate, byte_rate, block_align, bits = \
+        struct.unpack('<4sI4s4sIHHIIHH', data[:36])
+    assert (riff, wave_id, fmt_id, codec) == (b'RIFF', b'WAVE', b'fmt ', 1)
+    assert (channels, frame_rate, bits) == (fmt['channels'], fmt['frame_rate'], 8 * sample_width)
+    assert block_align == channels * sample_width and byte_rate == frame_rate * block_align
+    assert data[36:40] == b'data' and len(data) == 44 + 2 * len(session.segment.raw_data)
+    with wave.open(io.BytesIO(data)) as f:
+        frames = f.readframes(2 * fmt['frame_rate'])
+    # 8位WAV是无符号的
+    expected = session.segment.raw_data if sample_width > 1 else audioop.bias(session.segment.raw_data, 1, 128)
+    assert frames == expected * 2
+
+
+@pytest.mark.parametrize('stream_format', ['mp3', 'opus'])
+@pytest.mark.parametrize('profile, sample_width', [(p, None) for p in PROFILES] + [('low', 1)])
+def test_ffmpeg_stream_is_decodable(profile, sample_width, stream_format):
+    session = ToneSession(_format(profile, sample_width))
+    data = b''.join(stream_session(session, [70, 71, 72], fmt=stream_format, chunk_ms=200))
+    decoded = AudioSegment.from_file(io.BytesIO(data), format='ogg' if stream_format == 'opus' else 'mp3')
+    assert abs(len(decoded) - 3000) < 100
+    # 8位输入按有符号解释（s8），否则正弦波会变成直流偏移很大的噪声
+    assert abs(decoded.dBFS - session.segment.dBFS) < 1.5
@@ -0,0 +1,44 @@
+import numpy as np
+from pydub import AudioSegment
+from hflow_sound_match.mixer import ArraySound
+from hflow_sound_match.tiles import SoundTiles
+
+
+def _tone(seconds):
+    t = np.arange(int(seconds * 44100)) / 44100
+    wave = (8000 * np.sin(2 * np.pi * 220 * t)).astype(np.int16)
+    return AudioSegment(np.repeat(wave[:, None], 2, axis=1).tobytes(), frame_rate=44100, sample_width=2, channels=2)
+
+
+def _sliced(sound, index, fade_in, fade_out):
+    segment = sound[index * 10000:(index + 1) * 10000]
+    if fade_in:
+        segment = segment.fade_in(3000)
+    if fade_out:
+        segment = segment.fade_out(3000)
+    return segment
+
+
+def test_tiles_equal_sliced_segments():
+    sound = _tone(35)
+    for source in (sound, ArraySound(sound)):
+        tiles = SoundTiles(source, 10000, 3000)
+        assert len(tiles) == 3 and tiles.loop_indexes() == [2]
+        for key in [(0, False, False), (1, False, False), (2, False, False),
+                    (0, True, False), (2, False, True), (0, True, True)]:
+            tile, expected = tiles.get(*key), _sliced(source, *key)
+            if isinstance(source, ArraySound):
+                tile, expected = tile.to_audio_segment(), expected.to_audio_segment()
+            assert tile.raw_data == expected.raw_data
+
+
+def test_plain_tiles_do_not_copy_the_sound():
+    sound = _tone(35)
+    pydub_tiles = SoundTiles(sound, 10000, 3000)
+    # 只缓存带淡入淡出的tile：fade_in[0]、fade_out[2]、loop_wrap
+    assert sorted(pydub_tiles._tiles) == [(0, True, False), (0, True, True), (2, False, True)]
+    assert pydub_tiles.nbytes < 4 * len(pydub_tiles.get(0).raw_data)
+    numpy_tiles = SoundTiles(ArraySound(sound), 10000, 3000)
+    assert np.shares_memory(numpy_tiles.get(1).samples, numpy_tiles.sound.samples)
+    faded = sum(tile.samples.nbytes for key, tile in numpy_tiles._tiles.items() if key[1] or key[2])
+    assert numpy_tiles.nbytes - faded < 10000
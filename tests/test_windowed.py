@@ -0,0 +1,55 @@
+import os
+import numpy as np
+import pytest
+from pydub import AudioSegment
+from hflow_sound_match.config import cfg
+from hflow_sound_match.cache import sound_cache
+from hflow_sound_match.catalog import sound_catalog
+from hflow_sound_match.pcm_store import ffmpeg_decode, open_sound
+from hflow_sound_match.windowed import open_windowed, read_wav_window
+
+
+def _samples(sound):
+    return np.frombuffer(sound.raw_data, np.int16).reshape(-1, sound.channels)
+
+
+def _tone(path, seconds, fmt):
+    t = np.arange(int(seconds * 44100)) / 44100
+    wave = (8000 * np.sin(2 * np.pi * 220 * t) * (1 + np.sin(2 * np.pi * 0.3 * t)) / 2).astype(np.int16)
+    sound = AudioSegment(np.repeat(wave[:, None], 2, axis=1).tobytes(), frame_rate=44100, sample_width=2, channels=2)
+    sound.export(str(path), format=fmt)
+    return str(path)
+
+
+@pytest.mark.parametrize('fmt', ['wav', 'mp3'])
+def test_window_matches_full_decode(tmp_path, fmt):
+    sound_file = _tone(tmp_path / 'tone.{}'.format(fmt), 30, fmt)
+    full = _samples(AudioSegment.from_file(sound_file))
+    source = {'frame_rate': 44100, 'channels': 2, 'sample_width': 2}
+    for start in (0.0, 7.5, 21.0):
+        window = _samples(ffmpeg_decode(sound_file, source, start, 5.0))
+        begin = int(round(start * 44100))
+        assert len(window) == 5 * 44100
+        # 输入端定位（-ss在-i之前）加预解码，逐样本相同
+        assert np.array_equal(window, full[begin:begin + len(window)])
+    assert (read_wav_window(sound_file, 7.5, 5.0) is None) == (fmt != 'wav')
+
+
+def test_windowed_sound_is_shared_per_file_and_format(library, monkeypatch):
+    monkeypatch.setitem(cfg, 'windowed_decode_min_s', 20)
+    monkeypatch.setitem(cfg, 'windowed_block_s', 5)
+    folder = os.path.join(library, sorted(os.listdir(library))[1])
+    sound_file = sound_catalog.list_files(folder)[0][0]
+    # 完整解码一次，记录元数据（时长、响度、源格式）之后才能按窗口解码
+    full = open_sound(sound_file)
+    first = open_windowed(sound_file)
+    assert first is not None and open_windowed(sound_file) is first
+    assert open_windowed(sound_file, 'low') is not first
+    samples = first.samples
+    for start_ms in range(0, len(full) - 10000, 2500):
+        assert first[start_ms:start_ms + 10000].raw_data == full[start_ms:start_ms + 10000].raw_data
+    decodes = samples.decodes
+    # 已解码的块在sound_cache中，其他session读同一段不再解码
+    first[12000:22000]
+    assert samples.decodes == decodes
+    sound_cache.clear()
@@ -0,0 +1,30 @@
+import random
+from hflow_sound_match import pcm_store
+from hflow_sound_match.cache import sound_cache
+from hflow_sound_match.workers import PreforkSupervisor, process_memory, warm_up
+
+
+def test_warm_up_leaves_nothing_to_decode_for_a_new_session(library, sim_clock, monkeypatch):
+    from hflow_sound_match.match_v2 import RelaxMusicSessionV2
+    sound_cache.clear()
+    report = warm_up()
+    assert report['files'] > 0 and report['cache']['items'] == report['files']
+    assert report['cache']['evictions'] == 0
+    decodes = []
+    decode_file = pcm_store.decode_file
+    monkeypatch.setattr(pcm_store, 'decode_file', lambda *args: decodes.append(args) or decode_file(*args))
+    random.seed(0)
+    session = RelaxMusicSessionV2(clock=sim_clock[1])
+    assert len(session.match_and_generate(80)) == 10000
+    assert decodes == []
+
+
+def test_process_memory_without_smaps_rollup():
+    # 不存在的进程（或不支持smaps_rollup的内核）
+    assert process_memory(-1) is None
+    supervisor = PreforkSupervisor(lambda index: None, workers=0)
+    supervisor.pids = {-1: 0}
+    assert supervisor.memory_report()['workers'] == {0: {'pid': -1}}
+    memory = process_memory()
+    if memory is not None:
+        assert memory['rss_bytes'] > 0 and memory['rss_bytes'] >= memory['private_bytes']